@@ -8,10 +8,11 @@ class Annotation(ApiBase):
         super().__init__(session)
         self.single_resource_path = self.base_url + '/annotation/{}'
         self.list_resources_path = self.base_url + '/task/{}/annotation/'.format(task_id)
+        self.batch_path = self.base_url + '/task/{}/annotation/batch/'.format(task_id)
         self.schema = 'annotation.schema.json'
 
     def batch_create(self, annotations, labels=None, doc_anno_lookup=None, group_annotation_lookup=None):
-        created_annotations = []
+        payloads = []
         for anno in annotations:
             payload = {}
             anno_labels = anno.get('labels', None)
@@ -44,6 +45,15 @@ class Annotation(ApiBase):
             if group_annotation_lookup and group_annotation_lookup.get(anno['identifier'], None):
                 payload['annotation_group'] = group_annotation_lookup[anno['identifier']]
 
-            created_annotations.append(self.create(payload))
+            payloads.append(payload)
 
-        return created_annotations
+        return self.create_many(payloads)
+
+    def create_many(self, payloads):
+        """
+        Create a list of annotations in the task with a single request.
+        """
+        for payload in payloads:
+            self.validate_data(payload)
+        response = self.session.post(self.batch_path, json=payloads)
+        return self.process_response(response)
@@ -1,3 +1,6 @@
+import gzip
+import json
+import tempfile
 from api_base import ApiBase
 
 class Document(ApiBase):
@@ -9,8 +12,46 @@ class Document(ApiBase):
         self.single_resource_path = self.base_url + '/document/{}'
         self.list_resources_path = self.base_url + '/corpus/{}/document/'.format(corpus_id)
         self.batch_path = self.base_url + '/corpus/{}/document/batch/'.format(corpus_id)
+        self.stream_path = self.base_url + '/corpus/{}/document/stream/'.format(corpus_id)
         self.schema = 'document.schema.json'
 
-    def batch_create(self, documents):
-        response = self.session.post(self.batch_path, json=documents)
+    def batch_create(self, documents, on_duplicate=None):
+        params = {'on_duplicate': on_duplicate} if on_duplicate else {}
+        response = self.session.post(self.batch_path, json=documents, params=params)
         return self.process_response(response)
+
+    def stream_create(self, documents, chunk_size=None, on_duplicate=None):
+        """
+        Upload any number of documents as gzipped NDJSON and return the created documents with their ids.
+        The body is spooled to a temporary file so that memory stays flat for large corpora.
+        Duplicates of documents in the corpus are created by default, on_duplicate may be 'error' to reject them
+        or 'skip' or 'update' to make re-imports of overlapping dumps idempotent.
+        """
+        params = {}
+        if chunk_size:
+            params['chunk_size'] = chunk_size
+        if on_duplicate:
+            params['on_duplicate'] = on_duplicate
+        headers = {'Content-Type': 'application/x-ndjson', 'Content-Encoding': 'gzip'}
+        with tempfile.TemporaryFile() as body:
+            with gzip.GzipFile(fileobj=body, mode='wb') as compressed:
+                for document in documents:
+                    compressed.write((json.dumps(document) + '\n').encode('utf-8'))
+            body.seek(0)
+            response = self.session.post(self.stream_path, data=body, headers=headers, params=params, stream=True)
+            self.raise_for_errors(response)
+
+        results = {}
+        for line in response.iter_lines():
+            if line:
+                result = json.loads(line)
+                results[result['line']] = result
+
+        created_documents = []
+        for line_number, document in enumerate(documents, start=1):
+            result = results.get(line_number, {})
+            if 'errors' in result:
+                raise ValueError('Document on line {} could not be created: {}'.format(line_number, result['errors']))
+            created_documents.append({**document, 'id': result.get('id', None)})
+
+        return created_documents
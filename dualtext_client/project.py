@@ -1,13 +1,13 @@
 from api_base import ApiBase
 from annotation import Annotation
-from corpus import Corpus
 from document import Document
 from label import Label
 from task import Task
 from search import Search
-from annotation_group import AnnotationGroup
+import gzip
+import json
+import tempfile
 import math
-from collections import defaultdict
 
 class Project(ApiBase):
     """
@@ -17,87 +17,39 @@ class Project(ApiBase):
         super().__init__(session)
         self.single_resource_path = self.base_url + '/project/{}'
         self.list_resources_path = self.base_url + '/project/'
+        self.import_path = self.base_url + '/project/import/'
         self.schema = 'project.schema.json'
 
     def create_from_scratch(self, data, task_size):
+        """
+        Create the corpus, documents, labels, tasks, annotation groups and annotations of a project on the server
+        in a single request. Returns the created project, the id mapping is available under 'import'.
+        The data is sent as gzipped NDJSON records, spooled to a temporary file so that memory stays flat.
+        """
         # self.validate_data(data, 'project_from_scratch.schema.json')
-        corpus = Corpus(self.session)
-        created_corpus = corpus.create(data['corpus'])
-
-        project_data = data['project']
-        project_data['corpora'] = [ created_corpus['id'] ]
-        project = self.create(project_data)
-
-        labels = data.get('labels', None)
-        if labels is not None:
-            labels = self.create_labels(labels, project['id'])
-        documents = data.get('documents', None)
-        created_documents = None
-        if documents is not None:
-            created_documents = self.create_documents(documents, created_corpus['id'])
-
-        groups = data.get('annotation_groups', None)
-        if groups:
-            groups = self.split_list(groups, task_size)
-            for idx, chunk in enumerate(groups):
-                annotation_ids = set()
-                for group in chunk:
-                    if group.get('annotation_ids', None):
-                        annotation_ids.update(group['annotation_ids'])
-                annotations = [anno for anno in data['annotations'] if anno['identifier'] in annotation_ids]
-                self.create_project_task(annotations, project['id'], idx, labels, created_documents, chunk)
-        else:
-            annotations = self.split_list(data['annotations'], task_size)
-            for idx, chunk in enumerate(annotations):
-                self.create_project_task(chunk, project['id'], idx, labels, created_documents)
+        with tempfile.TemporaryFile() as body:
+            with gzip.GzipFile(fileobj=body, mode='wb') as compressed:
+                for record in self.import_records(data):
+                    compressed.write((json.dumps(record) + '\n').encode('utf-8'))
+            body.seek(0)
+            response = self.session.post(
+                self.import_path,
+                files={'file': ('project.ndjson.gz', body, 'application/gzip')},
+                params={'task_size': task_size},
+                # let requests set the multipart content type instead of the session's json default
+                headers={'Content-Type': None}
+            )
+        mapping = self.process_response(response)
+        project = self.get(mapping['project'])
+        project['import'] = mapping
 
         return project
 
-    def create_documents(self, documents, corpus_id):
-        document_instance = Document(self.session, corpus_id)
-        document_chunks = self.split_list(documents, 200)
-        created_documents = []
-        for chunk in document_chunks:
-            docs = document_instance.batch_create(chunk)
-            created_documents.extend(docs)
-
-        return created_documents
-
-    def split_list(self, lst, chunk_size):
-        return [lst[i * chunk_size:(i + 1) * chunk_size] for i in range((len(lst) + chunk_size - 1) // chunk_size )]
-
-    def create_project_task(self, annotations, project_id, task_idx=None, labels=None, documents=None, groups=None):
-        task_instance = Task(self.session, project_id)
-        task = task_instance.create({'name': 'P{}T{}'.format(project_id, task_idx)})
-        annotation_group_lookup = None
-        if groups is not None:
-            annotation_group_lookup = self.create_groups(task, groups)
-        return self.create_annotations(
-            annotations=annotations,
-            labels=labels,
-            task_id=task['id'],
-            documents=documents,
-            annotation_group_map=annotation_group_lookup
-        )
-
-    def create_groups(self, task, groups):
-        ag_instance = AnnotationGroup(self.session, task['id'])
-        annotation_group_map = {}
-        for group in groups:
-            g = ag_instance.create({})
-            for anno in group['annotation_ids']:
-                annotation_group_map[anno] = g['id']
-        return annotation_group_map
-
-    def create_annotations(self, annotations, labels, task_id, documents, annotation_group_map):
-        annotation_instance = Annotation(self.session, task_id)
-        return annotation_instance.batch_create(
-            annotations=annotations,
-            labels=labels,
-            doc_anno_lookup=documents,
-            group_annotation_lookup=annotation_group_map
-        )
-
+    def import_records(self, data):
+        yield {key: data[key] for key in ['corpus', 'project', 'labels'] if key in data}
+        for key, record_type in [('documents', 'document'), ('annotations', 'annotation'), ('annotation_groups', 'annotation_group')]:
+            for item in data.get(key, None) or []:
+                yield {record_type: item}
 
     def create_labels(self, labels, project_id):
         label_instance = Label(self.session, project_id)
@@ -118,35 +70,30 @@ class Project(ApiBase):
         project = self.create(data['project'])
         self.create_labels(data['labels'], project['id'])
 
-        query = {
-            'method': data['search_methods'],
-            'corpus': project['corpora']
-        }
         global_limit = data['limit']
+        searches = [
+            {'query': doc['content'], 'limit': math.floor(global_limit * doc['weight'])}
+            for doc in data['documents']
+        ]
 
         annotations_to_create = []
         s = Search(self.session)
-
-        for doc in data['documents']:
-            limit = math.floor(global_limit * doc['weight'])
-            candidates = s.search(params={**query, 'query': doc['content']}, limit=limit)
+        # the search used the last of the repeated corpus query parameters, the methods are fused by the server
+        results = s.search_batch(
+            corpus=project['corpora'][-1],
+            method=','.join(data['search_methods']),
+            searches=searches,
+            collapse_duplicates=data.get('collapse_duplicates', False)
+        )
+        for candidates in results:
             annotations_to_create.extend(candidates)
 
-        chunks = self.split_list(annotations_to_create, task_size)
-        project_id = project['id']
-        task_instance = Task(self.session, project_id)
-        for idx, chunk in enumerate(chunks):
-            task = task_instance.create({'name': 'P{}T{}'.format(project_id, idx)})
-            self.create_annotations_directly(task['id'], chunk)
+        # the server creates the tasks and their annotations
+        task_instance = Task(self.session, project['id'])
+        task_instance.partition(task_size, documents=[[doc['id']] for doc in annotations_to_create])
 
         return project
 
-    def create_annotations_directly(self, task_id, documents):
-        annotation_instance = Annotation(self.session, task_id)
-        for doc in documents:
-            payload = {'documents': [doc['id']]}
-            annotation_instance.create(payload)
-
     def get_annotations(self, project_id, task_params={}, annotation_params={}):
         self.validate_data(task_params, 'task_filter.schema.json')
         self.validate_data(annotation_params, 'annotation_filter.schema.json')
@@ -8,11 +8,32 @@ class Search(ApiBase):
         super().__init__(session)
         self.single_resource_path = None
         self.list_resources_path = self.base_url + '/search/'
+        self.batch_path = self.base_url + '/search/batch/'
         self.schema = None
 
-    def search(self, params, limit=None):
-        response = self.session.get(self.list_resources_path, params=params)
-        response = self.process_response(response)
+    def search(self, params, limit=None, offset=None):
+        params = {**params}
         if limit is not None:
-            response = response[:limit]
-        return response
+            params['limit'] = limit
+        if offset is not None:
+            params['offset'] = offset
+        response = self.session.get(self.list_resources_path, params=params)
+        return self.process_response(response)
+
+    def search_batch(self, corpus, method, searches, project=None, collapse_duplicates=False, batch_size=1000):
+        """
+        Run many searches in a corpus, searches is a list of dicts with a query and an optional limit and offset.
+        Returns a list of documents per search. With collapse_duplicates near duplicates are only returned once per batch.
+        """
+        results = []
+        for i in range(0, len(searches), batch_size):
+            payload = {
+                'corpus': corpus,
+                'method': method,
+                'project': project,
+                'collapse_duplicates': collapse_duplicates,
+                'searches': searches[i:i+batch_size]
+            }
+            response = self.session.post(self.batch_path, json=payload)
+            results.extend(self.process_response(response))
+        return results
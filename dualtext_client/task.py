@@ -8,4 +8,18 @@ class Task(ApiBase):
         super().__init__(session)
         self.single_resource_path = self.base_url + '/task/{}'
         self.list_resources_path = self.base_url + '/project/{}/task/'.format(project_id)
+        self.partition_path = self.base_url + '/project/{}/task/partition/'.format(project_id)
         self.schema = 'task.schema.json'
+
+    def partition(self, task_size, annotations=None, documents=None, keep_groups=False):
+        """
+        Split existing annotations or lists of document ids into new tasks of task_size with a single request.
+        Returns the ids of the created tasks.
+        """
+        payload = {'task_size': task_size, 'keep_groups': keep_groups}
+        if annotations is not None:
+            payload['annotations'] = annotations
+        if documents is not None:
+            payload['documents'] = documents
+        response = self.session.post(self.partition_path, json=payload)
+        return self.process_response(response)['tasks']
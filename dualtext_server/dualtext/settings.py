@@ -115,6 +115,27 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+# The search cache is shared between workers and management commands, which invalidate it after indexing.
+# It defaults to a database table created by `python manage.py createcachetable`, Redis is faster, e.g.
+# SEARCH_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache with a Redis using maxmemory-policy allkeys-lru
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'search': {
+        'BACKEND': os.environ.get('SEARCH_CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.environ.get('SEARCH_CACHE_LOCATION', 'dualtext_search_cache'),
+        'TIMEOUT': int(os.environ.get('SEARCH_CACHE_TIMEOUT', 300)),
+    },
+}
+if CACHES['search']['BACKEND'].endswith(('LocMemCache', 'DatabaseCache', 'FileBasedCache')):
+    # these backends cull entries above MAX_ENTRIES
+    CACHES['search']['OPTIONS'] = {'MAX_ENTRIES': int(os.environ.get('SEARCH_CACHE_MAX_ENTRIES', 10000))}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -153,3 +174,13 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, "../staticfiles")
+
+# Search indexes of the local pipelines in dualtext_api/haystack_connector
+
+DUALTEXT_INDEX_DIR = os.environ.get('DUALTEXT_INDEX_DIR', os.path.join(BASE_DIR, "../indexes"))
+
+# build all pipelines and load their models when the wsgi application is loaded instead of on first use
+DUALTEXT_WARM_UP_PIPELINES = bool(int(os.environ.get('DUALTEXT_WARM_UP_PIPELINES', default=0)))
+
+# leave the reviews of finished tasks to the generatereviews command instead of creating them when a task is finished
+DUALTEXT_DEFER_REVIEWS = bool(int(os.environ.get('DUALTEXT_DEFER_REVIEWS', default=0)))
@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/3.1/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dualtext.settings')
 
 application = get_wsgi_application()
+
+if settings.DUALTEXT_WARM_UP_PIPELINES:
+    # with gunicorn --preload this runs once in the master process before the workers are forked
+    from dualtext_api.haystack_connector.pipelines import registry
+    registry.warm_up()
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class DualtextApiConfig(AppConfig):
     name = 'dualtext_api'
+
+    def ready(self):
+        from dualtext_api import checks, signals  # noqa: F401
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+
+@register()
+def check_search_cache(app_configs, **kwargs):
+    """
+    Warn if the search cache is local to a process, invalidations of other workers and commands never reach it.
+    """
+    backend = settings.CACHES.get('search', {}).get('BACKEND', '')
+    if backend.endswith('LocMemCache'):
+        return [Warning(
+            'The search cache is local to every process.',
+            hint='Cached results outlive index updates made by management commands and other workers. '
+                 'Use a shared backend such as DatabaseCache or RedisCache.',
+            id='dualtext_api.W001',
+        )]
+    return []
@@ -0,0 +1,234 @@
+import os
+import re
+from bisect import bisect_left
+from collections import Counter
+import numpy as np
+from .segments import SegmentStore, LocalIndexPipeline
+
+TOKEN_PATTERN = re.compile(r'\w+')
+MAX_TOKEN_LENGTH = 64
+
+
+def tokenize(text):
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if len(token) <= MAX_TOKEN_LENGTH]
+
+
+def build_postings(term_ids, doc_indices, frequencies, vocabulary_size):
+    """
+    Sort (term, document, frequency) triples by term and document into offsets, postings and frequencies arrays.
+    The postings of the term at position i of the vocabulary are postings[offsets[i]:offsets[i + 1]].
+    """
+    order = np.lexsort((doc_indices, term_ids))
+    counts = np.bincount(term_ids, minlength=vocabulary_size)
+    offsets = np.zeros(vocabulary_size + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return {
+        'offsets': offsets,
+        'postings': doc_indices[order].astype(np.int32),
+        'frequencies': np.minimum(frequencies[order], np.iinfo(np.uint16).max).astype(np.uint16),
+    }
+
+
+def encode_terms(terms):
+    """
+    Pack sorted terms into a blob of their UTF-8 bytes and the offsets of every term in it,
+    term i is blob[offsets[i]:offsets[i + 1]].
+    """
+    encoded = [term.encode('utf-8') for term in terms]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(np.array([len(term) for term in encoded], dtype=np.int64), out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+class Terms:
+    """
+    The sorted vocabulary of a segment, decoding terms from the memory-mapped blob as they are accessed.
+    """
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+    def position(self, term):
+        """
+        The position of term in the vocabulary or None if the segment doesn't contain it.
+        """
+        position = bisect_left(self, term)
+        if position < len(self) and self[position] == term:
+            return position
+        return None
+
+
+def segment_terms(segment):
+    if 'terms' not in segment.cache:
+        segment.cache['terms'] = Terms(segment['term_bytes'], segment['term_offsets'])
+    return segment.cache['terms']
+
+
+class BM25Index:
+    """
+    An inverted index of a single corpus, stored as segments of memory-mapped arrays.
+    Every segment holds a sorted vocabulary (a UTF-8 blob of the terms and their offsets), per document lengths
+    and the postings of each term.
+    """
+    def __init__(self, path, merge_factor=10):
+        self.store = SegmentStore(path, merge=self.merge, merge_factor=merge_factor)
+
+    def add(self, ids, contents):
+        counters = [Counter(tokenize(content or '')) for content in contents]
+        vocabulary = sorted(set().union(*counters)) if counters else []
+        term_index = {term: i for i, term in enumerate(vocabulary)}
+
+        term_ids, doc_indices, frequencies = [], [], []
+        for doc_index, counter in enumerate(counters):
+            for term, frequency in counter.items():
+                term_ids.append(term_index[term])
+                doc_indices.append(doc_index)
+                frequencies.append(frequency)
+
+        arrays = build_postings(
+            np.array(term_ids, dtype=np.int64),
+            np.array(doc_indices, dtype=np.int64),
+            np.array(frequencies, dtype=np.int64),
+            len(vocabulary)
+        )
+        arrays['term_bytes'], arrays['term_offsets'] = encode_terms(vocabulary)
+        arrays['lengths'] = np.array([sum(counter.values()) for counter in counters], dtype=np.int32)
+        self.store.add(ids, arrays)
+
+    def delete(self, ids):
+        self.store.delete(ids)
+
+    def merge(self, segments):
+        # segments written by deletes have no documents and no arrays
+        segments = [segment for segment in segments if len(segment.ids) > 0]
+        segment_vocabularies = [list(segment_terms(segment)) for segment in segments]
+        vocabulary = sorted(set().union(*segment_vocabularies))
+        term_index = {term: i for i, term in enumerate(vocabulary)}
+        term_ids, doc_indices, frequencies, lengths = [], [], [], []
+        doc_offset = 0
+        for segment, segment_vocabulary in zip(segments, segment_vocabularies):
+            live = segment.live
+            new_indices = np.cumsum(live) - 1 + doc_offset
+            offsets = np.asarray(segment['offsets'])
+            postings = np.asarray(segment['postings'])
+            global_terms = np.array([term_index[term] for term in segment_vocabulary], dtype=np.int64)
+            posting_terms = np.repeat(global_terms, np.diff(offsets))
+            keep = live[postings]
+
+            term_ids.append(posting_terms[keep])
+            doc_indices.append(new_indices[postings[keep]])
+            frequencies.append(np.asarray(segment['frequencies'])[keep])
+            lengths.append(np.asarray(segment['lengths'])[live])
+            doc_offset += int(live.sum())
+
+        arrays = build_postings(
+            np.concatenate(term_ids + [np.array([], dtype=np.int64)]).astype(np.int64),
+            np.concatenate(doc_indices + [np.array([], dtype=np.int64)]).astype(np.int64),
+            np.concatenate(frequencies + [np.array([], dtype=np.int64)]).astype(np.int64),
+            len(vocabulary)
+        )
+        arrays['term_bytes'], arrays['term_offsets'] = encode_terms(vocabulary)
+        arrays['lengths'] = np.concatenate(lengths + [np.array([], dtype=np.int32)]).astype(np.int32)
+        return arrays, {}
+
+    def search(self, query, top_k=10, k1=1.2, b=0.75):
+        """
+        Return the ids and BM25 scores of the top_k best matching documents, best match first.
+        """
+        segments = [segment for segment in self.store.segments() if len(segment.ids) > 0]
+        terms = sorted(set(tokenize(query)))
+        if not segments or not terms:
+            return [], []
+
+        document_count = 0
+        length_sum = 0
+        for segment in segments:
+            if 'length_sum' not in segment.cache:
+                segment.cache['length_sum'] = int(np.asarray(segment['lengths'])[segment.live].sum())
+            document_count += int(segment.live.sum())
+            length_sum += segment.cache['length_sum']
+        if document_count == 0:
+            return [], []
+        average_length = length_sum / document_count
+
+        # postings of every query term in every segment restricted to live documents
+        matches = []
+        document_frequencies = np.zeros(len(terms), dtype=np.int64)
+        for segment in segments:
+            vocabulary = segment_terms(segment)
+            for term_number, term in enumerate(terms):
+                position = vocabulary.position(term)
+                if position is None:
+                    continue
+                start, end = segment['offsets'][position], segment['offsets'][position + 1]
+                postings = np.asarray(segment['postings'][start:end])
+                live = segment.live[postings]
+                postings = postings[live]
+                frequencies = np.asarray(segment['frequencies'][start:end])[live]
+                document_frequencies[term_number] += len(postings)
+                matches.append((segment, term_number, postings, frequencies))
+
+        idf = np.log(1 + (document_count - document_frequencies + 0.5) / (document_frequencies + 0.5))
+        candidate_ids, candidate_scores = [], []
+        for segment in segments:
+            segment_matches = [match for match in matches if match[0] is segment]
+            if not segment_matches:
+                continue
+            postings = np.concatenate([match[2] for match in segment_matches])
+            frequencies = np.concatenate([match[3] for match in segment_matches]).astype(np.float32)
+            weights = np.concatenate([np.full(len(match[2]), idf[match[1]], dtype=np.float32) for match in segment_matches])
+            lengths = np.asarray(segment['lengths'])[postings]
+            term_scores = weights * frequencies * (k1 + 1) / (frequencies + k1 * (1 - b + b * lengths / average_length))
+
+            documents, inverse = np.unique(postings, return_inverse=True)
+            scores = np.bincount(inverse, weights=term_scores)
+            candidate_ids.append(np.asarray(segment.ids)[documents])
+            candidate_scores.append(scores)
+
+        if not candidate_ids:
+            return [], []
+        ids = np.concatenate(candidate_ids)
+        scores = np.concatenate(candidate_scores)
+        if len(scores) > top_k:
+            best = np.argpartition(-scores, top_k)[:top_k]
+            ids, scores = ids[best], scores[best]
+        order = np.argsort(-scores, kind='stable')
+        return ids[order].tolist(), scores[order].tolist()
+
+
+class BM25Pipeline(LocalIndexPipeline):
+    def create_index(self, path):
+        return BM25Index(path, merge_factor=self.merge_factor)
+
+
+class BM25IndexingPipeline(BM25Pipeline):
+    def run(self, documents, params):
+        index = self.get_index(params['index'])
+        index.add([int(document['id']) for document in documents], [document['content'] for document in documents])
+
+    def delete(self, ids, params):
+        self.get_index(params['index']).delete([int(document_id) for document_id in ids])
+
+
+class BM25QueryPipeline(BM25Pipeline):
+    def __init__(self, name, index_dir=None, merge_factor=10, top_k=10, k1=1.2, b=0.75):
+        super().__init__(name, index_dir=index_dir, merge_factor=merge_factor)
+        self.top_k = top_k
+        self.k1 = k1
+        self.b = b
+
+    def run(self, query, params):
+        index = self.get_index(params['index'])
+        ids, scores = index.search(
+            query,
+            top_k=int(params.get('top_k', self.top_k)),
+            k1=float(params.get('k1', self.k1)),
+            b=float(params.get('b', self.b))
+        )
+        return {'documents': [{'id': document_id, 'score': score} for document_id, score in zip(ids, scores)]}
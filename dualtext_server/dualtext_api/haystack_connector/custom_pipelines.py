@@ -1,3 +1,24 @@
+from .bm25 import BM25IndexingPipeline, BM25QueryPipeline
+from .dense import DenseIndexingPipeline, DenseQueryPipeline, SentenceTransformerEncoder
+from .ivfpq import IVFPQQueryPipeline
+from .minhash import MinHashIndexingPipeline, MinHashQueryPipeline
+
+# in-process BM25 search without an external service, the indexes are stored in settings.DUALTEXT_INDEX_DIR
+bm25_index = BM25IndexingPipeline('bm25')
+bm25_query = BM25QueryPipeline('bm25')
+
+# in-process dense retrieval over memory-mapped embeddings, needs the sentence-transformers package
+sentence_encoder = SentenceTransformerEncoder('sentence-transformers/all-MiniLM-L6-v2')
+dense_index = DenseIndexingPipeline('dense', encoder=sentence_encoder)
+dense_query = DenseQueryPipeline('dense', encoder=sentence_encoder)
+
+# approximate search over the dense embeddings for very large corpora, built with the buildannindex command
+ann_query = IVFPQQueryPipeline('ann', source='dense', encoder=sentence_encoder, nprobe=8)
+
+# MinHash signatures to find and collapse near duplicate documents
+minhash_index = MinHashIndexingPipeline('minhash')
+minhash_query = MinHashQueryPipeline('minhash')
+
 # from haystack.nodes import ElasticsearchRetriever
 # from haystack.document_stores import ElasticsearchDocumentStore
 # from haystack.pipelines import Pipeline
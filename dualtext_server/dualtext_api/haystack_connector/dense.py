@@ -0,0 +1,233 @@
+import numpy as np
+from .segments import SegmentStore, LocalIndexPipeline
+
+
+class SentenceTransformerEncoder:
+    """
+    Encodes texts with a sentence-transformers model. The model is loaded on first use,
+    so sentence-transformers is only required when a dense pipeline is actually used.
+    """
+    def __init__(self, model_name, batch_size=64, device=None):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.device = device
+        self._model = None
+
+    def load(self):
+        if self._model is None:
+            try:
+                from sentence_transformers import SentenceTransformer
+            except ImportError:
+                raise ImportError('Dense pipelines need the sentence-transformers package: pip install sentence-transformers')
+            self._model = SentenceTransformer(self.model_name, device=self.device)
+        return self._model
+
+    def __call__(self, texts):
+        return self.load().encode(list(texts), batch_size=self.batch_size, convert_to_numpy=True)
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+class DenseIndex:
+    """
+    An embedding matrix per segment, stored as float32 or float16 .npy files and memory-mapped at query time.
+    Queries are scored block by block so that only block_size rows have to be in memory at once.
+    """
+    def __init__(self, path, dtype='float32', merge_factor=10):
+        self.dtype = np.dtype(dtype)
+        self.store = SegmentStore(path, merge=self.merge, merge_factor=merge_factor)
+
+    def add(self, ids, vectors):
+        vectors = np.asarray(vectors, dtype=self.dtype)
+        if vectors.ndim != 2 or len(vectors) != len(ids):
+            raise ValueError('Expected one embedding per document.')
+        dimension = self.dimension()
+        if dimension is not None and vectors.shape[1] != dimension:
+            raise ValueError(f'Expected embeddings of dimension {dimension}, got {vectors.shape[1]}.')
+        self.store.add(ids, {'vectors': vectors})
+
+    def delete(self, ids):
+        self.store.delete(ids)
+
+    def dimension(self):
+        for segment in self.store.segments():
+            if len(segment.ids) > 0:
+                return segment['vectors'].shape[1]
+        return None
+
+    def iterate(self, block_size=65536, segments=None):
+        """
+        Yield the ids and float32 embeddings of all current documents block by block.
+        """
+        for segment in segments if segments is not None else self.store.segments():
+            if len(segment.ids) == 0:
+                continue
+            vectors = segment['vectors']
+            for start in range(0, len(vectors), block_size):
+                live = segment.live[start:start + block_size]
+                if live.any():
+                    yield np.asarray(segment.ids[start:start + block_size])[live], np.asarray(vectors[start:start + block_size], dtype=np.float32)[live]
+
+    def vectors_of(self, ids):
+        """
+        Return the float32 embeddings of ids and a mask of the ids that are indexed, the rows of the others are zero.
+        The live ids of every segment are sorted once per segment and looked up by binary search.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        found = np.zeros(len(ids), dtype=bool)
+        vectors = None
+        for segment in self.store.segments():
+            if len(segment.ids) == 0:
+                continue
+            if 'id_order' not in segment.cache:
+                rows = np.flatnonzero(segment.live)
+                order = rows[np.argsort(np.asarray(segment.ids)[rows], kind='stable')]
+                segment.cache['id_order'] = (order, np.asarray(segment.ids)[order])
+            order, sorted_ids = segment.cache['id_order']
+            if len(order) == 0:
+                continue
+            if vectors is None:
+                vectors = np.zeros((len(ids), segment['vectors'].shape[1]), dtype=np.float32)
+            positions = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+            match = ~found & (sorted_ids[positions] == ids)
+            rows = order[positions[match]]
+            # rows in file order, so that the memory-mapped matrix is read front to back
+            file_order = np.argsort(rows)
+            vectors[np.flatnonzero(match)[file_order]] = np.asarray(segment['vectors'][rows[file_order]], dtype=np.float32)
+            found |= match
+        if vectors is None:
+            vectors = np.zeros((len(ids), 0), dtype=np.float32)
+        return vectors, found
+
+    def merge(self, segments):
+        # segments written by deletes have no documents and no arrays
+        segments = [segment for segment in segments if len(segment.ids) > 0]
+        rows = sum(int(segment.live.sum()) for segment in segments)
+        dimension = segments[0]['vectors'].shape[1] if segments else 0
+
+        def write(path, block_size=65536):
+            merged = np.lib.format.open_memmap(path, mode='w+', dtype=self.dtype, shape=(rows, dimension))
+            position = 0
+            for segment in segments:
+                vectors = segment['vectors']
+                for start in range(0, len(vectors), block_size):
+                    block = vectors[start:start + block_size][segment.live[start:start + block_size]]
+                    merged[position:position + len(block)] = block
+                    position += len(block)
+            merged.flush()
+            del merged
+
+        return {'vectors': write}, {}
+
+    def search(self, vector, top_k=10, block_size=65536):
+        """
+        Return the ids and dot product scores of the top_k documents closest to vector, best match first.
+        """
+        return self.search_batch([vector], top_k=top_k, block_size=block_size)[0]
+
+    def search_batch(self, vectors, top_k=10, block_size=65536):
+        """
+        Return the (ids, scores) of the top_k documents closest to each of vectors, best match first.
+        Every block is read once and scored against all vectors, each vector keeps its own running top_k.
+        """
+        queries = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+
+        for segment in self.store.segments():
+            if len(segment.ids) == 0:
+                continue
+            vectors = segment['vectors']
+            for start in range(0, len(vectors), block_size):
+                end = start + block_size
+                live = segment.live[start:end]
+                if not live.any():
+                    continue
+                scores = (np.asarray(vectors[start:end], dtype=np.float32)[live] @ queries.T).T
+                ids = np.asarray(segment.ids[start:end], dtype=np.int64)[live]
+
+                best_ids = np.concatenate([best_ids, np.broadcast_to(ids, scores.shape)], axis=1)
+                best_scores = np.concatenate([best_scores, scores], axis=1)
+                if best_scores.shape[1] > top_k:
+                    keep = np.argpartition(-best_scores, top_k, axis=1)[:, :top_k]
+                    best_ids = np.take_along_axis(best_ids, keep, axis=1)
+                    best_scores = np.take_along_axis(best_scores, keep, axis=1)
+
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        best_ids = np.take_along_axis(best_ids, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        return [(ids.tolist(), scores.tolist()) for ids, scores in zip(best_ids, best_scores)]
+
+
+class DensePipeline(LocalIndexPipeline):
+    """
+    Base of the dense pipelines. The encoder is a callable turning a list of texts into a 2d array of embeddings,
+    documents that already carry an embedding are not encoded again.
+    """
+    def __init__(self, name, encoder=None, index_dir=None, dtype='float32', similarity='cosine', merge_factor=10):
+        super().__init__(name, index_dir=index_dir, merge_factor=merge_factor)
+        if similarity not in ('cosine', 'dot_product'):
+            raise ValueError('similarity must be cosine or dot_product.')
+        self.encoder = encoder
+        self.dtype = dtype
+        self.similarity = similarity
+
+    def create_index(self, path):
+        return DenseIndex(path, dtype=self.dtype, merge_factor=self.merge_factor)
+
+    def warm_up(self):
+        if hasattr(self.encoder, 'load'):
+            self.encoder.load()
+
+    def encode(self, texts):
+        if self.encoder is None:
+            raise ValueError(f'{self.name} needs an encoder to embed texts.')
+        vectors = np.asarray(self.encoder(texts), dtype=np.float32)
+        return normalize(vectors) if self.similarity == 'cosine' else vectors
+
+
+class DenseIndexingPipeline(DensePipeline):
+    def run(self, documents, params):
+        if not documents:
+            return
+        missing = [document['content'] for document in documents if document.get('embedding') is None]
+        encoded = iter(self.encode(missing)) if missing else iter([])
+        vectors = []
+        for document in documents:
+            if document.get('embedding') is None:
+                vectors.append(next(encoded))
+            else:
+                vector = np.asarray(document['embedding'], dtype=np.float32)
+                vectors.append(normalize(vector) if self.similarity == 'cosine' else vector)
+
+        index = self.get_index(params['index'])
+        index.add([int(document['id']) for document in documents], np.stack(vectors))
+
+    def delete(self, ids, params):
+        self.get_index(params['index']).delete([int(document_id) for document_id in ids])
+
+
+class DenseQueryPipeline(DensePipeline):
+    def __init__(self, name, encoder=None, index_dir=None, dtype='float32', similarity='cosine', merge_factor=10,
+                 top_k=10, block_size=65536):
+        super().__init__(name, encoder=encoder, index_dir=index_dir, dtype=dtype, similarity=similarity, merge_factor=merge_factor)
+        self.top_k = top_k
+        self.block_size = block_size
+
+    def run(self, query, params):
+        return {'documents': self.run_batch([query], params)['documents'][0]}
+
+    def run_batch(self, queries, params):
+        """
+        Encode all queries at once and score them together in a single pass over the index.
+        """
+        if not queries:
+            return {'documents': []}
+        index = self.get_index(params['index'])
+        results = index.search_batch(self.encode(queries), top_k=int(params.get('top_k', self.top_k)), block_size=self.block_size)
+        return {'documents': [
+            [{'id': document_id, 'score': score} for document_id, score in zip(ids, scores)] for ids, scores in results
+        ]}
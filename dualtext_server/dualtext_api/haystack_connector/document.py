@@ -5,19 +5,24 @@ from.pipelines import initialized_pipelines
 indexing_pipelines = initialized_pipelines['indexing']
 
 class Document:
+    """
+    The fields of a model instance to index. The class attributes describe the document type and are never changed,
+    the values of a document are kept per instance in current_fields.
+    """
     model = None
     fields = []
     content_field = None
     id_field = None
     indexing_pipelines = []
     query_pipelines = []
-    current_fields = {}
     additional_fields = []
     index_by = 'class_name'
+    # an indexing pipeline with a collapse method, used to remove near duplicates from results
+    duplicate_pipeline = None
 
     def __init__(self, model_instance, **kwargs):
-        for key, value in kwargs:
-            self._check_and_set_arguments(kwargs, lookup=['additional_fields'])
+        self.current_fields = {}
+        self._check_and_set_arguments(kwargs, lookup=['additional_fields'])
 
         for field in self.fields:
             split_field = field.split('__')
@@ -73,9 +78,9 @@ class Document:
 
     @classmethod
     def query_pipeline(cls, pipeline_name, index=None):
-        query_index = index if index else cls.__class__.__name__
+        query_index = index if index is not None else cls.__name__
         if pipeline_name not in cls.query_pipelines:
-            raise ValueError(f'{cls.__class__.__name__} does not have a "{pipeline_name}" query pipeline.')
+            raise ValueError(f'{cls.__name__} does not have a "{pipeline_name}" query pipeline.')
 
         return PipelineQueryset(cls, pipeline_name, query_index)
 
@@ -102,5 +107,23 @@ class Document:
             except KeyError:
                 raise ValueError(f'{pipeline} does not exist.')
 
+    @classmethod
+    def delete_batch(cls, ids, index):
+        for pipeline in cls.indexing_pipelines:
+            try:
+                indexing_pipelines[pipeline].delete(ids, index)
+            except KeyError:
+                raise ValueError(f'{pipeline} does not exist.')
+
+    @classmethod
+    def collapse_duplicates(cls, ids, index):
+        """
+        Return the ids without repeated ids and without the near duplicates of an earlier id.
+        """
+        pipeline = indexing_pipelines[cls.duplicate_pipeline].pipeline if cls.duplicate_pipeline else None
+        if not hasattr(pipeline, 'collapse'):
+            raise ValueError(f'{cls.__name__} does not have a duplicate pipeline.')
+        return pipeline.collapse(ids=ids, params={'index': index})
+
     def __repr__(self):
         return f'<{self.__class__.__name__}: {str(self.current_fields)}>'
@@ -1,15 +1,29 @@
-import requests
-import json
+from concurrent.futures import ThreadPoolExecutor
+from .transport import HttpTransport
 
 
 class IndexingPipeline:
-    def __init__(self, pipeline_name, pipeline=None, url=None, token=None, batch_size=500):
+    def __init__(self, pipeline_name, pipeline=None, url=None, token=None, batch_size=500, concurrency=1,
+                 compress=False, retries=3, backoff_factor=0.5, timeout=60, delete_url=None):
         self.pipeline = pipeline
 
         self.url = url
+        self.delete_url = delete_url
         self.pipeline_name = pipeline_name
         self.token = token
         self.batch_size = batch_size
+        self.concurrency = concurrency
+
+        self.transport = None
+        if url is not None:
+            self.transport = HttpTransport(
+                token=token,
+                pool_size=concurrency,
+                retries=retries,
+                backoff_factor=backoff_factor,
+                compress=compress,
+                timeout=timeout
+            )
 
     def save(self, documents, index):
         if self.pipeline is None:
@@ -17,14 +31,28 @@ class IndexingPipeline:
         else:
             self.pipeline.run(documents=documents, params={'index': index})
 
-    def _make_indexing_request(self, documents, index):
-        for i in range(0, len(documents), self.batch_size):
-            batch = documents[i:i+self.batch_size]
-            body = {'documents': batch, 'params': {'index': index}}
+    def delete(self, ids, index):
+        """
+        Remove documents from the index. Remote pipelines need a delete_url, custom pipelines a delete method,
+        pipelines without either can't remove documents and are skipped.
+        """
+        if self.pipeline is None:
+            if self.delete_url is not None:
+                for i in range(0, len(ids), self.batch_size):
+                    self.transport.post(self.delete_url, {'ids': ids[i:i+self.batch_size], 'params': {'index': index}})
+        elif hasattr(self.pipeline, 'delete'):
+            self.pipeline.delete(ids=ids, params={'index': index})
 
-            headers = {}
-            if self.token is not None:
-                headers = {'Authorization': f'Bearer {self.token}'}
+    def _make_indexing_request(self, documents, index):
+        batches = [documents[i:i+self.batch_size] for i in range(0, len(documents), self.batch_size)]
+        if self.concurrency <= 1 or len(batches) <= 1:
+            for batch in batches:
+                self._send_batch(batch, index)
+        else:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                # consume the results to raise the first failed batch
+                list(executor.map(lambda batch: self._send_batch(batch, index), batches))
 
-            response = requests.post(self.url, json=json.dumps(body), headers=headers)
-            response.raise_for_status()
\ No newline at end of file
+    def _send_batch(self, batch, index):
+        body = {'documents': batch, 'params': {'index': index}}
+        self.transport.post(self.url, body)
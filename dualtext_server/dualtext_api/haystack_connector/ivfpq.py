@@ -0,0 +1,300 @@
+import json
+import os
+import shutil
+import uuid
+import numpy as np
+from .dense import DensePipeline, DenseIndex
+
+
+def squared_distances(vectors, centroids):
+    return (
+        np.einsum('ij,ij->i', vectors, vectors)[:, None]
+        - 2 * vectors @ centroids.T
+        + np.einsum('ij,ij->i', centroids, centroids)[None, :]
+    )
+
+
+def assign(vectors, centroids, budget=2 ** 22):
+    """
+    Return the index of the closest centroid for every vector, computed block by block.
+    A block has as many rows as keep its distance matrix within budget elements, whatever the number of centroids.
+    """
+    block_size = max(1, budget // max(len(centroids), 1))
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_size):
+        assignments[start:start + block_size] = squared_distances(vectors[start:start + block_size], centroids).argmin(axis=1)
+    return assignments
+
+
+def kmeans(vectors, k, iterations=20, seed=0):
+    """
+    Lloyd's k-means on a float32 array. Clusters that run empty are restarted on a random vector.
+    """
+    rng = np.random.default_rng(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=len(vectors) < k)].copy()
+    for _ in range(iterations):
+        assignments = assign(vectors, centroids)
+        counts = np.bincount(assignments, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        centroids[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()))]
+    return centroids
+
+
+def default_subquantizers(dimension):
+    """
+    The divisor of the dimension closest to dimension / 8, which compresses float32 vectors about 32 times.
+    """
+    divisors = [m for m in range(1, dimension + 1) if dimension % m == 0]
+    return min(divisors, key=lambda m: abs(m - dimension / 8))
+
+
+class IVFPQIndex:
+    """
+    An inverted file index with product-quantized residuals for approximate inner product search.
+
+    Vectors are assigned to the closest of nlist coarse centroids, the residual to that centroid is split into
+    m sub-vectors and each sub-vector is stored as the 1 byte id of its closest sub-centroid. A query only scores
+    the vectors of its nprobe closest lists: q . x ~ q . centroid + sum of the precomputed q_m . codebook_m[code_m].
+    The best rerank * top_k candidates are scored again with their original vectors, which are looked up by id
+    in the dense index the approximate index was built from.
+    """
+    CODEBOOK_SIZE = 256
+    ARRAYS = ('centroids', 'codebooks', 'codes', 'ids', 'list_offsets')
+    CURRENT = 'current.json'
+
+    def __init__(self, centroids, codebooks, codes=None, ids=None, list_offsets=None):
+        self.centroids = centroids
+        self.codebooks = codebooks
+        self.codes = codes
+        self.ids = ids
+        self.list_offsets = list_offsets
+
+    @classmethod
+    def train(cls, sample, nlist, m, iterations=20, seed=0):
+        sample = np.asarray(sample, dtype=np.float32)
+        dimension = sample.shape[1]
+        if dimension % m != 0:
+            raise ValueError(f'The number of sub-quantizers ({m}) has to divide the dimension ({dimension}).')
+
+        centroids = kmeans(sample, min(nlist, len(sample)), iterations=iterations, seed=seed)
+        residuals = sample - centroids[assign(sample, centroids)]
+        sub_dimension = dimension // m
+        codebooks = np.stack([
+            kmeans(residuals[:, i * sub_dimension:(i + 1) * sub_dimension], cls.CODEBOOK_SIZE, iterations=iterations, seed=seed + i)
+            for i in range(m)
+        ])
+        return cls(centroids, codebooks)
+
+    def encode(self, vectors):
+        """
+        Return the list and the PQ codes of every vector.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        lists = assign(vectors, self.centroids)
+        residuals = vectors - self.centroids[lists]
+        m, _, sub_dimension = self.codebooks.shape
+        codes = np.empty((len(vectors), m), dtype=np.uint8)
+        for i in range(m):
+            codes[:, i] = assign(residuals[:, i * sub_dimension:(i + 1) * sub_dimension], self.codebooks[i])
+        return lists, codes
+
+    def add_all(self, blocks):
+        """
+        Encode all (ids, vectors) blocks and store the codes grouped by list.
+        """
+        all_ids, all_lists, all_codes = [], [], []
+        for ids, vectors in blocks:
+            lists, codes = self.encode(vectors)
+            all_ids.append(np.asarray(ids, dtype=np.int64))
+            all_lists.append(lists)
+            all_codes.append(codes)
+
+        m = self.codebooks.shape[0]
+        ids = np.concatenate(all_ids + [np.array([], dtype=np.int64)])
+        lists = np.concatenate(all_lists + [np.array([], dtype=np.int64)])
+        codes = np.concatenate(all_codes + [np.zeros((0, m), dtype=np.uint8)])
+
+        order = np.argsort(lists, kind='stable')
+        self.ids = ids[order]
+        self.codes = codes[order]
+        self.list_offsets = np.zeros(len(self.centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(lists, minlength=len(self.centroids)), out=self.list_offsets[1:])
+
+    def search(self, vector, top_k=10, nprobe=8, rerank=4, vectors_of=None):
+        """
+        Return the ids and approximate inner products of the top_k documents closest to vector, best match first.
+        With rerank and vectors_of, a callable returning the vectors of ids and a mask of the ids it found,
+        the candidates are scored with their original vectors and documents deleted since the build are left out.
+        """
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        centroid_scores = self.centroids @ vector
+        nprobe = min(nprobe, len(self.centroids))
+        probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+
+        m, _, sub_dimension = self.codebooks.shape
+        # inner products of each query sub-vector with all sub-centroids of its codebook
+        table = np.einsum('mkd,md->mk', self.codebooks, vector.reshape(m, sub_dimension))
+
+        candidate_positions, candidate_scores = [], []
+        for probe in probes:
+            start, end = self.list_offsets[probe], self.list_offsets[probe + 1]
+            if start == end:
+                continue
+            codes = np.asarray(self.codes[start:end])
+            candidate_positions.append(np.arange(start, end))
+            candidate_scores.append(centroid_scores[probe] + table[np.arange(m), codes].sum(axis=1))
+
+        if not candidate_positions:
+            return [], []
+        positions = np.concatenate(candidate_positions)
+        scores = np.concatenate(candidate_scores)
+
+        if rerank and vectors_of is not None:
+            positions, scores = self.top(positions, scores, top_k * rerank)
+            vectors, found = vectors_of(np.asarray(self.ids[positions]))
+            if not found.any():
+                return [], []
+            positions, scores = positions[found], vectors[found] @ vector
+
+        positions, scores = self.top(positions, scores, top_k)
+        order = np.argsort(-scores, kind='stable')
+        return np.asarray(self.ids[positions[order]]).tolist(), scores[order].tolist()
+
+    @staticmethod
+    def top(positions, scores, k):
+        if len(scores) <= k:
+            return positions, scores
+        best = np.argpartition(-scores, k)[:k]
+        return positions[best], scores[best]
+
+    @property
+    def nbytes(self):
+        """
+        The size of the arrays of the index, the original vectors used for re-ranking stay in the dense index.
+        """
+        return sum(getattr(self, array_name).nbytes for array_name in self.ARRAYS)
+
+    def save(self, path):
+        """
+        Write the index to a new directory below path and point path/current.json to it.
+        Readers keep using the previous build until they see the new pointer.
+        """
+        os.makedirs(path, exist_ok=True)
+        name = 'build-{}'.format(uuid.uuid4().hex)
+        build_path = os.path.join(path, name)
+        os.makedirs(build_path)
+        for array_name in self.ARRAYS:
+            np.save(os.path.join(build_path, f'{array_name}.npy'), getattr(self, array_name))
+
+        previous = self.current_build(path)
+        tmp_path = os.path.join(path, self.CURRENT + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'name': name}, f)
+        os.replace(tmp_path, os.path.join(path, self.CURRENT))
+        if previous is not None:
+            shutil.rmtree(os.path.join(path, previous), ignore_errors=True)
+
+    @classmethod
+    def current_build(cls, path):
+        try:
+            with open(os.path.join(path, cls.CURRENT), 'r') as f:
+                return json.load(f)['name']
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def load(cls, path, name):
+        arrays = {
+            array_name: np.load(os.path.join(path, name, f'{array_name}.npy'), mmap_mode='r')
+            for array_name in cls.ARRAYS
+        }
+        # the small coarse quantizer and codebooks are used by every query and kept in memory
+        arrays['centroids'] = np.array(arrays['centroids'])
+        arrays['codebooks'] = np.array(arrays['codebooks'])
+        return cls(**arrays)
+
+
+class IVFPQQueryPipeline(DensePipeline):
+    """
+    Approximate search over the embeddings of a dense pipeline. The index is a snapshot built by the
+    buildannindex management command from the dense index named source and has to be rebuilt to include
+    documents indexed afterwards.
+    """
+    def __init__(self, name, source, encoder=None, index_dir=None, dtype='float32', similarity='cosine',
+                 top_k=10, nprobe=8, rerank=4):
+        super().__init__(name, encoder=encoder, index_dir=index_dir, dtype=dtype, similarity=similarity)
+        self.source = source
+        self.top_k = top_k
+        self.nprobe = nprobe
+        self.rerank = rerank
+        self._loaded = {}
+
+    def source_index(self, index):
+        """
+        The dense index the approximate index is built from, it also holds the vectors used for re-ranking.
+        """
+        index = str(index)
+        if index not in self._indexes:
+            self._indexes[index] = DenseIndex(self.index_path(index, name=self.source), dtype=self.dtype)
+        return self._indexes[index]
+
+    def load(self, index):
+        path = self.index_path(index)
+        name = IVFPQIndex.current_build(path)
+        if name is None:
+            raise ValueError(f'{self.name} has no index for {index}, build it with the buildannindex command.')
+        loaded = self._loaded.get(path)
+        if loaded is None or loaded[0] != name:
+            try:
+                loaded = (name, IVFPQIndex.load(path, name))
+            except FileNotFoundError:
+                # a new build replaced this one after current.json was read
+                return self.load(index)
+            self._loaded[path] = loaded
+        return loaded[1]
+
+    def build(self, index, nlist=None, m=None, train_size=100000, iterations=20, block_size=65536, seed=0):
+        source = self.source_index(index)
+        # a fixed list of segments, so that both passes over the embeddings see the same documents
+        segments = source.store.segments()
+        live_count = sum(int(segment.live.sum()) for segment in segments if len(segment.ids) > 0)
+        if live_count == 0:
+            raise ValueError(f'{self.source} has no documents for {index}.')
+
+        rng = np.random.default_rng(seed)
+        probability = min(1.0, train_size / live_count)
+        sample = np.concatenate([
+            vectors[rng.random(len(vectors)) < probability] for ids, vectors in source.iterate(block_size, segments)
+        ])
+        if len(sample) == 0:
+            sample = next(source.iterate(block_size, segments))[1]
+
+        dimension = sample.shape[1]
+        nlist = nlist or max(1, int(4 * np.sqrt(live_count)))
+        m = m or default_subquantizers(dimension)
+        ann_index = IVFPQIndex.train(sample, nlist=nlist, m=m, iterations=iterations, seed=seed)
+        ann_index.add_all(source.iterate(block_size, segments))
+        ann_index.save(self.index_path(index))
+        return self.load(index)
+
+    def run(self, query, params):
+        return {'documents': self.run_batch([query], params)['documents'][0]}
+
+    def run_batch(self, queries, params):
+        ann_index = self.load(params['index'])
+        source = self.source_index(params['index'])
+        documents = []
+        for vector in self.encode(queries):
+            ids, scores = ann_index.search(
+                vector,
+                top_k=int(params.get('top_k', self.top_k)),
+                nprobe=int(params.get('nprobe', self.nprobe)),
+                rerank=int(params.get('rerank', self.rerank)),
+                vectors_of=source.vectors_of
+            )
+            documents.append([{'id': document_id, 'score': score} for document_id, score in zip(ids, scores)])
+        return {'documents': documents}
@@ -0,0 +1,246 @@
+import zlib
+import numpy as np
+from .bm25 import tokenize
+from .segments import SegmentStore, LocalIndexPipeline
+
+# a prime larger than every 32 bit shingle hash, the permutations are (a * x + b) mod PRIME
+PRIME = np.uint64(4294967311)
+MAX_HASH = np.uint64(0xffffffff)
+MULTIPLIER = 1000003
+
+
+def polynomial_multipliers(count):
+    return np.array([pow(MULTIPLIER, i, 2 ** 64) for i in range(count)], dtype=np.uint64)
+
+
+def shingle_hashes(text, size=3):
+    """
+    Return the 32 bit hashes of all word n-grams of length size in text.
+    Texts with fewer words are a single shingle of all their words.
+    """
+    tokens = tokenize(text or '')
+    if len(tokens) < size:
+        return np.array([zlib.crc32(' '.join(tokens).encode('utf-8'))], dtype=np.uint64)
+
+    token_hashes = np.array([zlib.crc32(token.encode('utf-8')) for token in tokens], dtype=np.uint64)
+    count = len(tokens) - size + 1
+    hashes = np.zeros(count, dtype=np.uint64)
+    for multiplier, i in zip(polynomial_multipliers(size)[::-1], range(size)):
+        # wraps around modulo 2 ** 64 and is cut to 32 bits below
+        hashes += token_hashes[i:count + i] * multiplier
+    return np.unique(hashes & MAX_HASH)
+
+
+class MinHasher:
+    """
+    Computes MinHash signatures of num_perm random permutations. The share of equal signature values of two texts
+    estimates the Jaccard similarity of their shingle sets.
+    """
+    # number of shingles hashed at once, bounds the memory to num_perm * CHUNK_SHINGLES * 8 bytes
+    CHUNK_SHINGLES = 32768
+
+    def __init__(self, num_perm=128, shingle_size=3, seed=1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        # a * x + b stays below 2 ** 64 for a and x below 2 ** 32
+        self.a = rng.integers(1, 2 ** 32, size=num_perm, dtype=np.uint64)[:, None]
+        self.b = rng.integers(0, int(PRIME), size=num_perm, dtype=np.uint64)[:, None]
+
+    def signatures(self, texts):
+        """
+        Return the (len(texts), num_perm) uint32 signatures of the texts.
+        The shingles of consecutive texts are hashed together, so the work grows linearly with the total text length.
+        """
+        signatures = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        chunk, chunk_shingles, start = [], 0, 0
+        for position, text in enumerate(texts):
+            hashes = shingle_hashes(text, self.shingle_size)
+            chunk.append(hashes)
+            chunk_shingles += len(hashes)
+            if chunk_shingles >= self.CHUNK_SHINGLES or position == len(texts) - 1:
+                signatures[start:position + 1] = self.hash_chunk(chunk)
+                chunk, chunk_shingles, start = [], 0, position + 1
+        return signatures
+
+    def hash_chunk(self, chunk):
+        offsets = np.cumsum([0] + [len(hashes) for hashes in chunk[:-1]])
+        permuted = (self.a * np.concatenate(chunk)[None, :] + self.b) % PRIME
+        return np.minimum.reduceat(permuted, offsets, axis=1).T.astype(np.uint32)
+
+
+def band_keys(signatures, bands):
+    """
+    Combine the rows of every LSH band of the signatures into one uint64 key, returns an array of (documents, bands).
+    Documents sharing the key of any band are candidates for near duplicates.
+    """
+    signatures = np.asarray(signatures, dtype=np.uint64)
+    rows = signatures.shape[1] // bands
+    # wraps around modulo 2 ** 64
+    return (signatures[:, :bands * rows].reshape(len(signatures), bands, rows) * polynomial_multipliers(rows)).sum(axis=2, dtype=np.uint64)
+
+
+def similarity(signature, signatures):
+    """
+    The estimated Jaccard similarity of a signature with every row of signatures.
+    """
+    return (np.asarray(signatures) == signature).mean(axis=1)
+
+
+class MinHashIndex:
+    """
+    MinHash signatures of the documents of a corpus. Every segment also stores the LSH band keys of its documents
+    sorted per band, so the near duplicates of a text are found by a binary search per band.
+    """
+    def __init__(self, path, bands=32, merge_factor=10):
+        self.bands = bands
+        self.store = SegmentStore(path, merge=self.merge, merge_factor=merge_factor)
+
+    def add(self, ids, signatures):
+        self.store.add(ids, self.arrays(np.asarray(signatures, dtype=np.uint32)))
+
+    def delete(self, ids):
+        self.store.delete(ids)
+
+    def arrays(self, signatures):
+        keys = band_keys(signatures, self.bands).T
+        order = np.argsort(keys, axis=1, kind='stable')
+        return {
+            'signatures': signatures,
+            'band_keys': np.take_along_axis(keys, order, axis=1),
+            'band_rows': order.astype(np.int64),
+        }
+
+    def merge(self, segments):
+        # segments written by deletes have no documents and no arrays
+        signatures = [np.asarray(segment['signatures'])[segment.live] for segment in segments if len(segment.ids) > 0]
+        if not signatures:
+            return {}, {}
+        return self.arrays(np.concatenate(signatures)), {}
+
+    def query(self, signature, threshold=0.8):
+        """
+        Return the ids and estimated Jaccard similarities of the documents sharing a band with signature
+        and reaching the threshold, most similar first.
+        """
+        query_keys = band_keys(np.asarray(signature)[None, :], self.bands)[0]
+        all_ids, all_scores = [], []
+        for segment in self.store.segments():
+            if len(segment.ids) == 0:
+                continue
+            sorted_keys = segment['band_keys']
+            rows = []
+            for band in range(self.bands):
+                start = np.searchsorted(sorted_keys[band], query_keys[band], side='left')
+                end = np.searchsorted(sorted_keys[band], query_keys[band], side='right')
+                rows.append(np.asarray(segment['band_rows'][band, start:end]))
+            rows = np.unique(np.concatenate(rows))
+            rows = rows[segment.live[rows]]
+            if len(rows) == 0:
+                continue
+            scores = similarity(signature, segment['signatures'][rows])
+            keep = scores >= threshold
+            all_ids.append(np.asarray(segment.ids)[rows][keep])
+            all_scores.append(scores[keep])
+
+        if not all_ids:
+            return [], []
+        ids, scores = np.concatenate(all_ids), np.concatenate(all_scores)
+        order = np.argsort(-scores, kind='stable')
+        return ids[order].tolist(), scores[order].tolist()
+
+    def signatures_of(self, ids):
+        """
+        Return the stored signatures of the given document ids by id, ids without a signature are left out.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        found = {}
+        for segment in reversed(self.store.segments()):
+            if len(segment.ids) == 0 or len(found) == len(ids):
+                continue
+            if 'id_order' not in segment.cache:
+                segment.cache['id_order'] = np.argsort(segment.ids, kind='stable')
+            order = segment.cache['id_order']
+            segment_ids = np.asarray(segment.ids)[order]
+            positions = np.minimum(np.searchsorted(segment_ids, ids), len(segment_ids) - 1)
+            match = segment_ids[positions] == ids
+            for document_id, row in zip(ids[match].tolist(), order[positions[match]].tolist()):
+                if document_id not in found and segment.live[row]:
+                    found[document_id] = np.asarray(segment['signatures'][row])
+        return found
+
+
+class MinHashPipeline(LocalIndexPipeline):
+    """
+    Base of the near duplicate pipelines. Documents are near duplicates if the estimated Jaccard similarity of their
+    word shingles reaches threshold.
+    """
+    def __init__(self, name, index_dir=None, merge_factor=10, num_perm=128, bands=32, shingle_size=3, threshold=0.8):
+        super().__init__(name, index_dir=index_dir, merge_factor=merge_factor)
+        if num_perm % bands != 0:
+            raise ValueError('The number of permutations has to be a multiple of the number of bands.')
+        self.hasher = MinHasher(num_perm=num_perm, shingle_size=shingle_size)
+        self.bands = bands
+        self.threshold = threshold
+
+    def create_index(self, path):
+        return MinHashIndex(path, bands=self.bands, merge_factor=self.merge_factor)
+
+
+class MinHashIndexingPipeline(MinHashPipeline):
+    def run(self, documents, params):
+        if not documents:
+            return
+        signatures = self.hasher.signatures([document['content'] for document in documents])
+        self.get_index(params['index']).add([int(document['id']) for document in documents], signatures)
+
+    def delete(self, ids, params):
+        self.get_index(params['index']).delete([int(document_id) for document_id in ids])
+
+    def collapse(self, ids, params):
+        """
+        Return the ids without repeated ids and without the near duplicates of an earlier id.
+        Ids that were never indexed are kept.
+        """
+        threshold = float(params.get('threshold', self.threshold))
+        signatures = self.get_index(params['index']).signatures_of(ids)
+        known = list(signatures)
+        keys = dict(zip(known, band_keys(np.stack([signatures[document_id] for document_id in known]), self.bands).tolist())) if known else {}
+        # positions in kept_signatures by (band, key), only documents sharing a band are compared
+        kept_by_key = {}
+        kept_signatures = []
+        kept = []
+        seen = set()
+
+        for document_id in ids:
+            if document_id in seen:
+                continue
+            seen.add(document_id)
+            if document_id not in signatures:
+                kept.append(document_id)
+                continue
+
+            signature = signatures[document_id]
+            document_keys = list(enumerate(keys[document_id]))
+            candidates = sorted({position for band_key in document_keys for position in kept_by_key.get(band_key, [])})
+            if candidates and (similarity(signature, np.stack([kept_signatures[position] for position in candidates])) >= threshold).any():
+                continue
+            for band_key in document_keys:
+                kept_by_key.setdefault(band_key, []).append(len(kept_signatures))
+            kept_signatures.append(signature)
+            kept.append(document_id)
+
+        return kept
+
+
+class MinHashQueryPipeline(MinHashPipeline):
+    def run(self, query, params):
+        """
+        Find the near duplicates of the query text, scored by their estimated Jaccard similarity.
+        """
+        signature = self.hasher.signatures([query])[0]
+        ids, scores = self.get_index(params['index']).query(signature, threshold=float(params.get('threshold', self.threshold)))
+        top_k = params.get('top_k')
+        if top_k is not None:
+            ids, scores = ids[:int(top_k)], scores[:int(top_k)]
+        return {'documents': [{'id': document_id, 'score': score} for document_id, score in zip(ids, scores)]}
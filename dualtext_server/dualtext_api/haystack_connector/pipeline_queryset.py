@@ -3,47 +3,66 @@ from .pipelines import initialized_pipelines
 query_pipelines = initialized_pipelines['query']
 
 class PipelineQueryset:
-    filters = {}
-    options = {}
-    query = ''
-
-    def __init__(self, document_class, pipeline_name, index):
+    """
+    An immutable query to a query pipeline. query, filter and set_options return a new queryset
+    and leave the original unchanged, so a queryset can be shared between threads.
+    """
+    def __init__(self, document_class, pipeline_name, index, query_string='', filters=None, options=None):
         try:
             self.pipeline = query_pipelines[pipeline_name]
         except KeyError:
             raise ValueError(f'{pipeline_name} does not exist.')
 
         self.document_class = document_class
-        self.options['index'] = index
+        self.pipeline_name = pipeline_name
+        self.query_string = query_string
+        self.filters = dict(filters or {})
+        self.options = {'index': index, **(options or {})}
+
+    def _clone(self, **changes):
+        arguments = {
+            'document_class': self.document_class,
+            'pipeline_name': self.pipeline_name,
+            'index': self.options['index'],
+            'query_string': self.query_string,
+            'filters': self.filters,
+            'options': self.options,
+            **changes
+        }
+        return self.__class__(**arguments)
 
     def set_options(self, **kwargs):
-        for key, value in kwargs.items():
-            self.options[key] = value
-        return self
+        return self._clone(options={**self.options, **kwargs})
 
     def filter(self, **kwargs):
-        for key, value in kwargs.items():
+        for key in kwargs:
             if key not in self.document_class.fields:
                 raise TypeError(
                     f'Unexpected keyword argument. '
-                    f'Document {self.document_class.__class__.__name__} does not have a {key} field.'
+                    f'Document {self.document_class.__name__} does not have a {key} field.'
                 )
 
-            self.filters[key] = value
-
-        return self
+        return self._clone(filters={**self.filters, **kwargs})
 
     def query(self, query):
         if not isinstance(query, str):
             raise TypeError(f'query needs to be of type string.')
 
-        self.query = query
-
-        return self
+        return self._clone(query_string=query)
 
     def run(self):
         return self.pipeline.search(
-            query=self.query,
-            filters=self.filters,
-            options=self.options
-        )
\ No newline at end of file
+            query=self.query_string,
+            filters=dict(self.filters),
+            options=dict(self.options)
+        )
+
+    def run_batch(self, queries, options):
+        """
+        Run several queries with the filters and options of this queryset, options holds additional options per query.
+        """
+        return self.pipeline.search_batch(
+            queries=queries,
+            filters=dict(self.filters),
+            options=[{**self.options, **query_options} for query_options in options]
+        )
@@ -1,34 +1,136 @@
+import importlib
+import os
+import threading
+import time
+from collections.abc import MutableMapping
 import yaml
 from .indexing_pipeline import IndexingPipeline
 from .query_pipeline import QueryPipeline
-from dualtext_api.haystack_connector import custom_pipelines
-import os
 
 
-def init_pipeline(pipeline_name, pipeline_cfg, pipeline_type, initialized_pipelines):
-    if pipeline_cfg.get('url', None) is None:
-        pipeline = getattr(custom_pipelines, pipeline_name)
-    else:
-        pipeline = None
+class Pipelines(MutableMapping):
+    """
+    The pipelines of one type by name. Pipelines of the config file are built on first access,
+    pipelines can also be set directly and are then kept until they are deleted.
+    """
+    def __init__(self, registry, pipeline_type):
+        self.registry = registry
+        self.pipeline_type = pipeline_type
+        self.configs = {}
+        self.built = {}
 
-    if pipeline_type == 'indexing':
-        initialized_pipelines['indexing'][pipeline_name] = IndexingPipeline(pipeline_name, pipeline, **pipeline_cfg)
-    elif pipeline_type == 'query':
-        initialized_pipelines['query'][pipeline_name] = QueryPipeline(pipeline_name, pipeline, **pipeline_cfg)
+    def __getitem__(self, name):
+        self.registry.reload_if_changed()
+        try:
+            return self.built[name]
+        except KeyError:
+            pass
+        with self.registry.lock:
+            if name not in self.built:
+                if name not in self.configs:
+                    raise KeyError(name)
+                self.built[name] = self.registry.build(name, self.configs[name], self.pipeline_type)
+            return self.built[name]
 
-    return initialized_pipelines
+    def __setitem__(self, name, pipeline):
+        with self.registry.lock:
+            self.configs.pop(name, None)
+            self.built[name] = pipeline
 
-module_dir = os.path.dirname(__file__)  # get current directory
-file_path = os.path.join(module_dir, 'pipeline_config.yml')
-with open(file_path, 'r') as f:
-    pipelines = yaml.safe_load(f) or {}
+    def __delitem__(self, name):
+        with self.registry.lock:
+            if name not in self.configs and name not in self.built:
+                raise KeyError(name)
+            self.configs.pop(name, None)
+            self.built.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self.names()
+
+    def __iter__(self):
+        return iter(self.names())
+
+    def __len__(self):
+        return len(self.names())
+
+    def names(self):
+        self.registry.reload_if_changed()
+        return list(dict.fromkeys([*self.configs, *self.built]))
+
+
+class PipelineRegistry:
+    """
+    Reads pipeline_config.yml and builds the configured pipelines when they are first used, so processes that
+    never index or search don't load custom_pipelines and its models. The config file is read again when it
+    changes: pipelines with a changed configuration are rebuilt on their next use, removed pipelines disappear.
+    """
+    PIPELINE_CLASSES = {'indexing': IndexingPipeline, 'query': QueryPipeline}
+    # seconds between checks of the modification time of the config file
+    CHECK_INTERVAL = 2
 
-initialized_pipelines = {
-    'indexing': {},
-    'query': {}
-}
+    def __init__(self, config_path):
+        self.config_path = config_path
+        self.lock = threading.RLock()
+        self.pipelines = {pipeline_type: Pipelines(self, pipeline_type) for pipeline_type in self.PIPELINE_CLASSES}
+        self.mtime = None
+        self.next_check = 0
 
+    def reload_if_changed(self):
+        now = time.monotonic()
+        if now < self.next_check:
+            return
+        with self.lock:
+            self.next_check = now + self.CHECK_INTERVAL
+            try:
+                mtime = os.stat(self.config_path).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime != self.mtime:
+                self.load_config()
+                self.mtime = mtime
+
+    def load_config(self):
+        try:
+            with open(self.config_path, 'r') as f:
+                config = yaml.safe_load(f) or {}
+        except FileNotFoundError:
+            config = {}
+
+        configs = {pipeline_type: {} for pipeline_type in self.PIPELINE_CLASSES}
+        for pipeline_name, pipeline_cfg in config.items():
+            pipeline_cfg = dict(pipeline_cfg)
+            pipeline_type = pipeline_cfg.pop('type')
+            configs[pipeline_type][pipeline_name] = pipeline_cfg
+
+        for pipeline_type, pipelines in self.pipelines.items():
+            for pipeline_name, pipeline_cfg in pipelines.configs.items():
+                if configs[pipeline_type].get(pipeline_name) != pipeline_cfg:
+                    pipelines.built.pop(pipeline_name, None)
+            pipelines.configs = configs[pipeline_type]
+
+    def build(self, pipeline_name, pipeline_cfg, pipeline_type):
+        if pipeline_cfg.get('url', None) is None:
+            custom_pipelines = importlib.import_module('dualtext_api.haystack_connector.custom_pipelines')
+            pipeline = getattr(custom_pipelines, pipeline_name)
+        else:
+            pipeline = None
+
+        return self.PIPELINE_CLASSES[pipeline_type](pipeline_name, pipeline, **pipeline_cfg)
+
+    def warm_up(self):
+        """
+        Build all configured pipelines and load their models. Called before the server forks its workers
+        (gunicorn --preload), the workers then share the loaded models copy-on-write.
+        """
+        for pipelines in self.pipelines.values():
+            for pipeline_name in pipelines.names():
+                pipeline = pipelines[pipeline_name].pipeline
+                if hasattr(pipeline, 'warm_up'):
+                    pipeline.warm_up()
+
+
+module_dir = os.path.dirname(__file__)  # get current directory
+file_path = os.path.join(module_dir, 'pipeline_config.yml')
 
-for pipeline_name, pipeline_cfg in pipelines.items():
-    pipeline_type = pipeline_cfg.pop('type')
-    initialized_pipelines = init_pipeline(pipeline_name, pipeline_cfg, pipeline_type, initialized_pipelines)
+registry = PipelineRegistry(file_path)
+initialized_pipelines = registry.pipelines
@@ -1,20 +1,24 @@
-import importlib
 import requests
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 
 class QueryPipeline:
-    def __init__(self, pipeline_name, pipeline=None, url=None, token=None, batch_size=500, **kwargs):
+    def __init__(self, pipeline_name, pipeline=None, url=None, token=None, batch_size=500, concurrency=4, timeout=10,
+                 **kwargs):
         self.pipeline = pipeline
         self.url = url
         self.token = token
         self.batch_size = batch_size
+        self.concurrency = concurrency
+        # seconds a search waits for the results of this pipeline, None waits indefinitely
+        self.timeout = timeout
         self.name = pipeline_name
 
         self.options = kwargs
 
     def search(self, query, filters, options):
-        params ={'filters': filters, **options}
+        params = {'filters': filters, **self.options, **options}
         if self.url is not None:
             response = self._perform_search_request(query, params)
         else:
@@ -22,13 +26,36 @@ class QueryPipeline:
 
         return response
 
+    def search_batch(self, queries, filters, options):
+        """
+        Run several queries, options holds the options of every query. Custom pipelines with a run_batch method
+        get all queries with the same options in one call, other pipelines are queried by up to concurrency threads.
+        """
+        if self.pipeline is not None and hasattr(self.pipeline, 'run_batch'):
+            groups = {}
+            for position, query_options in enumerate(options):
+                groups.setdefault(json.dumps(query_options, sort_keys=True, default=str), []).append(position)
+
+            responses = [None] * len(queries)
+            for positions in groups.values():
+                params = {'filters': filters, **self.options, **options[positions[0]]}
+                response = self.pipeline.run_batch(queries=[queries[position] for position in positions], params=params)
+                for position, documents in zip(positions, response['documents']):
+                    responses[position] = {'documents': documents}
+            return responses
+
+        if self.concurrency <= 1 or len(queries) <= 1:
+            return [self.search(query, filters, query_options) for query, query_options in zip(queries, options)]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return list(executor.map(lambda query, query_options: self.search(query, filters, query_options), queries, options))
+
     def _perform_search_request(self, query, params):
         body = {'query': query, **params}
         headers = {}
         if self.token is not None:
             headers = {'Authorization': f'Bearer {self.token}'}
 
-        response = requests.post(self.url, json=json.dumps(body), headers=headers)
+        response = requests.post(self.url, json=json.dumps(body), headers=headers, timeout=self.timeout)
         response.raise_for_status()
 
         return response.json
@@ -0,0 +1,248 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+import numpy as np
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class Segment:
+    """
+    An immutable directory of .npy arrays describing a batch of indexed documents.
+    Every segment stores the ids of its documents and the ids it deletes from older segments,
+    all other arrays are memory-mapped on first access.
+    """
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+        self.name = os.path.basename(path)
+        self.ids = self.array('ids')
+        self.deleted = self.array('deleted')
+        # set by the store: which documents of this segment are not shadowed by a newer segment
+        self.live = np.ones(len(self.ids), dtype=bool)
+        # values derived from the segment by the index types, valid as long as the segment is current
+        self.cache = {}
+        self._arrays = {}
+
+    def array(self, name):
+        return np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode='r')
+
+    def __getitem__(self, name):
+        if name not in self._arrays:
+            self._arrays[name] = self.array(name)
+        return self._arrays[name]
+
+
+class SegmentStore:
+    """
+    An append-only collection of segments in a directory, listed in a manifest.
+
+    Adding documents writes a new segment, the newest segment containing a document id wins,
+    so updates and deletes never rewrite existing files. Once there are merge_factor segments the newest
+    ones are merged into one by the merge function of the index type. Writers are serialized by a lock file,
+    readers only ever see complete segments.
+
+    Readers of other processes may still use merged segments, whose arrays are memory-mapped when they are
+    first accessed. Merged segments are therefore retired in the manifest and their directories are only
+    removed by a later write once they have been retired for longer than any search takes.
+    """
+    MANIFEST = 'manifest.json'
+    LOCK = '.lock'
+    RETIRE_SECONDS = 600
+
+    _thread_lock = threading.Lock()
+
+    def __init__(self, path, merge, merge_factor=10):
+        self.path = path
+        self.merge = merge
+        self.merge_factor = merge_factor
+        self._cache = None
+
+    def segments(self):
+        """
+        Return the current segments, oldest first, with their live masks set.
+        """
+        manifest = self._read_manifest()
+        key = tuple(entry['name'] for entry in manifest['segments'])
+        cache = self._cache
+        if cache is not None and cache[0] == key:
+            return cache[1]
+
+        try:
+            segments = [
+                Segment(os.path.join(self.path, entry['name']), entry.get('meta', {}))
+                for entry in manifest['segments']
+            ]
+        except FileNotFoundError:
+            # a merge replaced segments after the manifest was read
+            return self.segments()
+
+        self._set_live_masks(segments)
+        self._cache = (key, segments)
+        return segments
+
+    def add(self, ids, arrays, meta=None):
+        """
+        Write a segment for the given document ids. Duplicate ids keep their last occurrence.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        with self._lock():
+            self._append(ids, np.array([], dtype=np.int64), arrays, meta or {})
+            self._merge_tail()
+
+    def delete(self, ids):
+        """
+        Write a segment without documents removing the given ids from all older segments.
+        """
+        with self._lock():
+            self._append(np.array([], dtype=np.int64), np.asarray(ids, dtype=np.int64), {}, {})
+            self._merge_tail()
+
+    @staticmethod
+    def live_ids(segments):
+        return np.concatenate([segment.ids[segment.live] for segment in segments]) if segments else np.array([], dtype=np.int64)
+
+    def _set_live_masks(self, segments):
+        shadowed = np.array([], dtype=np.int64)
+        for segment in reversed(segments):
+            ids = np.asarray(segment.ids)
+            live = ~np.isin(ids, shadowed)
+            # within a segment the last occurrence of an id wins
+            _, last = np.unique(ids[::-1], return_index=True)
+            unique = np.zeros(len(ids), dtype=bool)
+            unique[len(ids) - 1 - last] = True
+            segment.live = live & unique
+            shadowed = np.union1d(shadowed, np.union1d(ids, segment.deleted))
+
+    def _append(self, ids, deleted, arrays, meta):
+        manifest = self._read_manifest()
+        name = self._write_segment(ids, deleted, arrays)
+        manifest['segments'].append({'name': name, 'meta': meta})
+        expired = self._expire_retired(manifest)
+        self._write_manifest(manifest)
+        self._remove(expired)
+
+    def _merge_tail(self):
+        """
+        Keep the number of segments below merge_factor by merging the newest ones.
+        Older segments only join the merge while they are at most merge_factor times the size of the newer
+        segments merged so far, so large segments are rarely rewritten. Only consecutive segments are merged
+        so that newer documents keep winning over older ones.
+        """
+        segments = self.segments()
+        if len(segments) < self.merge_factor:
+            return
+
+        merged_size = int(segments[-1].live.sum())
+        count = 1
+        for segment in reversed(segments[:-1]):
+            size = int(segment.live.sum())
+            if size > merged_size * self.merge_factor and count > 1:
+                break
+            merged_size += size
+            count += 1
+        tail = segments[-count:]
+
+        merged_ids = self.live_ids(tail)
+        # deletes have to be kept as long as there are older segments they apply to
+        if len(tail) == len(segments):
+            deleted = np.array([], dtype=np.int64)
+        else:
+            deleted = np.setdiff1d(np.concatenate([segment.deleted for segment in tail]), merged_ids)
+        arrays, meta = self.merge(tail)
+        name = self._write_segment(merged_ids, deleted, arrays)
+
+        manifest = self._read_manifest()
+        manifest['segments'] = manifest['segments'][:-len(tail)] + [{'name': name, 'meta': meta}]
+        retired_at = time.time()
+        manifest['retired'] = manifest.get('retired', []) + [{'name': segment.name, 'retired_at': retired_at} for segment in tail]
+        self._write_manifest(manifest)
+
+    def _expire_retired(self, manifest):
+        """
+        Drop the segments retired for longer than RETIRE_SECONDS from the manifest and return their names.
+        """
+        now = time.time()
+        retired = manifest.get('retired', [])
+        manifest['retired'] = [entry for entry in retired if now - entry['retired_at'] < self.RETIRE_SECONDS]
+        return [entry['name'] for entry in retired if now - entry['retired_at'] >= self.RETIRE_SECONDS]
+
+    def _remove(self, names):
+        for name in names:
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+    def _write_segment(self, ids, deleted, arrays):
+        os.makedirs(self.path, exist_ok=True)
+        name = 'segment-{}'.format(uuid.uuid4().hex)
+        tmp_path = os.path.join(self.path, 'tmp-' + name)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, 'ids.npy'), ids)
+        np.save(os.path.join(tmp_path, 'deleted.npy'), deleted)
+        for array_name, array in arrays.items():
+            array_path = os.path.join(tmp_path, f'{array_name}.npy')
+            # arrays larger than memory can be passed as a function writing the .npy file itself
+            if callable(array):
+                array(array_path)
+            else:
+                np.save(array_path, array)
+        os.rename(tmp_path, os.path.join(self.path, name))
+        return name
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.path, self.MANIFEST), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'segments': []}
+
+    def _write_manifest(self, manifest):
+        tmp_path = os.path.join(self.path, self.MANIFEST + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(self.path, self.MANIFEST))
+
+    @contextmanager
+    def _lock(self):
+        os.makedirs(self.path, exist_ok=True)
+        with self._thread_lock:
+            with open(os.path.join(self.path, self.LOCK), 'w') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class LocalIndexPipeline:
+    """
+    Base of the in-process pipelines storing their indexes below settings.DUALTEXT_INDEX_DIR.
+    Indexing and query pipelines with the same name work on the same indexes, one per index of the haystack document.
+    """
+    def __init__(self, name, index_dir=None, merge_factor=10):
+        self.name = name
+        self.index_dir = index_dir
+        self.merge_factor = merge_factor
+        self._indexes = {}
+
+    def create_index(self, path):
+        raise NotImplementedError
+
+    def index_path(self, index, name=None):
+        index_dir = self.index_dir or settings.DUALTEXT_INDEX_DIR
+        return os.path.join(index_dir, name or self.name, str(index))
+
+    def get_index(self, index):
+        index = str(index)
+        if index not in self._indexes:
+            self._indexes[index] = self.create_index(self.index_path(index))
+        return self._indexes[index]
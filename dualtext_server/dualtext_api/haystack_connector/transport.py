@@ -0,0 +1,45 @@
+import gzip
+import json
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class HttpTransport:
+    """
+    A persistent, pooled HTTP session posting JSON bodies to a pipeline service.
+    Bodies are gzip compressed if compress is set and requests are retried with exponential backoff on 429 and 5xx responses.
+    """
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, token=None, pool_size=10, retries=3, backoff_factor=0.5, compress=False, timeout=60):
+        self.compress = compress
+        self.timeout = timeout
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=self.RETRY_STATUSES,
+            allowed_methods=None,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
+        if token is not None:
+            self.session.headers.update({'Authorization': f'Bearer {token}'})
+
+    def post(self, url, body):
+        data = json.dumps(body).encode('utf-8')
+        headers = {}
+        if self.compress:
+            data = gzip.compress(data)
+            headers['Content-Encoding'] = 'gzip'
+
+        response = self.session.post(url, data=data, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+
+        return response
@@ -8,3 +8,9 @@ class DualtextDocument(Document):
     index_by = 'corpus__id'
     # indexing_pipelines = ['elastic_index']
     # query_pipelines = ['elastic_query', 'alternative_query']
+    # local search without an external service:
+    # indexing_pipelines = ['bm25_index']
+    # query_pipelines = ['bm25_query']
+    # near duplicates, needed by searches with collapse_duplicates:
+    # indexing_pipelines = ['bm25_index', 'minhash_index']
+    # duplicate_pipeline = 'minhash_index'
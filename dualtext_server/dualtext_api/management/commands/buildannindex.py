@@ -0,0 +1,86 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from dualtext_api.models import Corpus
+from dualtext_api.haystack_connector import custom_pipelines
+from dualtext_api.haystack_connector.ivfpq import IVFPQQueryPipeline
+
+class Command(BaseCommand):
+    help = 'Builds the approximate nearest neighbour index of a corpus from its dense embeddings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('corpus', nargs=1, type=int)
+        parser.add_argument('--pipeline', default='ann_query', help='Name of the approximate query pipeline in custom_pipelines')
+        parser.add_argument('--nlist', type=int, default=None, help='Number of coarse clusters, defaults to 4 * sqrt(documents)')
+        parser.add_argument('--m', type=int, default=None, help='Number of product quantizer sub-vectors, defaults to about dimension / 8')
+        parser.add_argument('--train-size', type=int, default=100000, help='Number of embeddings sampled to train the quantizers')
+        parser.add_argument('--iterations', type=int, default=20, help='Number of k-means iterations')
+        parser.add_argument('--benchmark', action='store_true', help='Report recall@k and latency against exact search')
+        parser.add_argument('--queries', type=int, default=100, help='Number of benchmark queries sampled from the corpus')
+        parser.add_argument('--k', type=int, default=10, help='Number of results compared per benchmark query')
+        parser.add_argument('--nprobe', type=int, nargs='*', default=None, help='nprobe values to benchmark, defaults to the pipeline setting')
+
+    def handle(self, *args, **options):
+        try:
+            corpus = Corpus.objects.get(id=options['corpus'][0], is_deleted=False)
+        except Corpus.DoesNotExist:
+            raise CommandError('Corpus {} does not exist'.format(options['corpus'][0]))
+
+        pipeline = getattr(custom_pipelines, options['pipeline'], None)
+        if not isinstance(pipeline, IVFPQQueryPipeline):
+            raise CommandError('{} is not an approximate query pipeline'.format(options['pipeline']))
+
+        start = time.monotonic()
+        try:
+            ann_index = pipeline.build(
+                corpus.id,
+                nlist=options['nlist'],
+                m=options['m'],
+                train_size=options['train_size'],
+                iterations=options['iterations']
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        dimension = ann_index.codebooks.shape[0] * ann_index.codebooks.shape[2]
+        exact_bytes = len(ann_index.ids) * dimension * np.dtype(pipeline.dtype).itemsize
+        self.stdout.write(self.style.SUCCESS(
+            'Built index of {} documents in {:.1f}s: {} lists, {} sub-vectors, {:.1f}x smaller than the embeddings'.format(
+                len(ann_index.ids), time.monotonic() - start, len(ann_index.centroids), ann_index.codebooks.shape[0],
+                exact_bytes / ann_index.nbytes
+            )
+        ))
+
+        if options['benchmark']:
+            for nprobe in options['nprobe'] or [pipeline.nprobe]:
+                self.benchmark(pipeline, ann_index, corpus.id, options['queries'], options['k'], nprobe)
+
+    def benchmark(self, pipeline, ann_index, corpus_id, queries, k, nprobe):
+        """
+        Compare the approximate results for embeddings sampled from the corpus with an exact search.
+        """
+        source = pipeline.source_index(corpus_id)
+        rng = np.random.default_rng(0)
+        probability = min(1.0, 2 * queries / max(len(ann_index.ids), 1))
+        query_vectors = np.concatenate([vectors[rng.random(len(vectors)) < probability] for ids, vectors in source.iterate()])
+        query_vectors = query_vectors[:queries]
+
+        recalls, exact_times, approximate_times = [], [], []
+        for vector in query_vectors:
+            start = time.monotonic()
+            exact_ids, _ = source.search(vector, top_k=k)
+            exact_times.append(time.monotonic() - start)
+
+            start = time.monotonic()
+            approximate_ids, _ = ann_index.search(vector, top_k=k, nprobe=nprobe, rerank=pipeline.rerank, vectors_of=source.vectors_of)
+            approximate_times.append(time.monotonic() - start)
+
+            recalls.append(len(set(exact_ids) & set(approximate_ids)) / max(len(exact_ids), 1))
+
+        self.stdout.write(
+            'nprobe {}: recall@{} {:.3f}, latency {:.2f}ms (p95 {:.2f}ms), exact search {:.2f}ms'.format(
+                nprobe, k, np.mean(recalls),
+                np.mean(approximate_times) * 1000, np.percentile(approximate_times, 95) * 1000,
+                np.mean(exact_times) * 1000
+            )
+        )
@@ -1,12 +1,98 @@
+import time
+import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from django.core.management.base import BaseCommand, CommandError
+from dualtext_api.models import Corpus, Document, IndexCheckpoint
+from dualtext_api.haystack_documents import DualtextDocument
+from dualtext_api.services import SearchCacheService
+
 class Command(BaseCommand):
-    help = 'Builds feature values for the provided features'
+    help = 'Re-indexes all documents of a corpus, resuming from the last checkpoint'
 
     def add_arguments(self, parser):
         parser.add_argument('corpus', nargs=1, type=int)
-        parser.add_argument('featurekey', nargs=1, type=str)
+        parser.add_argument('--chunk-size', type=int, default=500, help='Number of documents sent to the pipelines per batch')
+        parser.add_argument('--workers', type=int, default=4, help='Number of batches indexed concurrently')
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and re-index the whole corpus')
 
     def handle(self, *args, **options):
-        pass # TODO implement re-indexing
-        # runner = FeatureRunner()
-        # runner.build_feature(options['featurekey'][0], options['corpus'][0])
\ No newline at end of file
+        try:
+            corpus = Corpus.objects.get(id=options['corpus'][0], is_deleted=False)
+        except Corpus.DoesNotExist:
+            raise CommandError('Corpus {} does not exist'.format(options['corpus'][0]))
+
+        chunk_size = options['chunk_size']
+        workers = options['workers']
+        checkpoint, created = IndexCheckpoint.objects.get_or_create(corpus=corpus)
+        if options['restart']:
+            checkpoint.last_document_id = 0
+            checkpoint.save()
+
+        documents = Document.objects.filter(corpus=corpus, id__gt=checkpoint.last_document_id).order_by('id').only('id', 'content', 'corpus_id')
+        total = documents.count()
+        self.stdout.write('Indexing {} documents of corpus {} starting after document {}'.format(total, corpus.id, checkpoint.last_document_id))
+
+        # batches in submission order, the checkpoint only moves past batches whose predecessors are done as well
+        batches = deque()
+        in_flight = {}
+        self.indexed = 0
+        self.start = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                for batch in self.iterate_batches(documents, chunk_size):
+                    while len(in_flight) >= workers * 2:
+                        self.collect(in_flight, batches, checkpoint, total)
+                    future = executor.submit(self.index_batch, batch, corpus.id)
+                    entry = {'last_id': batch[-1].id, 'size': len(batch), 'done': False}
+                    batches.append(entry)
+                    in_flight[future] = entry
+                while in_flight:
+                    self.collect(in_flight, batches, checkpoint, total)
+            except Exception as e:
+                for future in in_flight:
+                    future.cancel()
+                raise CommandError('Indexing failed, resume from document {}: {}'.format(checkpoint.last_document_id, e))
+
+        self.stdout.write(self.style.SUCCESS('Indexed {} documents of corpus {}'.format(self.indexed, corpus.id)))
+
+    def iterate_batches(self, documents, chunk_size):
+        batch = []
+        for document in documents.iterator(chunk_size=chunk_size):
+            batch.append(document)
+            if len(batch) >= chunk_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def index_batch(self, documents, corpus_id):
+        DualtextDocument.save_batch(documents=documents, index=corpus_id, common_attributes={'corpus__id': corpus_id})
+
+    def collect(self, in_flight, batches, checkpoint, total):
+        done, not_done = wait(list(in_flight), return_when=FIRST_COMPLETED)
+        try:
+            for future in done:
+                entry = in_flight.pop(future)
+                future.result()
+                entry['done'] = True
+                self.indexed += entry['size']
+        finally:
+            # invalidated from the command's thread, the search cache may be a database table
+            SearchCacheService().invalidate(checkpoint.corpus_id)
+
+        last_id = None
+        while batches and batches[0]['done']:
+            last_id = batches.popleft()['last_id']
+        if last_id is not None:
+            checkpoint.last_document_id = last_id
+            checkpoint.save()
+
+        self.report_progress(total)
+
+    def report_progress(self, total):
+        elapsed = time.monotonic() - self.start
+        rate = self.indexed / elapsed if elapsed > 0 else 0
+        eta = datetime.timedelta(seconds=round((total - self.indexed) / rate)) if rate > 0 else 'unknown'
+        self.stdout.write('{}/{} documents indexed ({:.0f} documents/s, ETA {})'.format(self.indexed, total, rate, eta))
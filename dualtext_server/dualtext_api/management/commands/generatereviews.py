@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+from dualtext_api.services import TaskService
+
+class Command(BaseCommand):
+    help = 'Creates the review tasks of finished tasks that have no review yet in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, default=None, help='Only review the tasks of this project')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--loop', action='store_true', help='Keep polling for finished tasks instead of exiting once all are reviewed')
+        parser.add_argument('--sleep', type=float, default=5.0, help='Seconds to wait between polls when there is nothing to review')
+
+    def handle(self, *args, **options):
+        task_service = TaskService()
+        total = 0
+        while True:
+            generated = task_service.generate_pending_reviews(batch_size=options['batch_size'], project_id=options['project'])
+            total += generated
+            if generated > 0:
+                self.stdout.write('Generated {} reviews ({} total)'.format(generated, total))
+            elif options['loop']:
+                time.sleep(options['sleep'])
+            else:
+                break
@@ -0,0 +1,43 @@
+import time
+from django.core.management.base import BaseCommand
+from dualtext_api.services import IndexService
+
+class Command(BaseCommand):
+    help = 'Sends pending document index operations to the indexing pipelines in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new operations instead of exiting once the queue is empty')
+        parser.add_argument('--sleep', type=float, default=5.0, help='Seconds to wait between polls when the queue is empty')
+        parser.add_argument('--retry-failed', action='store_true', help='Queue the operations that failed too often again before starting')
+
+    def handle(self, *args, **options):
+        index_service = IndexService()
+        if options['retry_failed']:
+            self.stdout.write('Retrying {} failed operations'.format(index_service.retry_dead_letters()))
+
+        total = 0
+        while True:
+            try:
+                processed = index_service.process_pending(batch_size=options['batch_size'])
+            except Exception as e:
+                if not options['loop']:
+                    raise
+                # e.g. a lost database connection, the claimed operations become available again after their lease
+                self.stderr.write('Processing the index queue failed: {!r}'.format(e))
+                processed = 0
+            total += processed
+            if processed > 0:
+                self.stdout.write('Processed {} index operations ({} total)'.format(processed, total))
+            elif options['loop']:
+                time.sleep(options['sleep'])
+            else:
+                break
+
+        dead_letters = index_service.dead_letters().count()
+        if dead_letters:
+            self.stdout.write(self.style.WARNING(
+                '{} operations failed {} times and are skipped, see IndexOperation.last_error and use --retry-failed'.format(
+                    dead_letters, IndexService.MAX_ATTEMPTS
+                )
+            ))
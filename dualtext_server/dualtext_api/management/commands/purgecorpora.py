@@ -0,0 +1,27 @@
+import time
+from django.core.management.base import BaseCommand
+from dualtext_api.models import Corpus
+from dualtext_api.services import CorpusService
+
+class Command(BaseCommand):
+    help = 'Removes the documents, annotation links and index entries of deleted corpora in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=CorpusService.BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help='Keep polling for deleted corpora instead of exiting once none are left')
+        parser.add_argument('--sleep', type=float, default=5.0, help='Seconds to wait between polls when no corpus is deleted')
+
+    def handle(self, *args, **options):
+        corpus_service = CorpusService()
+        while True:
+            corpora = list(Corpus.objects.filter(is_deleted=True).order_by('id'))
+            for corpus in corpora:
+                deleted = corpus_service.purge(corpus, batch_size=options['batch_size'])
+                self.stdout.write('Purged corpus {} ({} documents)'.format(corpus.name, deleted))
+
+            if corpora:
+                continue
+            elif options['loop']:
+                time.sleep(options['sleep'])
+            else:
+                break
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from dualtext_api.models import Project
+from dualtext_api.services import TaskCountService
+
+class Command(BaseCommand):
+    help = 'Sets the open task counts of projects from their tasks, e.g. after tasks were changed by queryset updates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, default=None, help='Only recount the tasks of this project')
+
+    def handle(self, *args, **options):
+        projects = Project.objects.order_by('id')
+        if options['project'] is not None:
+            projects = projects.filter(id=options['project'])
+        task_count_service = TaskCountService()
+        for project_id, name in projects.values_list('id', 'name'):
+            counts = task_count_service.recount(project_id)
+            self.stdout.write('Project {}: {} open annotation tasks, {} open review tasks'.format(
+                name, counts['open_annotation_tasks'], counts['open_review_tasks']
+            ))
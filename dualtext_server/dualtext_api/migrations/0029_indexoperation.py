@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dualtext_api', '0028_annotation_annotation_meta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexOperation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dualtext_api.document')),
+            ],
+            options={
+                'ordering': ('created_at',),
+                'abstract': False,
+            },
+        ),
+    ]
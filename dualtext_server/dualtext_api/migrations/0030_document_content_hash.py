@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:32
+
+import hashlib
+from django.db import migrations, models
+
+
+def populate_content_hash(apps, schema_editor):
+    """
+    Hash the content of existing documents. Documents duplicating an earlier document of
+    the same corpus keep a null digest so that the unique constraint can be created.
+    """
+    Document = apps.get_model('dualtext_api', 'Document')
+    seen = set()
+    current_corpus = None
+    batch = []
+    documents = Document.objects.order_by('corpus_id', 'id').only('id', 'corpus_id', 'content')
+    for document in documents.iterator(chunk_size=2000):
+        if document.corpus_id != current_corpus:
+            current_corpus = document.corpus_id
+            seen = set()
+        content_hash = hashlib.sha256(document.content.encode('utf-8')).hexdigest()
+        if content_hash in seen:
+            continue
+        seen.add(content_hash)
+        document.content_hash = content_hash
+        batch.append(document)
+        if len(batch) >= 2000:
+            Document.objects.bulk_update(batch, ['content_hash'])
+            batch = []
+    Document.objects.bulk_update(batch, ['content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dualtext_api', '0029_indexoperation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='content_hash',
+            field=models.CharField(editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(populate_content_hash, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='document',
+            constraint=models.UniqueConstraint(fields=('corpus', 'content_hash'), name='unique_content_hash_in_corpus'),
+        ),
+    ]
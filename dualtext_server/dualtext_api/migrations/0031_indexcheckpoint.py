@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dualtext_api', '0030_document_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+                ('last_document_id', models.IntegerField(default=0)),
+                ('corpus', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='dualtext_api.corpus')),
+            ],
+            options={
+                'ordering': ('created_at',),
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dualtext_api', '0031_indexcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='corpus',
+            name='is_deleted',
+            field=models.BooleanField(blank=True, default=False),
+        ),
+    ]
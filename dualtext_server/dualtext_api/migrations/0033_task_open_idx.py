@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dualtext_api', '0032_corpus_is_deleted'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['project', 'is_finished', 'action', 'annotator'], name='task_open_idx'),
+        ),
+    ]
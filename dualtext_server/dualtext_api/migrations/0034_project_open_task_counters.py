@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:05
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def count_open_tasks(apps, schema_editor):
+    """
+    Count the tasks of existing projects that are neither claimed nor finished.
+    """
+    Project = apps.get_model('dualtext_api', 'Project')
+    Task = apps.get_model('dualtext_api', 'Task')
+    counts = Task.objects.filter(is_finished=False, annotator=None).values('project_id').annotate(
+        open_annotation_tasks=Count('id', filter=Q(action__in=['annotate', 'duplicate'])),
+        open_review_tasks=Count('id', filter=Q(action='review')),
+    ).order_by()
+    for count in counts:
+        Project.objects.filter(id=count['project_id']).update(
+            open_annotation_tasks=count['open_annotation_tasks'],
+            open_review_tasks=count['open_review_tasks'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dualtext_api', '0033_task_open_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='open_annotation_tasks',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='open_review_tasks',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_open_tasks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dualtext_api', '0034_project_open_task_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indexoperation',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='indexoperation',
+            name='available_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='indexoperation',
+            name='last_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
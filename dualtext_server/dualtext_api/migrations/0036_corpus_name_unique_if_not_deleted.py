@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('dualtext_api', '0035_indexoperation_retries'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='corpus',
+            name='unique_corpus_name',
+        ),
+        migrations.AddConstraint(
+            model_name='corpus',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_deleted', False)), fields=('name',), name='unique_corpus_name'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_open_task_counts(apps, schema_editor):
+    """
+    Move the open task counts of existing projects into their own table.
+    """
+    Project = apps.get_model('dualtext_api', 'Project')
+    OpenTaskCount = apps.get_model('dualtext_api', 'OpenTaskCount')
+    OpenTaskCount.objects.bulk_create([
+        OpenTaskCount(project_id=project_id, open_annotation_tasks=annotations, open_review_tasks=reviews)
+        for project_id, annotations, reviews in Project.objects.values_list('id', 'open_annotation_tasks', 'open_review_tasks')
+    ], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dualtext_api', '0036_corpus_name_unique_if_not_deleted'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpenTaskCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+                ('open_annotation_tasks', models.IntegerField(default=0)),
+                ('open_review_tasks', models.IntegerField(default=0)),
+                ('project', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='open_task_count', to='dualtext_api.project')),
+            ],
+            options={
+                'ordering': ('created_at',),
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(copy_open_task_counts, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='project',
+            name='open_annotation_tasks',
+        ),
+        migrations.RemoveField(
+            model_name='project',
+            name='open_review_tasks',
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:44
+
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_tables(apps, schema_editor):
+    """
+    Create the tables of database caches, e.g. of the 'search' cache, so installs upgraded with migrate alone have them.
+    Existing tables are left alone.
+    """
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dualtext_api', '0037_open_task_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_tables, migrations.RunPython.noop),
+    ]
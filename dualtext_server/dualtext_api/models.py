@@ -1,11 +1,61 @@
-from django.db import models
+import hashlib
+from django.core.management.color import no_style
+from django.db import models, connections, transaction, IntegrityError
 from django.contrib.auth.models import User, Group
 from .validators import validate_alphabetic
 
+class BulkCreateManager(models.Manager):
+    """
+    A manager providing a bulk insert that sets the primary keys on all created instances.
+    """
+    RESERVE_ATTEMPTS = 3
+
+    def bulk_create_with_ids(self, objs, batch_size=None):
+        objs = list(objs)
+        if not objs:
+            return objs
+
+        connection = connections[self.db]
+        if connection.features.can_return_rows_from_bulk_insert:
+            # PostgreSQL, MariaDB and SQLite >= 3.35 return the ids through INSERT ... RETURNING
+            return self.bulk_create(objs, batch_size=batch_size)
+
+        for attempt in range(self.RESERVE_ATTEMPTS):
+            try:
+                return self._bulk_create_reserved_ids(objs, batch_size)
+            except IntegrityError:
+                for obj in objs:
+                    obj.pk = None
+                if attempt == self.RESERVE_ATTEMPTS - 1:
+                    raise
+
+    def _bulk_create_reserved_ids(self, objs, batch_size):
+        """
+        Reserve a contiguous block of ids after the current maximum and insert with explicit primary keys.
+        The row lock on the highest id keeps concurrent reservations from overlapping where supported,
+        otherwise a colliding insert raises an IntegrityError and the block is reserved again.
+        """
+        with transaction.atomic(using=self.db):
+            last_id = self.get_queryset().select_for_update().order_by('-pk').values_list('pk', flat=True).first()
+            next_id = (last_id or 0) + 1
+            for offset, obj in enumerate(objs):
+                obj.pk = next_id + offset
+            objs = self.bulk_create(objs, batch_size=batch_size)
+            # explicit ids don't advance sequences or identity columns on every backend (e.g. Oracle),
+            # backends that need it get a reset to the highest id so later inserts don't collide
+            connection = connections[self.db]
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [self.model]):
+                    cursor.execute(sql)
+            return objs
+
+
 class AbstractBase(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     modified_at = models.DateTimeField(auto_now=True)
 
+    objects = BulkCreateManager()
+
     class Meta:
         abstract = True
         ordering = ('created_at',)
@@ -15,10 +65,13 @@ class Corpus(AbstractBase):
     name = models.CharField(max_length=255)
     corpus_meta = models.JSONField(blank=True, default=dict)
     allowed_groups = models.ManyToManyField(Group)
+    # deleted corpora are hidden immediately and purged in batches by the purgecorpora management command
+    is_deleted = models.BooleanField(blank=True, default=False)
 
     class Meta(AbstractBase.Meta):
         constraints = [
-            models.UniqueConstraint(fields=['name'], name='unique_corpus_name')
+            # deleted corpora keep their name until they are purged, it can be reused right away
+            models.UniqueConstraint(fields=['name'], condition=models.Q(is_deleted=False), name='unique_corpus_name')
         ]
 
 
@@ -26,6 +79,58 @@ class Document(AbstractBase):
     content = models.TextField(blank=True, default='')
     document_meta = models.JSONField(blank=True, default=dict)
     corpus = models.ForeignKey(Corpus, on_delete=models.CASCADE)
+    # sha256 digest of content, null for documents duplicating another document of the corpus
+    content_hash = models.CharField(max_length=64, null=True, editable=False)
+
+    class Meta(AbstractBase.Meta):
+        constraints = [
+            models.UniqueConstraint(fields=['corpus', 'content_hash'], name='unique_content_hash_in_corpus')
+        ]
+
+    @staticmethod
+    def hash_content(content):
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def save(self, *args, **kwargs):
+        # like the duplicates DocumentListSerializer allows, only the first document of a content in a corpus
+        # keeps the digest, the digest is looked up only for new documents, duplicates and changed content
+        content_hash = self.hash_content(self.content)
+        if content_hash == self.content_hash:
+            super().save(*args, **kwargs)
+            return
+        duplicates = Document.objects.filter(corpus_id=self.corpus_id, content_hash=content_hash).exclude(pk=self.pk)
+        self.content_hash = None if duplicates.exists() else content_hash
+        if self.content_hash is None:
+            super().save(*args, **kwargs)
+            return
+        try:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+        except IntegrityError:
+            # a concurrent save stored the same content first
+            self.content_hash = None
+            super().save(*args, **kwargs)
+
+
+class IndexOperation(AbstractBase):
+    """
+    A pending search index update, written in the same transaction as the document it refers to
+    and drained in batches by the processindexqueue management command.
+    """
+    document = models.ForeignKey(Document, on_delete=models.CASCADE)
+    # failed indexing attempts, operations reaching IndexService.MAX_ATTEMPTS are dead letters
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    # claimed or backed off operations are skipped until then
+    available_at = models.DateTimeField(null=True, blank=True)
+
+
+class IndexCheckpoint(AbstractBase):
+    """
+    The highest document id up to which a corpus has been re-indexed by the buildindex command.
+    """
+    corpus = models.OneToOneField(Corpus, on_delete=models.CASCADE)
+    last_document_id = models.IntegerField(default=0)
 
 
 class Project(AbstractBase):
@@ -52,6 +157,16 @@ class Project(AbstractBase):
         ]
 
 
+class OpenTaskCount(AbstractBase):
+    """
+    The numbers of tasks of a project that are neither claimed nor finished. Only TaskCountService writes them,
+    with F() updates, so saving a project never overwrites them.
+    """
+    project = models.OneToOneField(Project, on_delete=models.CASCADE, related_name='open_task_count')
+    open_annotation_tasks = models.IntegerField(default=0)
+    open_review_tasks = models.IntegerField(default=0)
+
+
 class Label(AbstractBase):
     name = models.CharField(max_length=255)
     project = models.ForeignKey(Project, on_delete=models.CASCADE)
@@ -85,6 +200,10 @@ class Task(AbstractBase):
         constraints = [
             models.UniqueConstraint(fields=['name', 'project'], name='unique_task_name_in_project')
         ]
+        indexes = [
+            # the open tasks of a project are claimed by this index
+            models.Index(fields=['project', 'is_finished', 'action', 'annotator'], name='task_open_idx'),
+        ]
 
 
 class AnnotationGroup(AbstractBase):
@@ -1,10 +1,11 @@
+from collections import defaultdict
 from django.contrib.auth.models import User, Group
-from django.db.models import Q
+from django.db import IntegrityError, transaction
 from rest_framework import serializers
 from rest_framework.validators import UniqueTogetherValidator, UniqueValidator
 from dualtext_api.models import Annotation, Project, Corpus, Task, Document, Prediction, Label
 from dualtext_api.models import AnnotationGroup
-from dualtext_api.haystack_documents import DualtextDocument
+from dualtext_api.services import IndexService
 from .validators import validate_alphabetic
 from django.utils import timezone
 
@@ -13,7 +14,7 @@ DEFAULT_FIELDS = ['created_at', 'modified_at']
 
 class CorpusSerializer(serializers.ModelSerializer):
     name = serializers.CharField(max_length=255, validators=[
-        UniqueValidator(queryset=Corpus.objects.all())
+        UniqueValidator(queryset=Corpus.objects.filter(is_deleted=False))
     ])
     document_count = serializers.SerializerMethodField('count_documents')
 
@@ -37,22 +38,87 @@ class GroupSerializer(serializers.ModelSerializer):
 
 
 class DocumentListSerializer(serializers.ListSerializer):
+    """
+    Creates documents in bulk. Documents whose content already exists in the corpus are handled
+    according to the on_duplicate context value: 'allow' creates them anyway, 'error' rejects the batch,
+    'skip' returns the existing document and 'update' returns the existing document with its document_meta replaced.
+    """
+    ALLOW = 'allow'
+    ERROR = 'error'
+    SKIP = 'skip'
+    UPDATE = 'update'
+    ON_DUPLICATE_CHOICES = (ALLOW, ERROR, SKIP, UPDATE)
+    # a concurrent insert of the same content makes a batch fail once, its retry finds the inserted documents
+    ATTEMPTS = 3
+
     def create(self, validated_data):
+        on_duplicate = self.context.get('on_duplicate', self.ALLOW)
+        for attempt in range(self.ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    return self.create_documents(validated_data, on_duplicate)
+            except IntegrityError:
+                if attempt == self.ATTEMPTS - 1:
+                    raise
+
+    def find_existing(self, documents):
+        """
+        Map the (corpus id, digest) of documents to the documents already stored with that digest,
+        with one indexed lookup per corpus.
+        """
+        existing = {}
+        hashes_by_corpus = defaultdict(set)
+        for document in documents:
+            hashes_by_corpus[document.corpus_id].add(document.content_hash)
+        for corpus_id, hashes in hashes_by_corpus.items():
+            for document in Document.objects.filter(corpus_id=corpus_id, content_hash__in=hashes):
+                existing[(corpus_id, document.content_hash)] = document
+        return existing
+
+    def create_documents(self, validated_data, on_duplicate):
         documents = [Document(**item) for item in validated_data]
-        now = timezone.now()
-        Document.objects.bulk_create(documents)
-
-        # This might be almost save to get an id from documents created in bulk_create
-        # It is not impossible for another document to have been created by another process
-        # since now was calculated but it's extremely unlikely that it has the same content.
-        # Postgres apparently provides ids on bulk_create so this might be resolved later.
-        contents = [doc.content for doc in documents]
-        documents = Document.objects.filter(Q(created_at__gte=now) & Q(content__in=contents)).all()
-        if len(documents) > 0:
-            corpus_id = documents[0].corpus.id
-            DualtextDocument.save_batch(documents=documents, index=corpus_id, common_attributes={'corpus__id': corpus_id})
-
-        return documents
+        for document in documents:
+            document.content_hash = Document.hash_content(document.content)
+        existing = self.find_existing(documents)
+
+        results = []
+        new_documents = []
+        updated_documents = {}
+        errors = []
+        for item, document in zip(validated_data, documents):
+            key = (document.corpus_id, document.content_hash)
+            duplicate = existing.get(key, None)
+            if duplicate is None:
+                existing[key] = document
+                new_documents.append(document)
+                results.append(document)
+                errors.append({})
+                continue
+
+            if on_duplicate == self.ALLOW:
+                # only the first document of a content in a corpus keeps the digest
+                document.content_hash = None
+                new_documents.append(document)
+                results.append(document)
+                errors.append({})
+                continue
+
+            errors.append({'content': ['A document with this content already exists in the corpus.']})
+            if on_duplicate == self.UPDATE and 'document_meta' in item:
+                duplicate.document_meta = document.document_meta
+                duplicate.modified_at = timezone.now()
+                if duplicate.pk is not None:
+                    updated_documents[duplicate.pk] = duplicate
+            results.append(duplicate)
+
+        if on_duplicate == self.ERROR and any(errors):
+            raise serializers.ValidationError(errors)
+
+        new_documents = Document.objects.bulk_create_with_ids(new_documents)
+        Document.objects.bulk_update(list(updated_documents.values()), ['document_meta', 'modified_at'])
+        # indexing happens outside of the request through the processindexqueue command
+        IndexService().enqueue(new_documents)
+        return results
 
 
 class DocumentSerializer(serializers.ModelSerializer):
@@ -63,6 +129,14 @@ class DocumentSerializer(serializers.ModelSerializer):
         fields = ['id', 'content', 'corpus', 'method', 'document_meta'] + DEFAULT_FIELDS
         read_only_fields = ['corpus', 'method']
 
+    def create(self, validated_data):
+        # a single document takes the same duplicate handling as a batch of one
+        list_serializer = DocumentListSerializer(child=DocumentSerializer(), context=self.context)
+        try:
+            return list_serializer.create([validated_data])[0]
+        except serializers.ValidationError as e:
+            raise serializers.ValidationError(e.detail[0])
+
 
 class ProjectSerializer(serializers.ModelSerializer):
     name = serializers.CharField(max_length=255, validators=[
@@ -155,6 +229,48 @@ class AnnotationSerializer(serializers.ModelSerializer):
         return data
 
 
+class AnnotationBatchItemSerializer(serializers.Serializer):
+    """
+    Validates the shape of a single annotation in a batch, related objects are checked for the whole batch by the AnnotationService.
+    """
+    documents = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    labels = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    annotation_group = serializers.IntegerField(required=False, allow_null=True, default=None)
+    annotation_meta = serializers.JSONField(required=False, default=dict)
+
+
+class SearchBatchItemSerializer(serializers.Serializer):
+    """
+    Validates a single search of a batch search.
+    """
+    query = serializers.CharField()
+    limit = serializers.IntegerField(min_value=0, required=False, allow_null=True, default=None)
+    offset = serializers.IntegerField(min_value=0, required=False, default=0)
+
+
+class SearchBatchSerializer(serializers.Serializer):
+    corpus = serializers.IntegerField()
+    method = serializers.CharField()
+    project = serializers.IntegerField(required=False, allow_null=True, default=None)
+    collapse_duplicates = serializers.BooleanField(required=False, default=False)
+    searches = SearchBatchItemSerializer(many=True)
+
+
+class TaskPartitionSerializer(serializers.Serializer):
+    """
+    Validates a pool of annotation ids or of document id lists to split into tasks.
+    """
+    task_size = serializers.IntegerField(min_value=1)
+    annotations = serializers.ListField(child=serializers.IntegerField(), required=False)
+    documents = serializers.ListField(child=serializers.ListField(child=serializers.IntegerField()), required=False)
+    keep_groups = serializers.BooleanField(required=False, default=False)
+
+    def validate(self, data):
+        if ('annotations' in data) == ('documents' in data):
+            raise serializers.ValidationError('Either annotations or documents are required.')
+        return data
+
+
 class AnnotationGroupSerializer(serializers.ModelSerializer):
     class Meta:
         model = AnnotationGroup
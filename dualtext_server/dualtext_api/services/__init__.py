@@ -1,5 +1,12 @@
 from .label_service import LabelService
+from .task_count_service import TaskCountService
 from .project_service import ProjectService
 from .user_service import UserService
 from .task_service import TaskService
 from .run_service import RunService
+from .index_service import IndexService
+from .annotation_service import AnnotationService
+from .project_import_service import ProjectImportService
+from .task_partition_service import TaskPartitionService
+from .corpus_service import CorpusService
+from .search_cache_service import SearchCacheService
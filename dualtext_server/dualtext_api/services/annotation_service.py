@@ -0,0 +1,78 @@
+from rest_framework import serializers
+from dualtext_api.models import Annotation, AnnotationGroup, Document, Label
+
+class AnnotationService():
+    """
+    A service to create annotations together with their documents and labels in bulk.
+    """
+    BATCH_SIZE = 2000
+
+    def bulk_create(self, annotations, document_ids=None, label_ids=None):
+        """
+        Create unsaved annotation instances and fill both many-to-many through tables with one bulk insert each.
+        document_ids and label_ids are lists of id lists running parallel to annotations. Ids repeated within
+        one list are linked once, as the through tables don't allow a pair twice.
+        """
+        annotations = Annotation.objects.bulk_create_with_ids(annotations, batch_size=self.BATCH_SIZE)
+
+        if document_ids is not None:
+            through = Annotation.documents.through
+            rows = [
+                through(annotation_id=annotation.id, document_id=document_id)
+                for annotation, ids in zip(annotations, document_ids) for document_id in dict.fromkeys(ids)
+            ]
+            through.objects.bulk_create(rows, batch_size=self.BATCH_SIZE)
+
+        if label_ids is not None:
+            through = Annotation.labels.through
+            rows = [
+                through(annotation_id=annotation.id, label_id=label_id)
+                for annotation, ids in zip(annotations, label_ids) for label_id in dict.fromkeys(ids)
+            ]
+            through.objects.bulk_create(rows, batch_size=self.BATCH_SIZE)
+
+        return annotations
+
+    def create_for_task(self, task, items):
+        """
+        Validate a list of annotation payloads against a task and its project with one query per related model
+        and create them in bulk. Each item holds documents, labels, annotation_group and annotation_meta.
+        """
+        project = task.project
+        document_ids = set(d for item in items for d in item.get('documents', []))
+        label_ids = set(l for item in items for l in item.get('labels', []))
+        group_ids = set(item['annotation_group'] for item in items if item.get('annotation_group', None) is not None)
+
+        existing_documents = set(Document.objects.filter(id__in=document_ids).values_list('id', flat=True))
+        project_labels = set(Label.objects.filter(id__in=label_ids, project=project).values_list('id', flat=True))
+        task_groups = set(AnnotationGroup.objects.filter(id__in=group_ids, task=task).values_list('id', flat=True))
+
+        errors = []
+        for item in items:
+            item_errors = {}
+            documents = list(dict.fromkeys(item.get('documents', [])))
+            missing_documents = [d for d in documents if d not in existing_documents]
+            if missing_documents:
+                item_errors['documents'] = [f'Invalid pk "{d}" - object does not exist.' for d in missing_documents]
+            elif len(documents) > project.max_documents:
+                item_errors['documents'] = [f'The annotation may have a maximum of {project.max_documents} documents.']
+            invalid_labels = [l for l in item.get('labels', []) if l not in project_labels]
+            if invalid_labels:
+                item_errors['labels'] = [f'Label "{l}" does not belong to the project of this task.' for l in invalid_labels]
+            group = item.get('annotation_group', None)
+            if group is not None and group not in task_groups:
+                item_errors['annotation_group'] = ['Annotation must belong to the same task as its group.']
+            errors.append(item_errors)
+
+        if any(errors):
+            raise serializers.ValidationError(errors)
+
+        annotations = [
+            Annotation(task=task, annotation_group_id=item.get('annotation_group', None), annotation_meta=item.get('annotation_meta', {}))
+            for item in items
+        ]
+        return self.bulk_create(
+            annotations,
+            document_ids=[item.get('documents', []) for item in items],
+            label_ids=[item.get('labels', []) for item in items]
+        )
@@ -0,0 +1,66 @@
+from django.db import transaction
+from dualtext_api.models import Annotation, Document, IndexOperation
+from dualtext_api.haystack_documents import DualtextDocument
+from .search_cache_service import SearchCacheService
+
+class CorpusService():
+    """
+    A service to delete corpora without cascading over all of their documents in a single transaction.
+    """
+    BATCH_SIZE = 1000
+
+    def mark_deleted(self, corpus):
+        corpus.is_deleted = True
+        corpus.save(update_fields=['is_deleted', 'modified_at'])
+
+    def purge(self, corpus, batch_size=BATCH_SIZE):
+        """
+        Delete the documents of a corpus batch by batch, then the corpus itself.
+        Returns the number of deleted documents.
+        """
+        total = 0
+        while True:
+            deleted = self.purge_batch(corpus, batch_size)
+            if deleted == 0:
+                break
+            total += deleted
+
+        corpus.delete()
+        return total
+
+    def purge_batch(self, corpus, batch_size=BATCH_SIZE):
+        """
+        Remove up to batch_size documents of a corpus from the search index and the database.
+        The index is cleaned up first and outside of the transaction, so no rows are locked while the pipelines
+        are called. If a pipeline fails the documents are kept and retried on the next run, removing them
+        from the index again is harmless.
+        """
+        document_ids = list(
+            Document.objects.filter(corpus=corpus).order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not document_ids:
+            return 0
+
+        DualtextDocument.delete_batch(ids=document_ids, index=corpus.id)
+        with transaction.atomic():
+            Annotation.documents.through.objects.filter(document_id__in=document_ids).delete()
+            IndexOperation.objects.filter(document_id__in=document_ids).delete()
+            Document.objects.filter(id__in=document_ids).delete()
+        SearchCacheService().invalidate(corpus.id)
+
+        return len(document_ids)
+
+    def delete_index_entries(self, corpus, batch_size=BATCH_SIZE):
+        """
+        Remove all remaining documents of a corpus from the search index.
+        """
+        document_ids = Document.objects.filter(corpus=corpus).order_by('id').values_list('id', flat=True)
+        batch = []
+        for document_id in document_ids.iterator(chunk_size=batch_size):
+            batch.append(document_id)
+            if len(batch) == batch_size:
+                DualtextDocument.delete_batch(ids=batch, index=corpus.id)
+                batch = []
+        if batch:
+            DualtextDocument.delete_batch(ids=batch, index=corpus.id)
+        SearchCacheService().invalidate(corpus.id)
@@ -0,0 +1,95 @@
+import datetime
+from collections import defaultdict
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from dualtext_api.models import IndexOperation
+from dualtext_api.haystack_documents import DualtextDocument
+from .search_cache_service import SearchCacheService
+
+class IndexService():
+    """
+    A service to defer search indexing through the IndexOperation outbox.
+    """
+    # operations that failed this often are left in the outbox as dead letters until they are retried explicitly
+    MAX_ATTEMPTS = 5
+    # seconds a claimed operation is hidden from other workers, also the base of the retry backoff
+    LEASE_SECONDS = 300
+    RETRY_SECONDS = 30
+
+    def enqueue(self, documents):
+        operations = [IndexOperation(document_id=document.id) for document in documents]
+        IndexOperation.objects.bulk_create(operations)
+
+    def available(self):
+        now = timezone.now()
+        return IndexOperation.objects.filter(
+            Q(available_at__isnull=True) | Q(available_at__lte=now), attempts__lt=self.MAX_ATTEMPTS
+        )
+
+    def dead_letters(self):
+        return IndexOperation.objects.filter(attempts__gte=self.MAX_ATTEMPTS)
+
+    def retry_dead_letters(self):
+        """
+        Put the operations that failed MAX_ATTEMPTS times back into the queue. Returns their number.
+        """
+        return self.dead_letters().update(attempts=0, available_at=None)
+
+    def claim(self, batch_size):
+        """
+        Lease up to batch_size available operations. The lease is committed before any pipeline is called,
+        so no row locks are held while indexing and other workers skip the claimed operations.
+        """
+        with transaction.atomic():
+            operations = self.available().order_by('id')
+            if connection.features.has_select_for_update_skip_locked and connection.features.has_select_for_update_of:
+                operations = operations.select_for_update(skip_locked=True, of=('self',))
+            operations = list(operations.select_related('document')[:batch_size])
+            lease = timezone.now() + datetime.timedelta(seconds=self.LEASE_SECONDS)
+            IndexOperation.objects.filter(id__in=[operation.id for operation in operations]).update(available_at=lease)
+        return operations
+
+    def process_pending(self, batch_size=1000):
+        """
+        Index up to batch_size pending documents and remove their operations from the outbox.
+        Operations of a failing batch are retried one document at a time after a backoff, so a document
+        that can't be indexed only holds up itself and ends up as a dead letter. Returns the number of claimed operations.
+        """
+        operations = self.claim(batch_size)
+
+        operations_by_corpus = defaultdict(list)
+        for operation in operations:
+            operations_by_corpus[operation.document.corpus_id].append(operation)
+
+        for corpus_id, corpus_operations in operations_by_corpus.items():
+            # operations that failed before are indexed alone
+            batches = [[operation] for operation in corpus_operations if operation.attempts > 0]
+            fresh = [operation for operation in corpus_operations if operation.attempts == 0]
+            if fresh:
+                batches.append(fresh)
+            for batch in batches:
+                self.index_batch(corpus_id, batch)
+
+        return len(operations)
+
+    def index_batch(self, corpus_id, operations):
+        documents = {operation.document_id: operation.document for operation in operations}
+        operation_ids = [operation.id for operation in operations]
+        try:
+            DualtextDocument.save_batch(
+                documents=list(documents.values()),
+                index=corpus_id,
+                common_attributes={'corpus__id': corpus_id}
+            )
+        except Exception as e:
+            attempts = max(operation.attempts for operation in operations) + 1
+            retry_at = timezone.now() + datetime.timedelta(seconds=self.RETRY_SECONDS * 2 ** (attempts - 1))
+            IndexOperation.objects.filter(id__in=operation_ids).update(
+                attempts=F('attempts') + 1, last_error=repr(e), available_at=retry_at
+            )
+            return False
+
+        SearchCacheService().invalidate(corpus_id)
+        IndexOperation.objects.filter(id__in=operation_ids).delete()
+        return True
@@ -0,0 +1,260 @@
+from collections import defaultdict
+from django.db import transaction
+from rest_framework import serializers
+from dualtext_api.models import Annotation, AnnotationGroup, Label, Task
+from .annotation_service import AnnotationService
+from .label_service import LabelService
+from .task_count_service import TaskCountService
+
+class ProjectImportService():
+    """
+    A service to create a whole project (corpus, documents, labels, tasks, annotation groups and annotations)
+    from a document following the project_from_scratch schema of the client.
+    Imports are read as a sequence of (section, item) records, so that large uploads can be parsed line by line
+    and their documents inserted in chunks. Only the fields annotations are matched by are kept of inserted documents.
+    """
+    DOCUMENT_CHUNK_SIZE = 2000
+    # sections holding a list of items and the record type of their items
+    LIST_SECTIONS = {
+        'labels': 'label',
+        'documents': 'document',
+        'annotations': 'annotation',
+        'annotation_groups': 'annotation_group',
+    }
+
+    def __init__(self, user, task_size=20):
+        self.user = user
+        self.task_size = task_size
+
+    def run(self, data):
+        for key in ['project', 'corpus', 'annotations']:
+            if key not in data:
+                raise serializers.ValidationError({key: ['This field is required.']})
+        return self.run_records(self.records(data))
+
+    def records(self, data):
+        """
+        Split an object of sections into records. The corpus and the project come first, list sections
+        (e.g. documents) yield one record per item and single items (e.g. document) are passed on.
+        """
+        for key in ['corpus', 'project']:
+            if key in data:
+                yield key, data[key]
+        for key, record_type in self.LIST_SECTIONS.items():
+            for item in data.get(key, None) or []:
+                yield record_type, item
+            if record_type in data:
+                yield record_type, data[record_type]
+
+    def run_records(self, records):
+        # imported here to avoid a circular import between serializers and services
+        from dualtext_api.serializers import CorpusSerializer, ProjectSerializer, LabelSerializer
+
+        corpus = None
+        project_data = None
+        labels = []
+        annotations = []
+        groups = []
+        documents = []
+        document_ids = []
+        document_references = []
+        with transaction.atomic():
+            for record_type, item in records:
+                if record_type == 'corpus':
+                    corpus_serializer = CorpusSerializer(data=item)
+                    corpus_serializer.is_valid(raise_exception=True)
+                    corpus = corpus_serializer.save()
+                elif record_type == 'project':
+                    project_data = item
+                elif record_type == 'label':
+                    labels.append(item)
+                elif record_type == 'document':
+                    if corpus is None:
+                        raise serializers.ValidationError({'documents': ['Documents have to follow the corpus.']})
+                    documents.append(item)
+                    if len(documents) >= self.DOCUMENT_CHUNK_SIZE:
+                        self.create_documents(documents, corpus, document_ids, document_references)
+                        documents = []
+                elif record_type == 'annotation':
+                    annotations.append(item)
+                elif record_type == 'annotation_group':
+                    groups.append(item)
+
+            for key, value in [('corpus', corpus), ('project', project_data)]:
+                if value is None:
+                    raise serializers.ValidationError({key: ['This field is required.']})
+            self.create_documents(documents, corpus, document_ids, document_references)
+
+            project_serializer = ProjectSerializer(data={**project_data, 'corpora': [corpus.id]})
+            project_serializer.is_valid(raise_exception=True)
+            project = project_serializer.save(creator=self.user)
+
+            labels = self.create_labels(labels, project, LabelSerializer)
+
+            tasks, annotation_ids = self.create_tasks(
+                project,
+                annotations,
+                groups or None,
+                labels,
+                self.build_document_lookup(annotations, document_references, document_ids)
+            )
+
+        return {
+            'project': project.id,
+            'corpus': corpus.id,
+            'labels': {label.name: label.id for label in labels.values()},
+            'documents': document_ids,
+            'tasks': [task.id for task in tasks],
+            'annotations': annotation_ids,
+        }
+
+    def create_documents(self, documents, corpus, document_ids, document_references):
+        """
+        Insert a chunk of documents, appending their ids to document_ids and the fields annotations
+        reference them by to document_references.
+        """
+        from dualtext_api.serializers import DocumentSerializer
+
+        if not documents:
+            return
+        document_serializer = DocumentSerializer(data=documents, many=True, context={'on_duplicate': 'skip'})
+        if not document_serializer.is_valid():
+            offset = len(document_ids)
+            raise serializers.ValidationError({'documents': {
+                offset + idx: errors for idx, errors in enumerate(document_serializer.errors) if errors
+            }})
+        created_documents = document_serializer.save(corpus=corpus)
+        document_ids.extend(document.id for document in created_documents)
+        document_references.extend(
+            {key: document[key] for key in ['annotation_identifier', 'document_meta'] if key in document}
+            for document in documents
+        )
+
+    def create_labels(self, labels, project, serializer):
+        names = [label.get('name', None) for label in labels]
+        if len(set(names)) != len(names):
+            raise serializers.ValidationError({'labels': ['Label names must be unique.']})
+
+        colors = LabelService().colors
+        instances = []
+        for idx, label in enumerate(labels):
+            color = colors[idx] if idx < len(colors) else LabelService().default_color
+            serialized = serializer(data={'color': color, **label, 'project': project.id})
+            serialized.is_valid(raise_exception=True)
+            instances.append(Label(**serialized.validated_data))
+
+        instances = Label.objects.bulk_create_with_ids(instances)
+        return {label.name: label for label in instances}
+
+    def identifier_key(self, identifier):
+        if isinstance(identifier, dict):
+            return identifier.get('unique_id', None)
+        return identifier
+
+    def build_document_lookup(self, annotations, documents, document_ids):
+        """
+        Map (key, value) pairs to created document ids in one pass over the documents.
+        Documents reference annotations either through a document_meta key named by the annotation identifier
+        or through a top-level annotation_identifier.
+        """
+        meta_keys = set()
+        for annotation in annotations:
+            identifier = annotation.get('identifier', None)
+            if isinstance(identifier, dict) and identifier.get('document_meta_key', None):
+                meta_keys.add(identifier['document_meta_key'])
+
+        lookup = defaultdict(list)
+        for document, document_id in zip(documents, document_ids):
+            if 'annotation_identifier' in document:
+                lookup[('annotation_identifier', document['annotation_identifier'])].append((document, document_id))
+            meta = document.get('document_meta', None) or {}
+            for key in meta_keys:
+                values = meta.get(key, None)
+                if values is None:
+                    continue
+                if not isinstance(values, list):
+                    values = [values]
+                for value in values:
+                    lookup[(key, value)].append((document, document_id))
+
+        return lookup
+
+    def find_documents(self, identifier, lookup):
+        """
+        The ids of the documents an annotation identifier refers to. A document_meta value matches a unique_id
+        if it is equal to it or, for lists, contains it. Unlike the client's create_from_scratch, string values
+        are not searched for substrings.
+        """
+        if not isinstance(identifier, dict):
+            return [document_id for document, document_id in lookup.get(('annotation_identifier', identifier), [])]
+
+        unique_id = identifier.get('unique_id', None)
+        matches = lookup.get((identifier.get('document_meta_key', None), unique_id), [])
+        # the document the annotation id originates from comes first, as in the client's create_from_scratch
+        def is_origin(match):
+            doc_id = (match[0].get('document_meta', None) or {}).get('doc_id', None)
+            return doc_id is not None and str(unique_id).startswith(str(doc_id))
+        return [document_id for document, document_id in sorted(matches, key=lambda match: not is_origin(match))]
+
+    def split_list(self, lst, chunk_size):
+        return [lst[i:i + chunk_size] for i in range(0, len(lst), chunk_size)]
+
+    def create_tasks(self, project, annotations, groups, labels, document_lookup):
+        if groups:
+            chunks = []
+            annotations_by_key = {self.identifier_key(a.get('identifier', None)): a for a in annotations}
+            for group_chunk in self.split_list(groups, self.task_size):
+                chunk_annotations = []
+                for group in group_chunk:
+                    chunk_annotations.extend(
+                        annotations_by_key[key] for key in group.get('annotation_ids', []) if key in annotations_by_key
+                    )
+                chunks.append((chunk_annotations, group_chunk))
+        else:
+            chunks = [(chunk, None) for chunk in self.split_list(annotations, self.task_size)]
+
+        tasks = [Task(name='P{}T{}'.format(project.id, idx), project=project) for idx in range(len(chunks))]
+        tasks = Task.objects.bulk_create_with_ids(tasks)
+        TaskCountService().add(tasks)
+
+        # one annotation group per input group, keyed by the annotation identifiers it contains
+        group_by_annotation = {}
+        new_groups = []
+        for task, (chunk_annotations, group_chunk) in zip(tasks, chunks):
+            for group in group_chunk or []:
+                annotation_group = AnnotationGroup(task=task)
+                new_groups.append(annotation_group)
+                for key in group.get('annotation_ids', []):
+                    group_by_annotation[(task.id, key)] = annotation_group
+        AnnotationGroup.objects.bulk_create_with_ids(new_groups)
+
+        instances = []
+        document_ids = []
+        label_ids = []
+        keys = []
+        for task, (chunk_annotations, group_chunk) in zip(tasks, chunks):
+            for annotation in chunk_annotations:
+                key = self.identifier_key(annotation.get('identifier', None))
+                documents = self.find_documents(annotation.get('identifier', None), document_lookup)
+                if len(documents) > project.max_documents:
+                    raise serializers.ValidationError(
+                        {'annotations': [f'Annotation {key} has more than the allowed {project.max_documents} documents.']}
+                    )
+                try:
+                    annotation_labels = [labels[name].id for name in annotation.get('labels', None) or []]
+                except KeyError as e:
+                    raise serializers.ValidationError({'annotations': [f'Annotation {key} uses the unknown label {e}.']})
+
+                instances.append(Annotation(
+                    task=task,
+                    annotation_meta=annotation.get('annotation_meta', {}),
+                    annotation_group=group_by_annotation.get((task.id, key), None)
+                ))
+                document_ids.append(documents)
+                label_ids.append(annotation_labels)
+                keys.append(key)
+
+        instances = AnnotationService().bulk_create(instances, document_ids=document_ids, label_ids=label_ids)
+        annotation_ids = {str(key): annotation.id for key, annotation in zip(keys, instances)}
+
+        return tasks, annotation_ids
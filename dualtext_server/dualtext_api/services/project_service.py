@@ -1,12 +1,18 @@
+from django.db import connection, transaction
 from django.db.models import Q
+from django.utils import timezone
 from operator import itemgetter
 from dualtext_api.models import Project, Annotation, Label, Task, Run, Lap
 from collections import defaultdict
 from .run_service import RunService
+from .task_count_service import TaskCountService
 import math
 import datetime
 
 class ProjectService():
+    # number of open tasks tried per query by the conditional update claim
+    CLAIM_CANDIDATES = 10
+
     def __init__(self, project_id):
         self.project = Project.objects.get(id=project_id)
         self.total_annotations = None
@@ -146,22 +152,47 @@ class ProjectService():
             return self.open_review_tasks
     
     def claim_annotation_task(self, user):
-        task = self.get_open_annotation_tasks(user).first()
-        if task is not None:
-            task.annotator = user
-            task.save()
-            return task
-        else:
-            return None
-    
+        return self.claim_task(self.get_open_annotation_tasks(user), user)
+
     def claim_review_task(self, user):
-        task = self.get_open_review_tasks(user).first()
-        if task is not None:
-            task.annotator = user
-            task.save()
-            return task
-        else:
-            return None
+        return self.claim_task(self.get_open_review_tasks(user), user)
+
+    def claim_task(self, open_tasks, user):
+        """
+        Assign the oldest of the open tasks to user and return it, or None if there is no task left.
+        A task is never handed to two users, even if they claim at the same time.
+        """
+        open_tasks = open_tasks.order_by('id')
+        features = connection.features
+        if features.has_select_for_update_skip_locked:
+            with transaction.atomic():
+                if features.has_select_for_update_of:
+                    open_tasks = open_tasks.select_for_update(skip_locked=True, of=('self',))
+                else:
+                    open_tasks = open_tasks.select_for_update(skip_locked=True)
+                # concurrent claims skip the rows locked by each other instead of waiting for them
+                task = open_tasks.first()
+                if task is None:
+                    return None
+                counter = TaskCountService().counter_of(task)
+                task.annotator = user
+                task.modified_at = timezone.now()
+                Task.objects.filter(id=task.id).update(annotator=user, modified_at=task.modified_at)
+                TaskCountService().remember(task)
+                TaskCountService().change(counter, None)
+                return task
+
+        # backends without row locks assign the task with a conditional update and try the next one if it lost
+        while True:
+            task_ids = list(open_tasks.values_list('id', flat=True)[:self.CLAIM_CANDIDATES])
+            if not task_ids:
+                return None
+            for task_id in task_ids:
+                with transaction.atomic():
+                    counter = TaskCountService().stored_counter_of(task_id)
+                    if Task.objects.filter(id=task_id, annotator=None).update(annotator=user, modified_at=timezone.now()):
+                        TaskCountService().change(counter, None)
+                        return Task.objects.get(id=task_id)
 
     def get_task_statistics(self):
         total = self.get_total_tasks().count()
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import time
+import unicodedata
+from django.core.cache import caches
+from dualtext_api.haystack_documents import DualtextDocument
+
+class SearchCacheService():
+    """
+    A cache of search pipeline results in the 'search' cache, shared by all workers if the cache backend is.
+    Every corpus has a version that is part of the cache keys. Changing the search index of a corpus increases
+    its version, entries of older versions are never read again and expire by LRU or timeout.
+    """
+    VERSION_KEY = 'search-version:{}'
+    RESULT_KEY = 'search:{}:{}:{}'
+
+    def __init__(self, run=None):
+        self.cache = caches['search']
+        # called with the pipeline request of a cache miss and returning its result, e.g. to bound it by a timeout
+        self.run = run
+
+    def search(self, corpus_id, method, query, options=None):
+        """
+        Return the results of the method query pipeline for the query in a corpus, from the cache if possible.
+        """
+        options = {**(options or {}), 'index': corpus_id}
+        query = self.normalize_query(query)
+        # the version is read before running the pipeline, so results racing with an index update are stored as outdated
+        key = self.make_key(corpus_id, method, query, options)
+        results = self.cache.get(key)
+        if results is None:
+            query_set = DualtextDocument.query_pipeline(pipeline_name=method)
+            results = self.serialize(self.request(query_set.query(query).set_options(**options).run))
+            self.cache.set(key, results)
+        return results
+
+    def search_many(self, corpus_id, method, searches):
+        """
+        Return the results of several (query, options) searches in a corpus. The searches missing from the cache
+        are run with a single batch search of the query pipeline.
+        """
+        searches = [(self.normalize_query(query), {**(options or {}), 'index': corpus_id}) for query, options in searches]
+        version = self.get_version(corpus_id)
+        keys = [self.make_key(corpus_id, method, query, options, version=version) for query, options in searches]
+        results = self.cache.get_many(keys)
+
+        missing = [position for position, key in enumerate(keys) if key not in results]
+        if missing:
+            query_set = DualtextDocument.query_pipeline(pipeline_name=method)
+            responses = self.request(lambda: query_set.run_batch(
+                queries=[searches[position][0] for position in missing],
+                options=[searches[position][1] for position in missing]
+            ))
+            fresh = {keys[position]: self.serialize(response) for position, response in zip(missing, responses)}
+            self.cache.set_many(fresh)
+            results.update(fresh)
+
+        return [results[key] for key in keys]
+
+    def request(self, call):
+        return call() if self.run is None else self.run(call)
+
+    def invalidate(self, corpus_id):
+        key = self.VERSION_KEY.format(corpus_id)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.get_version(corpus_id)
+
+    def get_version(self, corpus_id):
+        key = self.VERSION_KEY.format(corpus_id)
+        # versions start at the current time, so a lost version can't be confused with one that was already used
+        self.cache.add(key, int(time.time() * 1000), timeout=None)
+        return self.cache.get(key)
+
+    def make_key(self, corpus_id, method, query, options, version=None):
+        digest = hashlib.sha256(json.dumps([method, query, options], sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        if version is None:
+            version = self.get_version(corpus_id)
+        return self.RESULT_KEY.format(corpus_id, version, digest)
+
+    @staticmethod
+    def normalize_query(query):
+        return ' '.join(unicodedata.normalize('NFC', query).split())
+
+    @staticmethod
+    def serialize(results):
+        documents = []
+        for document in results['documents']:
+            if isinstance(document, dict):
+                documents.append({'id': document['id'], 'score': document.get('score')})
+            else:
+                documents.append({'id': document.id, 'score': getattr(document, 'score', None)})
+        return {'documents': documents}
@@ -1,44 +1,312 @@
-from django.db.models import Case, When, Q
+import copy
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from django.db import connection
+from django.db.models import Exists, OuterRef
+
+from dualtext_api.models import Annotation, Document, Project
+from dualtext_api.haystack_documents import DualtextDocument
+from .search_cache_service import SearchCacheService
+
+# threads running the methods of fused searches, shared by all requests of a process
+SEARCH_THREADS = 32
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    The search executor of this process. It is created on first use, so workers forked from a preloaded
+    application don't inherit the threads of their parent.
+    """
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=SEARCH_THREADS, thread_name_prefix='search')
+            _executor_pid = os.getpid()
+        return _executor
+
+
+class InvalidSearch(ValueError):
+    """
+    A search with unknown or missing methods or invalid parameters.
+    """
 
-from dualtext_api.models import Document, Project
 
 class SearchService():
     """
     A class to perform actions related to searches.
+    The timeout of a method's query pipeline covers all rounds of a search, methods that didn't answer
+    in the first round are not asked again when a page is filled up. Unknown methods raise InvalidSearch.
     """
-    def __init__(self, corpus_id, project_id=None):
+    # upper bound for the number of results requested from a pipeline for a single page
+    MAX_FETCH = 10000
+    MAX_ROUNDS = 4
+    # rank constant of the reciprocal rank fusion of several methods
+    RRF_K = 60
+
+    def __init__(self, corpus_id, project_id=None, collapse_duplicates=False):
         self.corpus_id = corpus_id
         self.project_id = project_id
+        self.collapse_duplicates = collapse_duplicates
+        # monotonic time by which each method has to answer, set by its first request
+        self.deadlines = {}
+        self.timed_out = set()
 
-    def postprocess_results(self, results, search_method):
-        document_ids = []
-        for document in results['documents']:
-            if not isinstance(document, dict):
-                document_ids.append(document.id)
-            else:
-                document_ids.append(document['id'])
+    def search(self, method, query, limit=None, offset=0):
+        """
+        Return the documents at offset:offset + limit of the postprocessed results.
+        method can be a comma separated list of methods whose results are fused.
+        """
+        results = self.fetch(method, query, self.page_options(limit, offset))
+        documents = self.postprocess_results(results=results, search_method=method)
+        return self.fill_page(method, query, limit, offset, results, documents)
+
+    def search_many(self, method, searches):
+        """
+        Return a page of results for each of the searches, dicts with a query and an optional limit and offset.
+        The first results of all searches are requested in one batch and postprocessed together.
+        If near duplicates are collapsed, a document is only returned for the first search it is found by.
+        """
+        options = [self.page_options(search.get('limit'), search.get('offset', 0)) for search in searches]
+        all_results = self.fetch_many(
+            method, [(search['query'], search_options) for search, search_options in zip(searches, options)]
+        )
+
+        document_ids = {document_id for results in all_results for document_id in self.result_ids(results)}
+        found = self.exclude_annotated_documents(Document.objects.all()).in_bulk(document_ids)
+
+        pages = []
+        for search, results in zip(searches, all_results):
+            documents = self.postprocess_results(results=results, search_method=method, found=found)
+            pages.append(self.fill_page(method, search['query'], search.get('limit'), search.get('offset', 0), results, documents))
+
+        if self.collapse_duplicates:
+            kept = set(DualtextDocument.collapse_duplicates(
+                [document.id for documents in pages for document in documents], index=self.corpus_id
+            ))
+            for position, documents in enumerate(pages):
+                page = []
+                for document in documents:
+                    if document.id in kept:
+                        kept.remove(document.id)
+                        page.append(document)
+                pages[position] = page
+        return pages
+
+    def page_options(self, limit, offset):
+        if limit is None:
+            return {}
+        return {'top_k': max(1, min(offset + limit, self.MAX_FETCH))}
+
+    def fill_page(self, method, query, limit, offset, results, documents):
+        """
+        Slice a page out of the postprocessed documents. Documents removed by the postprocessing are replaced by
+        fetching more results from the pipeline, each request is sized by the share of results kept by the previous one.
+        """
+        if limit is None:
+            return documents[offset:]
+
+        wanted = offset + limit
+        top_k = self.page_options(limit, offset)['top_k']
+        for _ in range(self.MAX_ROUNDS - 1):
+            returned = len(results['documents'])
+            # the page is complete or the pipeline has no more results
+            if len(documents) >= wanted or returned < top_k or top_k == self.MAX_FETCH:
+                break
+            kept_share = max(len(documents) / returned, 0.1)
+            top_k = min(self.MAX_FETCH, max(2 * top_k, math.ceil(1.2 * wanted / kept_share)))
+            try:
+                results = self.fetch(method, query, {'top_k': top_k})
+            except TimeoutError:
+                # the page is filled as far as the methods answered in time
+                break
+            documents = self.postprocess_results(results=results, search_method=method)
 
-        excluded_documents = self.get_excluded_documents()
-        document_ids = [int(doc_id) for doc_id in document_ids if int(doc_id) not in excluded_documents]
+        return documents[offset:wanted]
 
-        preserved = Case(*[When(pk=pk, then=pos) for pos, pk in enumerate(document_ids)])
-        queryset = Document.objects.filter(pk__in=document_ids).order_by(preserved)
-        for idx, q in enumerate(queryset):
-            q.method = search_method
+    def fetch(self, method, query, options):
+        """
+        Return the pipeline results of one or, fused, of several comma separated methods.
+        """
+        methods = self.split_methods(method)
+        self.start_deadlines(methods)
+        if len(methods) == 1:
+            return self.cache_service(methods[0]).search(corpus_id=self.corpus_id, method=methods[0], query=query, options=options)
 
-        return queryset
+        results = self.run_concurrently(
+            methods,
+            lambda name: SearchCacheService().search(corpus_id=self.corpus_id, method=name, query=query, options=options)
+        )
+        return self.fuse(results)
 
-    def get_excluded_documents(self):
-        project = None
-        excluded_documents = []
-        if self.project_id:
-            project = Project.objects.get(id=self.project_id)
+    def fetch_many(self, method, searches):
+        """
+        Return the pipeline results of several (query, options) searches, fused per search for several methods.
+        """
+        methods = self.split_methods(method)
+        self.start_deadlines(methods)
+        if len(methods) == 1:
+            return self.cache_service(methods[0]).search_many(corpus_id=self.corpus_id, method=methods[0], searches=searches)
 
-        if project and project.annotation_document_duplicates == False:
-            annotated_documents = Document.objects.filter(
-                Q(corpus__id=self.corpus_id) & Q(annotation__task__project=project)
+        results = self.run_concurrently(
+            methods,
+            lambda name: SearchCacheService().search_many(corpus_id=self.corpus_id, method=name, searches=searches)
+        )
+        return [self.fuse({name: method_results[i] for name, method_results in results.items()}) for i in range(len(searches))]
+
+    def start_deadlines(self, methods):
+        """
+        Set the deadlines of methods that weren't requested before. Looking up the pipelines also rejects
+        unknown methods before any of them runs.
+        """
+        try:
+            timeouts = {name: DualtextDocument.query_pipeline(pipeline_name=name).pipeline.timeout for name in methods}
+        except ValueError as e:
+            raise InvalidSearch(str(e))
+        start = time.monotonic()
+        for name in methods:
+            if name not in self.deadlines and timeouts[name] is not None:
+                self.deadlines[name] = start + timeouts[name]
+
+    def cache_service(self, name):
+        """
+        The search cache of a single method search. The cache is used by the calling thread, only requests
+        to the pipeline run in the search executor and are bounded by the deadline of the method.
+        """
+        def run(request):
+            if name in self.timed_out:
+                raise TimeoutError('The search method {} did not answer in time.'.format(name))
+            try:
+                return self.result_by_deadline(name, self.submit(request))
+            except FutureTimeoutError:
+                raise TimeoutError('The search method {} did not answer in time.'.format(name))
+
+        return SearchCacheService(run=run)
+
+    def run_concurrently(self, methods, search):
+        """
+        Call search with every method in a thread of the search executor and return the results by method.
+        Methods that don't answer by their deadline are left out, unless all of them are.
+        """
+        pending = [name for name in methods if name not in self.timed_out]
+        # threads of timed out pipelines finish in the background and still fill the search cache
+        futures = {name: self.submit(lambda name=name: search(name)) for name in pending}
+
+        results = {}
+        for name, future in futures.items():
+            try:
+                results[name] = self.result_by_deadline(name, future)
+            except FutureTimeoutError:
+                pass
+
+        if not results:
+            raise TimeoutError('None of the search methods {} answered in time.'.format(', '.join(methods)))
+        return results
+
+    @staticmethod
+    def submit(call):
+        def run():
+            try:
+                return call()
+            finally:
+                connection.close()
+
+        return get_executor().submit(run)
+
+    def result_by_deadline(self, name, future):
+        """
+        Wait for the result of a method until its deadline, a method that doesn't answer in time is marked as timed out.
+        """
+        deadline = self.deadlines.get(name, None)
+        try:
+            return future.result(timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            self.timed_out.add(name)
+            raise
+
+    def fuse(self, results):
+        """
+        Reciprocal rank fusion of the results by method: a document scores 1 / (RRF_K + rank) for every method
+        that found it. Every fused result keeps the methods that found it.
+        """
+        scores = {}
+        methods = {}
+        for name, method_results in results.items():
+            for rank, document_id in enumerate(dict.fromkeys(self.result_ids(method_results)), start=1):
+                scores[document_id] = scores.get(document_id, 0) + 1 / (self.RRF_K + rank)
+                methods.setdefault(document_id, []).append(name)
+
+        ranked = sorted(scores, key=lambda document_id: -scores[document_id])
+        return {'documents': [
+            {'id': document_id, 'score': scores[document_id], 'methods': methods[document_id]} for document_id in ranked
+        ]}
+
+    @staticmethod
+    def split_methods(method):
+        methods = list(dict.fromkeys(name.strip() for name in method.split(',') if name.strip()))
+        if not methods:
+            raise InvalidSearch('No search method given.')
+        return methods
+
+    def postprocess_results(self, results, search_method, found=None):
+        """
+        Return the documents of the results that are not excluded in the project, in the order of the results.
+        found can hold the already loaded documents by id, they are copied before their method is set.
+        """
+        document_ids = self.result_ids(results)
+        shared = found is not None
+        if not shared:
+            found = self.exclude_annotated_documents(Document.objects.all()).in_bulk(document_ids)
+        if self.collapse_duplicates:
+            document_ids = DualtextDocument.collapse_duplicates(
+                [document_id for document_id in document_ids if document_id in found], index=self.corpus_id
             )
-            excluded_documents = list(annotated_documents.values_list('id', flat=True))
-        print('excluded documents: {}'.format(excluded_documents))
+        methods = {
+            int(document['id']): ','.join(document['methods'])
+            for document in results['documents'] if isinstance(document, dict) and 'methods' in document
+        }
+
+        documents = []
+        seen = set()
+        for document_id in document_ids:
+            document = found.get(document_id)
+            if document is not None and document_id not in seen:
+                seen.add(document_id)
+                document = copy.copy(document) if shared else document
+                document.method = methods.get(document_id, search_method)
+                documents.append(document)
+
+        return documents
+
+    @staticmethod
+    def result_ids(results):
+        document_ids = []
+        for document in results['documents']:
+            if not isinstance(document, dict):
+                document_ids.append(int(document.id))
+            else:
+                document_ids.append(int(document['id']))
+        return document_ids
+
+    def exclude_annotated_documents(self, queryset):
+        """
+        Exclude documents that are already annotated in the project if it doesn't allow annotation duplicates.
+        The check is an EXISTS subquery per candidate, so it doesn't depend on the number of annotations in the project.
+        """
+        if not self.project_id:
+            return queryset
+
+        allows_duplicates = Project.objects.filter(id=self.project_id).values_list('annotation_document_duplicates', flat=True).first()
+        if allows_duplicates is None or allows_duplicates:
+            return queryset
 
-        return excluded_documents
+        annotated = Annotation.documents.through.objects.filter(
+            document_id=OuterRef('pk'),
+            annotation__task__project_id=self.project_id
+        )
+        return queryset.exclude(Exists(annotated))
@@ -0,0 +1,127 @@
+from collections import Counter
+from django.db.models import Count, F, Q
+from dualtext_api.models import OpenTaskCount, Task
+
+class TaskCountService():
+    """
+    A service to keep the open task counts of projects up to date. A task is open as long as it is neither
+    claimed nor finished and counts as an open annotation or an open review by its action.
+    """
+    COUNTERS = {
+        Task.ANNOTATE: 'open_annotation_tasks',
+        Task.DUPLICATE: 'open_annotation_tasks',
+        Task.REVIEW: 'open_review_tasks',
+    }
+    # the fields deciding which counter a task is counted in, in the order of the arguments of counter
+    COUNTED_FIELDS = ('project_id', 'action', 'annotator_id', 'is_finished')
+
+    def counter(self, project_id, action, annotator_id, is_finished):
+        """
+        Return the (project id, counter field) a task in the given state is counted in, or None if it isn't open.
+        """
+        if is_finished or annotator_id is not None or action not in self.COUNTERS:
+            return None
+        return (project_id, self.COUNTERS[action])
+
+    def counter_of(self, task):
+        return self.counter(task.project_id, task.action, task.annotator_id, task.is_finished)
+
+    def stored_counter_of(self, task_id):
+        """
+        The counter of a task as it is stored in the database.
+        """
+        state = Task.objects.filter(id=task_id).values_list(*self.COUNTED_FIELDS).first()
+        return self.counter(*state) if state is not None else None
+
+    def state_of(self, task):
+        """
+        The counted fields of a task, None if some of them weren't loaded.
+        """
+        if any(name not in task.__dict__ for name in self.COUNTED_FIELDS):
+            return None
+        return tuple(task.__dict__[name] for name in self.COUNTED_FIELDS)
+
+    def remember(self, task):
+        """
+        Remember the counted fields of a task as they are stored, e.g. after it was loaded or saved.
+        """
+        task._counted_state = self.state_of(task)
+
+    def saved_counter_of(self, task):
+        """
+        The counter a task is counted in before it is saved or deleted. A task whose counted fields didn't change
+        since it was loaded or saved is counted in the counter of its fields without a query.
+        """
+        if task.pk is None:
+            return None
+        state = self.state_of(task)
+        if not task._state.adding and state is not None and state == getattr(task, '_counted_state', None):
+            return self.counter(*state)
+        return self.stored_counter_of(task.pk)
+
+    def change(self, before, after):
+        """
+        Move a task from the counter before to the counter after, either of them may be None.
+        """
+        if before != after:
+            self.apply({before: -1, after: 1})
+
+    def add(self, tasks):
+        """
+        Count new tasks that were created without save, e.g. by a bulk insert.
+        """
+        self.apply(Counter(self.counter_of(task) for task in tasks))
+
+    def remove(self, tasks):
+        """
+        Uncount tasks that are finished or deleted without save, e.g. by a queryset update.
+        """
+        self.apply({key: -count for key, count in Counter(self.counter_of(task) for task in tasks).items()})
+
+    def release_claims(self, user):
+        """
+        Count the unfinished tasks of user as open again, deleting a user unassigns them without save.
+        """
+        tasks = Task.objects.filter(annotator=user, is_finished=False).values_list('project_id', 'action')
+        self.apply(Counter(self.counter(project_id, action, None, False) for project_id, action in tasks))
+
+    def apply(self, deltas):
+        for key, delta in deltas.items():
+            if key is None or delta == 0:
+                continue
+            project_id, field = key
+            if not OpenTaskCount.objects.filter(project_id=project_id).update(**{field: F(field) + delta}):
+                # projects that were created without save have no counts yet
+                self.recount(project_id)
+
+    def recount(self, project_id):
+        """
+        Set the open task counts of a project from its tasks, e.g. to repair counts that were changed
+        by queryset updates. Returns the counts.
+        """
+        counts = Task.objects.filter(project_id=project_id, is_finished=False, annotator=None).aggregate(
+            open_annotation_tasks=Count('id', filter=Q(action__in=[Task.ANNOTATE, Task.DUPLICATE])),
+            open_review_tasks=Count('id', filter=Q(action=Task.REVIEW)),
+        )
+        OpenTaskCount.objects.update_or_create(project_id=project_id, defaults=counts)
+        return counts
+
+    def open_task_counts(self, project, user):
+        """
+        Return the number of open annotation and review tasks user may claim in project.
+        Open copies of tasks annotated by user are subtracted, they are found through the tasks of user.
+        """
+        try:
+            counts = project.open_task_count
+        except OpenTaskCount.DoesNotExist:
+            counts = OpenTaskCount(**self.recount(project.id))
+        own_copies = Task.objects.filter(
+            project=project, is_finished=False, annotator=None, copied_from__annotator=user
+        ).aggregate(
+            annotations=Count('id', filter=Q(action__in=[Task.ANNOTATE, Task.DUPLICATE])),
+            reviews=Count('id', filter=Q(action=Task.REVIEW)),
+        )
+        return {
+            'open_annotations': counts.open_annotation_tasks - own_copies['annotations'],
+            'open_reviews': counts.open_review_tasks - own_copies['reviews'],
+        }
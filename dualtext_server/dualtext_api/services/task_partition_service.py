@@ -0,0 +1,138 @@
+import re
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from rest_framework import serializers
+from dualtext_api.models import Annotation, AnnotationGroup, Document, Project, Task
+from .annotation_service import AnnotationService
+from .task_count_service import TaskCountService
+
+class TaskPartitionService():
+    """
+    A service to split a pool of annotations or candidate documents of a project into new tasks of task_size
+    with a constant number of bulk statements per batch.
+    """
+    BATCH_SIZE = 2000
+
+    def __init__(self, project, task_size=20):
+        self.project = project
+        self.task_size = task_size
+
+    def partition_annotations(self, annotation_ids, keep_groups=False):
+        """
+        Move existing annotations of the project into new tasks, in the order of annotation_ids.
+        With keep_groups, the annotations of a group stay together and the group moves to their task,
+        a group larger than task_size gets a task of its own. Otherwise moved annotations leave their groups.
+        Only annotations of open tasks can be moved, source tasks left without annotations are deleted.
+        """
+        annotations = Annotation.objects.filter(id__in=annotation_ids, task__project=self.project).select_related('task').in_bulk()
+        missing = [annotation_id for annotation_id in annotation_ids if annotation_id not in annotations]
+        if missing:
+            raise serializers.ValidationError(
+                {'annotations': [f'Annotation {annotation_id} does not belong to the project.' for annotation_id in missing]}
+            )
+        busy = [
+            annotation_id for annotation_id, annotation in annotations.items()
+            if annotation.task.annotator_id is not None or annotation.task.is_finished
+        ]
+        if busy:
+            raise serializers.ValidationError(
+                {'annotations': [f'Annotation {annotation_id} belongs to a claimed or finished task.' for annotation_id in busy]}
+            )
+        source_ids = set(annotation.task_id for annotation in annotations.values())
+        ordered = [annotations[annotation_id] for annotation_id in dict.fromkeys(annotation_ids)]
+
+        if keep_groups:
+            group_ids = set(annotation.annotation_group_id for annotation in ordered) - {None}
+            split_groups = sorted(set(
+                Annotation.objects.filter(annotation_group_id__in=group_ids).exclude(id__in=annotations.keys())
+                .values_list('annotation_group_id', flat=True)
+            ))
+            if split_groups:
+                raise serializers.ValidationError(
+                    {'annotations': [f'Annotation group {group_id} is only partially included.' for group_id in split_groups]}
+                )
+            units = {}
+            for annotation in ordered:
+                key = annotation.annotation_group_id if annotation.annotation_group_id is not None else ('annotation', annotation.id)
+                units.setdefault(key, []).append(annotation)
+            chunks = self.pack(list(units.values()))
+        else:
+            chunks = self.split_list(ordered, self.task_size)
+
+        tasks = self.create_tasks(len(chunks))
+        groups = {}
+        for task, chunk in zip(tasks, chunks):
+            for annotation in chunk:
+                annotation.task = task
+                if not keep_groups:
+                    annotation.annotation_group = None
+                elif annotation.annotation_group_id is not None:
+                    groups[annotation.annotation_group_id] = AnnotationGroup(id=annotation.annotation_group_id, task=task)
+
+        Annotation.objects.bulk_update(ordered, ['task', 'annotation_group'], batch_size=self.BATCH_SIZE)
+        AnnotationGroup.objects.bulk_update(list(groups.values()), ['task'], batch_size=self.BATCH_SIZE)
+        # deleting the emptied tasks takes them off the open task counters through the post_delete signal
+        Task.objects.filter(id__in=source_ids).exclude(Exists(Annotation.objects.filter(task=OuterRef('pk')))).delete()
+        return tasks
+
+    def partition_documents(self, documents):
+        """
+        Create an annotation for every list of document ids and split them into new tasks.
+        """
+        document_ids = set(document_id for ids in documents for document_id in ids)
+        existing = set(
+            Document.objects.filter(id__in=document_ids, corpus__in=self.project.corpora.all()).values_list('id', flat=True)
+        )
+        errors = []
+        for ids in documents:
+            item_errors = []
+            missing = [document_id for document_id in ids if document_id not in existing]
+            if missing:
+                item_errors = [f'Document {document_id} does not belong to a corpus of the project.' for document_id in missing]
+            elif len(set(ids)) > self.project.max_documents:
+                item_errors = [f'The annotation may have a maximum of {self.project.max_documents} documents.']
+            errors.append(item_errors)
+        if any(errors):
+            raise serializers.ValidationError({'documents': errors})
+
+        chunks = self.split_list(documents, self.task_size)
+        tasks = self.create_tasks(len(chunks))
+        annotations = [Annotation(task=task) for task, chunk in zip(tasks, chunks) for ids in chunk]
+        AnnotationService().bulk_create(annotations, document_ids=documents)
+        return tasks
+
+    def pack(self, units):
+        """
+        Fill tasks with whole units in order, a unit only starts a new task if it doesn't fit into the current one.
+        """
+        chunks = []
+        current = []
+        for unit in units:
+            if current and len(current) + len(unit) > self.task_size:
+                chunks.append(current)
+                current = []
+            current.extend(unit)
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def create_tasks(self, count):
+        """
+        Create count tasks named P{project}T{index}, continuing after the highest index in use.
+        The project row stays locked until the transaction ends, so concurrent partitions don't pick the same names.
+        """
+        prefix = 'P{}T'.format(self.project.id)
+        pattern = re.compile(r'^{}(\d+)$'.format(re.escape(prefix)))
+        with transaction.atomic():
+            Project.objects.select_for_update().only('id').get(id=self.project.id)
+            names = Task.objects.filter(project=self.project, name__startswith=prefix).values_list('name', flat=True)
+            used = [int(match.group(1)) for match in map(pattern.match, names) if match]
+            start = max(used) + 1 if used else 0
+
+            tasks = [Task(name='{}{}'.format(prefix, start + idx), project=self.project) for idx in range(count)]
+            tasks = Task.objects.bulk_create_with_ids(tasks, batch_size=self.BATCH_SIZE)
+            TaskCountService().add(tasks)
+        return tasks
+
+    def split_list(self, lst, chunk_size):
+        return [lst[i:i + chunk_size] for i in range(0, len(lst), chunk_size)]
@@ -1,38 +1,120 @@
-from django.db.models import Q
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Exists, OuterRef
+from django.utils import timezone
 from dualtext_api.models import Task, Annotation, AnnotationGroup
+from .task_count_service import TaskCountService
 
 class TaskService():
     """
     A service to perform actions related to tasks.
     """
-    def __init__(self):
-        self.task_properties_to_copy = [
-            ''
-        ]
+    BATCH_SIZE = 2000
+
+    def finish_tasks(self, task_ids):
+        """
+        Mark tasks as finished and generate the reviews of the newly finished ones.
+        Returns the ids of the tasks that weren't finished before.
+        """
+        with transaction.atomic():
+            tasks = Task.objects.filter(id__in=task_ids, is_finished=False)
+            if connection.features.has_select_for_update:
+                tasks = tasks.select_for_update()
+            tasks = list(tasks.only('id', 'project_id', 'action', 'annotator_id', 'is_finished'))
+            finished_ids = [task.id for task in tasks]
+            Task.objects.filter(id__in=finished_ids).update(is_finished=True, modified_at=timezone.now())
+            TaskCountService().remove(tasks)
+            self.on_finished(finished_ids)
+        return finished_ids
+
+    def on_finished(self, task_ids):
+        """
+        Generate the reviews of finished tasks, unless DUALTEXT_DEFER_REVIEWS leaves them to the generatereviews command.
+        """
+        if not settings.DUALTEXT_DEFER_REVIEWS:
+            self.copy_tasks(list(self.pending_reviews().filter(id__in=task_ids).values_list('id', flat=True)))
+
+    def pending_reviews(self):
+        """
+        Finished original tasks of projects using reviews that don't have a review yet.
+        """
+        reviews = Task.objects.filter(copied_from=OuterRef('pk'), action=Task.REVIEW)
+        return Task.objects.filter(is_finished=True, copied_from=None, project__use_reviews=True).exclude(Exists(reviews))
+
+    def generate_pending_reviews(self, batch_size=1000, project_id=None):
+        """
+        Generate the reviews of up to batch_size finished tasks, optionally of a single project.
+        Returns the number of generated reviews.
+        """
+        with transaction.atomic():
+            tasks = self.pending_reviews().order_by('id')
+            if project_id is not None:
+                tasks = tasks.filter(project_id=project_id)
+            if connection.features.has_select_for_update_skip_locked and connection.features.has_select_for_update_of:
+                # concurrent workers skip the tasks that are already being reviewed
+                tasks = tasks.select_for_update(skip_locked=True, of=('self',))
+            task_ids = list(tasks.values_list('id', flat=True)[:batch_size])
+            return len(self.copy_tasks(task_ids))
 
     def copy_task(self, task_id, action=Task.REVIEW):
-        task = Task.objects.get(id=task_id)
-        copies = task.task_set.all()
-        name = task.name + action + str(len(copies))
-        task_copy = Task(name=name, project=task.project, copied_from=task, action=action)
-        task_copy.save()
-        self.copy_task_annotations(task, task_copy, action)
-        return Task.objects.get(id=task_copy.id)
-
-    def copy_task_annotations(self, task, task_copy, action):
-        annotations = task.annotation_set.all()
-        group_group_copy_map = {}
-        for annotation in annotations:
-            annotation_copy = Annotation(task=task_copy, copied_from=annotation, action=action)
-            if annotation.annotation_group:
-                original_group_id = annotation.annotation_group.id
-                group = group_group_copy_map.get(original_group_id, None)
-                if group is None:
-                    group = AnnotationGroup(task=task_copy)
-                    group.save()
-                    group_group_copy_map[original_group_id] = group
-                annotation_copy.annotation_group = group
-
-            annotation_copy.save()
-            annotation_copy.documents.set(annotation.documents.all())
-            annotation_copy.save()
+        return self.copy_tasks([task_id], action)[0]
+
+    def copy_tasks(self, task_ids, action=Task.REVIEW):
+        """
+        Copy tasks with their annotation groups and annotations, e.g. to review them.
+        The copies of all tasks are created with one bulk insert per table, the copies are returned in the order of task_ids.
+        """
+        task_ids = list(dict.fromkeys(task_ids))
+        if not task_ids:
+            return []
+        with transaction.atomic():
+            tasks = Task.objects.in_bulk(task_ids)
+            copy_counts = dict(
+                Task.objects.filter(copied_from__in=task_ids).values('copied_from').annotate(count=Count('id'))
+                .values_list('copied_from', 'count').order_by()
+            )
+            copies = [
+                Task(
+                    name=tasks[task_id].name + action + str(copy_counts.get(task_id, 0)),
+                    project_id=tasks[task_id].project_id,
+                    copied_from_id=task_id,
+                    action=action
+                )
+                for task_id in task_ids
+            ]
+            copies = Task.objects.bulk_create_with_ids(copies, batch_size=self.BATCH_SIZE)
+            TaskCountService().add(copies)
+            self.copy_task_annotations({task_id: copy.id for task_id, copy in zip(task_ids, copies)}, action)
+        return copies
+
+    def copy_task_annotations(self, task_map, action):
+        """
+        Copy the annotation groups, annotations and annotation documents of the tasks in task_map,
+        which maps task ids to the ids of their copies.
+        """
+        groups = list(AnnotationGroup.objects.filter(task__in=task_map.keys()).order_by('id').values_list('id', 'task_id'))
+        group_copies = AnnotationGroup.objects.bulk_create_with_ids(
+            [AnnotationGroup(task_id=task_map[task_id]) for group_id, task_id in groups], batch_size=self.BATCH_SIZE
+        )
+        group_map = {group_id: copy.id for (group_id, task_id), copy in zip(groups, group_copies)}
+
+        annotations = list(
+            Annotation.objects.filter(task__in=task_map.keys()).order_by('id').values_list('id', 'task_id', 'annotation_group_id')
+        )
+        annotation_copies = Annotation.objects.bulk_create_with_ids([
+            Annotation(
+                task_id=task_map[task_id],
+                copied_from_id=annotation_id,
+                action=action,
+                annotation_group_id=group_map.get(group_id, None)
+            )
+            for annotation_id, task_id, group_id in annotations
+        ], batch_size=self.BATCH_SIZE)
+        annotation_map = {annotation[0]: copy.id for annotation, copy in zip(annotations, annotation_copies)}
+
+        through = Annotation.documents.through
+        rows = through.objects.filter(annotation__task__in=task_map.keys()).order_by('id').values_list('annotation_id', 'document_id')
+        through.objects.bulk_create(
+            [through(annotation_id=annotation_map[annotation_id], document_id=document_id) for annotation_id, document_id in rows],
+            batch_size=self.BATCH_SIZE
+        )
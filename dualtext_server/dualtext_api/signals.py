@@ -1,48 +1,53 @@
-from django.db.models.signals import pre_save, post_save, pre_delete
+from django.contrib.auth.models import User
+from django.db.models.signals import post_init, pre_save, post_save, pre_delete
 from django.dispatch import receiver
-from .models import Task, Document, Corpus
-from dualtext_api.services import TaskService
-from dualtext_api.haystack_documents import DualtextDocument
+from .models import Task, Document, Corpus, Project, OpenTaskCount
+from dualtext_api.services import IndexService, CorpusService, TaskCountService
+
+@receiver(post_init, sender=Task)
+def remember_open_task_counter_on_init(sender, instance, **kwargs):
+    TaskCountService().remember(instance)
+
 
 @receiver(pre_save, sender=Task)
-def generate_review_on_task_completion(sender, instance, **kwargs):
-    try:
-        task = sender.objects.get(id=instance.id)
-    except sender.DoesNotExist:
-        pass
-    else:
-        # only tasks that change their completion state should generate reviews
-        condition = task.is_finished != instance.is_finished
-        # only completed tasks should generate reviews
-        condition = bool(condition and instance.is_finished == True)
-        # tasks that are copied from another task should not be reviewed another time
-        condition = bool(condition and instance.copied_from == None)
-        # reviews should only be generated if the project uses reviews
-        condition = bool(condition and task.project.use_reviews == True)
-        # tasks that already have a review should not be reviewed again
-        condition = bool(condition and task.task_set.filter(action=Task.REVIEW).count() == 0)
-        if condition:
-            ts = TaskService()
-            ts.copy_task(task.id)
+def remember_open_task_counter_on_save(sender, instance, **kwargs):
+    instance._open_counter = TaskCountService().saved_counter_of(instance)
+
+
+@receiver(post_save, sender=Task)
+def update_open_task_counters_on_save(sender, instance, **kwargs):
+    service = TaskCountService()
+    service.change(instance._open_counter, service.counter_of(instance))
+    service.remember(instance)
+
+
+@receiver(pre_delete, sender=Task)
+def update_open_task_counters_on_delete(sender, instance, origin=None, **kwargs):
+    # the counts of a deleted project don't matter
+    if not isinstance(origin, Project):
+        service = TaskCountService()
+        service.change(service.saved_counter_of(instance), None)
+
+
+@receiver(pre_delete, sender=User)
+def release_tasks_on_user_deletion(sender, instance, **kwargs):
+    # the tasks of the user lose their annotator by an update without signals
+    TaskCountService().release_claims(instance)
+
+
+@receiver(post_save, sender=Project)
+def create_open_task_count(sender, instance, created, **kwargs):
+    if created:
+        OpenTaskCount.objects.create(project=instance)
 
 
 @receiver(post_save, sender=Document)
 def generate_document_features_on_document_creation(sender, **kwargs):
     if kwargs['created']:
-        document = kwargs['instance']
-        document_update = Document.objects.get(id=document.id)
-        dualtext_document = DualtextDocument(model_instance=document_update)
-        dualtext_document.save()
+        IndexService().enqueue([kwargs['instance']])
 
 
 @receiver(pre_delete, sender=Corpus)
-def delete_document_features_on_corpus_deletion(sender, **kwargs):
-    pass
-    # TODO implement corpus deletion in haystack connector
-    # corpus = kwargs['instance']
-    # builder = Builder()
-    # documents = corpus.document_set.all()
-    # features = corpus.feature_set.all()
-    #
-    # for feature in features:
-    #     builder.remove_document_features(documents, feature.key)
+def delete_document_features_on_corpus_deletion(sender, instance, **kwargs):
+    # corpora purged by the purgecorpora command have no documents left at this point
+    CorpusService().delete_index_entries(instance)
@@ -1,3 +1,5 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
@@ -172,6 +174,113 @@ class TestAnnotationListView(APITestCase):
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
+class TestAnnotationBatchView(APITestCase):
+    def create_batch(self, task, data):
+        url = reverse('annotation_batch', args=[task.id])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data, format='json')
+        # requests are profiled by silk, its own bookkeeping queries are not part of the view
+        return response, len([q for q in queries if 'silk_' not in q['sql']])
+
+    def test_superuser_create(self):
+        """
+        Ensure that superusers can create a list of annotations with documents, labels and groups.
+        """
+        su = UserFactory(is_superuser=True)
+        task = TaskFactory()
+        label = LabelFactory(project=task.project)
+        group = AnnotationGroupFactory(task=task)
+        documents = DocumentFactory.create_batch(size=2)
+        data = [
+            {'documents': [d.id for d in documents], 'labels': [label.id], 'annotation_group': group.id},
+            {'documents': [documents[0].id], 'annotation_meta': {'source': 'import'}},
+        ]
+
+        self.client.force_authenticate(user=su)
+        response, query_count = self.create_batch(task, data)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 2)
+        first = Annotation.objects.get(id=response.data[0]['id'])
+        self.assertEqual(sorted(first.documents.values_list('id', flat=True)), sorted(d.id for d in documents))
+        self.assertEqual(list(first.labels.all()), [label])
+        self.assertEqual(first.annotation_group, group)
+        self.assertEqual(Annotation.objects.get(id=response.data[1]['id']).annotation_meta, {'source': 'import'})
+
+    def test_repeated_ids(self):
+        """
+        Ensure that documents and labels repeated within one annotation are linked once.
+        """
+        su = UserFactory(is_superuser=True)
+        task = TaskFactory(project=ProjectFactory(max_documents=1))
+        label = LabelFactory(project=task.project)
+        document = DocumentFactory()
+        data = [{'documents': [document.id, document.id], 'labels': [label.id, label.id]}]
+
+        self.client.force_authenticate(user=su)
+        response, query_count = self.create_batch(task, data)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        annotation = Annotation.objects.get(id=response.data[0]['id'])
+        self.assertEqual(list(annotation.documents.all()), [document])
+        self.assertEqual(list(annotation.labels.all()), [label])
+
+    def test_constant_queries(self):
+        """
+        Ensure that the number of queries does not depend on the number of annotations.
+        """
+        su = UserFactory(is_superuser=True)
+        task = TaskFactory()
+        label = LabelFactory(project=task.project)
+        document = DocumentFactory()
+
+        self.client.force_authenticate(user=su)
+        response, small_batch = self.create_batch(task, [{'documents': [document.id], 'labels': [label.id]}] * 2)
+        response, large_batch = self.create_batch(task, [{'documents': [document.id], 'labels': [label.id]}] * 50)
+
+        self.assertEqual(Annotation.objects.filter(task=task).count(), 52)
+        self.assertEqual(small_batch, large_batch)
+
+    def test_validate_against_task(self):
+        """
+        Ensure that labels of other projects, groups of other tasks and too many documents are rejected.
+        """
+        su = UserFactory(is_superuser=True)
+        project = ProjectFactory(max_documents=1)
+        task = TaskFactory(project=project)
+        other_task = TaskFactory(project=ProjectFactory(name='other project'))
+        foreign_label = LabelFactory(project=other_task.project)
+        foreign_group = AnnotationGroupFactory(task=other_task)
+        documents = DocumentFactory.create_batch(size=2)
+        data = [
+            {'labels': [foreign_label.id]},
+            {'annotation_group': foreign_group.id},
+            {'documents': [d.id for d in documents]},
+            {'documents': [documents[0].id]},
+        ]
+
+        self.client.force_authenticate(user=su)
+        response, query_count = self.create_batch(task, data)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('labels', response.data[0])
+        self.assertIn('annotation_group', response.data[1])
+        self.assertIn('documents', response.data[2])
+        self.assertEqual(response.data[3], {})
+        self.assertEqual(Annotation.objects.filter(task=task).count(), 0)
+
+    def test_deny_non_superuser_create(self):
+        """
+        Ensure that non superusers can not create annotations in batches.
+        """
+        user = UserFactory()
+        task = TaskFactory(annotator=user)
+
+        self.client.force_authenticate(user=user)
+        response, query_count = self.create_batch(task, [{}])
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
 class TestAnnotationDetailView(APITestCase):
     def test_annotator_view(self):
         """
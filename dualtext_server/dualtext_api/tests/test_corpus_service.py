@@ -0,0 +1,74 @@
+from unittest import mock
+from django.core.management import call_command
+from django.db import connection
+from rest_framework.test import APITestCase
+from dualtext_api.models import Corpus, Document, IndexOperation
+from dualtext_api.services import CorpusService
+from .factories import CorpusFactory, DocumentFactory, AnnotationFactory
+
+class TestCorpusService(APITestCase):
+    def test_purge_in_batches(self):
+        """
+        Ensure that purging removes documents, annotation links and index entries batch by batch before the corpus.
+        """
+        corpus = CorpusFactory()
+        documents = [DocumentFactory(corpus=corpus) for i in range(5)]
+        other_document = DocumentFactory()
+        annotation = AnnotationFactory(documents=[documents[0], other_document])
+        CorpusService().mark_deleted(corpus)
+
+        with mock.patch('dualtext_api.services.corpus_service.DualtextDocument.delete_batch') as delete_batch:
+            deleted = CorpusService().purge(corpus, batch_size=2)
+
+        self.assertEqual(deleted, 5)
+        self.assertEqual(delete_batch.call_count, 3)
+        deleted_ids = [document_id for call in delete_batch.call_args_list for document_id in call.kwargs['ids']]
+        self.assertEqual(deleted_ids, [document.id for document in documents])
+        self.assertFalse(Corpus.objects.filter(id=corpus.id).exists())
+        self.assertFalse(Document.objects.filter(corpus_id=corpus.id).exists())
+        self.assertFalse(IndexOperation.objects.filter(document_id__in=deleted_ids).exists())
+        self.assertEqual(list(annotation.documents.all()), [other_document])
+
+    def test_failed_index_deletion_keeps_batch(self):
+        """
+        Ensure that documents stay in the database when their index entries could not be removed.
+        """
+        corpus = CorpusFactory()
+        DocumentFactory(corpus=corpus)
+        CorpusService().mark_deleted(corpus)
+
+        with mock.patch('dualtext_api.services.corpus_service.DualtextDocument.delete_batch', side_effect=ConnectionError):
+            with self.assertRaises(ConnectionError):
+                CorpusService().purge(corpus)
+
+        self.assertEqual(Document.objects.filter(corpus=corpus).count(), 1)
+
+    def test_index_deletion_outside_transaction(self):
+        """
+        Ensure that the search index is cleaned up before the transaction deleting the documents is opened.
+        """
+        corpus = CorpusFactory()
+        DocumentFactory(corpus=corpus)
+        CorpusService().mark_deleted(corpus)
+        depth = len(connection.atomic_blocks)
+        depths = []
+
+        with mock.patch('dualtext_api.services.corpus_service.DualtextDocument.delete_batch', side_effect=lambda **kwargs: depths.append(len(connection.atomic_blocks))):
+            CorpusService().purge(corpus)
+
+        self.assertEqual(depths, [depth])
+
+    def test_command_purges_deleted_corpora(self):
+        """
+        Ensure that the purgecorpora command only removes corpora marked as deleted.
+        """
+        deleted_corpus = CorpusFactory()
+        DocumentFactory(corpus=deleted_corpus)
+        CorpusService().mark_deleted(deleted_corpus)
+        corpus = DocumentFactory().corpus
+
+        with mock.patch('dualtext_api.services.corpus_service.DualtextDocument.delete_batch'):
+            call_command('purgecorpora', stdout=mock.MagicMock())
+
+        self.assertFalse(Corpus.objects.filter(id=deleted_corpus.id).exists())
+        self.assertTrue(Document.objects.filter(corpus=corpus).exists())
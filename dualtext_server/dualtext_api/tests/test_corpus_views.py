@@ -57,6 +57,21 @@ class TestCorpusListView(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(response_2.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_reuse_deleted_name(self):
+        """
+        Ensure that the name of a deleted corpus can be used for a new corpus before it is purged.
+        """
+        su = UserFactory(is_superuser=True)
+        corpus = CorpusFactory(name='Test Corpus')
+        url = reverse('corpus_list')
+
+        self.client.force_authenticate(user=su)
+        self.client.delete(reverse('corpus_detail', args=[corpus.id]), format='json')
+        response = self.client.post(url, {'name': 'Test Corpus'}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Corpus.objects.filter(name='Test Corpus').count(), 2)
+
     def test_superuser_view(self):
         """
         Ensure a superuser can view all corpora.
@@ -147,14 +162,16 @@ class TestCorpusDetailView(APITestCase):
 
         self.client.force_authenticate(user=su)
         response = self.client.delete(url, format='json')
-
-        try:
-            corpus = Corpus.objects.get(id=corpus.id)
-        except Corpus.DoesNotExist:
-            corpus = None
+        corpus.refresh_from_db()
 
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
-        self.assertEqual(corpus, None)
+        self.assertTrue(corpus.is_deleted)
+
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = self.client.get(reverse('corpus_list'), format='json')
+        self.assertNotIn(corpus.id, [c['id'] for c in response.data])
 
     def test_deny_non_member_view(self):
         """
@@ -1,7 +1,12 @@
+import gzip
+import json
+from unittest import mock
+from django.db import connection
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
 from dualtext_api.models import Document
+from dualtext_api.serializers import DocumentListSerializer
 from .factories import UserFactory, GroupFactory, CorpusFactory, DocumentFactory
 
 class TestDocumentListView(APITestCase):
@@ -50,6 +55,20 @@ class TestDocumentListView(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(response.data['content'], data['content'])
 
+    def test_reject_duplicate(self):
+        """
+        Ensure that with on_duplicate=error a document can not be created twice in the same corpus.
+        """
+        su = UserFactory(is_superuser=True)
+        corpus = CorpusFactory()
+        DocumentFactory(corpus=corpus, content='A new document')
+        url = reverse('document_list', args=[corpus.id])
+
+        self.client.force_authenticate(user=su)
+        response = self.client.post(url + '?on_duplicate=error', {'content': 'A new document'}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_deny_non_superuser_create(self):
         """
         Ensure that non superusers can not create new documents.
@@ -152,6 +171,171 @@ class TestDocumentBatchView(APITestCase):
         self.assertEqual(len(response.data), 20)
         self.assertEqual(len(Document.objects.all()), 20)
 
+    def test_returns_exact_ids(self):
+        """
+        Ensure that the ids of a batch match the created documents, even for documents with identical content.
+        """
+        su = UserFactory(is_superuser=True)
+        corpus = CorpusFactory()
+        DocumentFactory(corpus=corpus, content='same content')
+        url = reverse('document_batch', args=[corpus.id])
+        data = [{'content': 'same content', 'document_meta': {'n': n}} for n in range(3)]
+
+        self.client.force_authenticate(user=su)
+        response = self.client.post(url, data, format='json')
+
+        self.assertEqual(len(response.data), 3)
+        for n, document in enumerate(response.data):
+            self.assertEqual(Document.objects.get(id=document['id']).document_meta, {'n': n})
+
+    def test_returns_exact_ids_without_returning_support(self):
+        """
+        Ensure that backends without INSERT ... RETURNING get ids through a reserved id block.
+        """
+        su = UserFactory(is_superuser=True)
+        corpus = CorpusFactory()
+        existing = DocumentFactory(corpus=corpus)
+        url = reverse('document_batch', args=[corpus.id])
+        data = [{'content': 'document {}'.format(n)} for n in range(3)]
+
+        self.client.force_authenticate(user=su)
+        features = type(connection.features)
+        reset = mock.Mock(wraps=connection.ops.sequence_reset_sql)
+        with mock.patch.object(features, 'can_return_rows_from_bulk_insert', new_callable=mock.PropertyMock, return_value=False), \
+                mock.patch.object(connection.ops, 'sequence_reset_sql', reset):
+            response = self.client.post(url, data, format='json')
+
+        ids = [document['id'] for document in response.data]
+        self.assertEqual(ids, [existing.id + 1, existing.id + 2, existing.id + 3])
+        for document, item in zip(response.data, data):
+            self.assertEqual(Document.objects.get(id=document['id']).content, item['content'])
+        # the sequence is reset past the reserved block, so ordinary inserts don't collide with it
+        self.assertEqual(reset.call_args.args[1], [Document])
+        self.assertEqual(DocumentFactory(corpus=corpus).id, existing.id + 4)
+
+    def test_reject_duplicates(self):
+        """
+        Ensure that on_duplicate=error rejects documents already present in the corpus.
+        """
+        su = UserFactory(is_superuser=True)
+        corpus = CorpusFactory()
+        DocumentFactory(corpus=corpus, content='existing')
+        url = reverse('document_batch', args=[corpus.id])
+        data = [{'content': 'existing'}, {'content': 'new'}]
+
+        self.client.force_authenticate(user=su)
+        response = self.client.post(url + '?on_duplicate=error', data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Document.objects.filter(corpus=corpus).count(), 1)
+
+    def test_skip_duplicates(self):
+        """
+        Ensure that on_duplicate=skip returns existing documents instead of creating them again.
+        """
+        su = UserFactory(is_superuser=True)
+        corpus = CorpusFactory()
+        existing = DocumentFactory(corpus=corpus, content='existing')
+        url = reverse('document_batch', args=[corpus.id])
+        data = [{'content': 'existing'}, {'content': 'new'}, {'content': 'new'}]
+
+        self.client.force_authenticate(user=su)
+        response = self.client.post(url + '?on_duplicate=skip', data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data[0]['id'], existing.id)
+        self.assertEqual(response.data[1]['id'], response.data[2]['id'])
+        self.assertEqual(Document.objects.filter(corpus=corpus).count(), 2)
+
+    def test_update_duplicates(self):
+        """
+        Ensure that on_duplicate=update replaces the meta data of existing documents.
+        """
+        su = UserFactory(is_superuser=True)
+        corpus = CorpusFactory()
+        existing = DocumentFactory(corpus=corpus, content='existing')
+        url = reverse('document_batch', args=[corpus.id])
+        data = [{'content': 'existing', 'document_meta': {'source': 'dump 2'}}]
+
+        self.client.force_authenticate(user=su)
+        response = self.client.post(url + '?on_duplicate=update', data, format='json')
+
+        self.assertEqual(response.data[0]['id'], existing.id)
+        existing.refresh_from_db()
+        self.assertEqual(existing.document_meta, {'source': 'dump 2'})
+
+    def test_concurrent_duplicate(self):
+        """
+        Ensure that a document inserted by a concurrent request after the duplicate lookup is found by a retry.
+        """
+        su = UserFactory(is_superuser=True)
+        corpus = CorpusFactory()
+        existing = DocumentFactory(corpus=corpus, content='existing')
+        url = reverse('document_batch', args=[corpus.id])
+        find_existing = DocumentListSerializer.find_existing
+        # the first lookup misses the document, as if it was committed right after it
+        lookups = [lambda serializer, documents: {}, find_existing]
+
+        self.client.force_authenticate(user=su)
+        with mock.patch.object(DocumentListSerializer, 'find_existing', autospec=True, side_effect=lambda *args: lookups.pop(0)(*args)):
+            response = self.client.post(url + '?on_duplicate=skip', [{'content': 'existing'}], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data[0]['id'], existing.id)
+        self.assertEqual(Document.objects.filter(corpus=corpus).count(), 1)
+
+    def test_save_duplicate(self):
+        """
+        Ensure that documents created as duplicates can be saved again.
+        """
+        su = UserFactory(is_superuser=True)
+        corpus = CorpusFactory()
+        DocumentFactory(corpus=corpus, content='existing')
+        url = reverse('document_batch', args=[corpus.id])
+
+        self.client.force_authenticate(user=su)
+        response = self.client.post(url, [{'content': 'existing'}], format='json')
+        duplicate = Document.objects.get(id=response.data[0]['id'])
+        duplicate.document_meta = {'edited': True}
+        duplicate.save()
+
+        self.assertIsNone(duplicate.content_hash)
+        self.assertEqual(Document.objects.filter(corpus=corpus).count(), 2)
+
+    def test_orm_duplicates(self):
+        """
+        Ensure that documents saved through the ORM allow duplicates, only the first of a content keeps the digest.
+        """
+        corpus = CorpusFactory()
+        first = Document.objects.create(content='a', corpus=corpus)
+        duplicate = Document.objects.create(content='a', corpus=corpus)
+        self.assertEqual(first.content_hash, Document.hash_content('a'))
+        self.assertIsNone(duplicate.content_hash)
+        # the lookup misses a document saved concurrently, the constraint catches it
+        with mock.patch('django.db.models.query.QuerySet.exists', return_value=False):
+            raced = Document.objects.create(content='a', corpus=corpus)
+        self.assertIsNone(raced.content_hash)
+
+        # a duplicate whose content changes to a new one takes the digest of its content
+        duplicate.content = 'b'
+        duplicate.save()
+        self.assertEqual(Document.objects.get(id=duplicate.id).content_hash, Document.hash_content('b'))
+
+    def test_allow_same_content_in_other_corpus(self):
+        """
+        Ensure that deduplication is scoped to a single corpus.
+        """
+        su = UserFactory(is_superuser=True)
+        other_corpus = CorpusFactory(name='other corpus')
+        corpus = CorpusFactory(name='corpus')
+        DocumentFactory(corpus=other_corpus, content='existing')
+        url = reverse('document_batch', args=[corpus.id])
+
+        self.client.force_authenticate(user=su)
+        response = self.client.post(url, [{'content': 'existing'}], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
     def test_batch_limited(self):
         """
         Ensure that a batch is limited to 200 documents.
@@ -183,3 +367,86 @@ class TestDocumentBatchView(APITestCase):
         response = self.client.post(url, data, format='json')
 
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+class TestDocumentStreamView(APITestCase):
+    def stream_body(self, documents):
+        return ''.join(json.dumps(doc) + '\n' for doc in documents).encode('utf-8')
+
+    def read_results(self, response):
+        content = b''.join(response.streaming_content).decode('utf-8')
+        return [json.loads(line) for line in content.splitlines()]
+
+    def test_superuser_create_gzip(self):
+        """
+        Ensure that superusers can stream gzipped NDJSON documents of arbitrary size in chunks.
+        """
+        su = UserFactory(is_superuser=True)
+        corpus = CorpusFactory()
+        url = reverse('document_stream', args=[corpus.id])
+        data = [{'content': 'document {}'.format(n), 'document_meta': {'n': n}} for n in range(250)]
+
+        self.client.force_authenticate(user=su)
+        response = self.client.post(
+            url + '?chunk_size=100',
+            gzip.compress(self.stream_body(data)),
+            content_type='application/x-ndjson',
+            HTTP_CONTENT_ENCODING='gzip'
+        )
+        results = self.read_results(response)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(results), 250)
+        self.assertEqual(Document.objects.filter(corpus=corpus).count(), 250)
+        for line, result in enumerate(results, start=1):
+            self.assertEqual(result['line'], line)
+            self.assertEqual(Document.objects.get(id=result['id']).content, data[line - 1]['content'])
+
+    def test_report_invalid_lines(self):
+        """
+        Ensure that invalid lines are reported without aborting the upload.
+        """
+        su = UserFactory(is_superuser=True)
+        corpus = CorpusFactory()
+        url = reverse('document_stream', args=[corpus.id])
+        body = b'{"content": "first"}\nnot json\n\n{"content": "second"}\n'
+
+        self.client.force_authenticate(user=su)
+        response = self.client.post(url, body, content_type='application/x-ndjson')
+        results = self.read_results(response)
+
+        self.assertEqual([r['line'] for r in results], [2, 1, 4])
+        self.assertIn('errors', results[0])
+        self.assertEqual(Document.objects.filter(corpus=corpus).count(), 2)
+
+    def test_report_duplicates(self):
+        """
+        Ensure that duplicates are reported per line while the rest of the chunk is saved.
+        """
+        su = UserFactory(is_superuser=True)
+        corpus = CorpusFactory()
+        DocumentFactory(corpus=corpus, content='existing')
+        url = reverse('document_stream', args=[corpus.id])
+        data = [{'content': 'existing'}, {'content': 'new'}, {'content': 'new'}]
+
+        self.client.force_authenticate(user=su)
+        response = self.client.post(url + '?on_duplicate=error', self.stream_body(data), content_type='application/x-ndjson')
+        results = sorted(self.read_results(response), key=lambda r: r['line'])
+
+        self.assertIn('errors', results[0])
+        self.assertIn('id', results[1])
+        self.assertIn('errors', results[2])
+        self.assertEqual(Document.objects.filter(corpus=corpus).count(), 2)
+
+    def test_deny_non_superuser_create(self):
+        """
+        Ensure that non superusers can not stream new documents.
+        """
+        user = UserFactory()
+        corpus = CorpusFactory()
+        url = reverse('document_stream', args=[corpus.id])
+
+        self.client.force_authenticate(user=user)
+        response = self.client.post(url, self.stream_body([{'content': 'A new document'}]), content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(Document.objects.count(), 0)
@@ -0,0 +1,647 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+import numpy as np
+from django.core.management import call_command
+from django.test import SimpleTestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from dualtext_api.haystack_connector.bm25 import BM25IndexingPipeline, BM25QueryPipeline
+from dualtext_api.haystack_connector.dense import DenseIndexingPipeline, DenseQueryPipeline, normalize
+from dualtext_api.haystack_connector.ivfpq import IVFPQIndex, IVFPQQueryPipeline, assign, squared_distances
+from dualtext_api.haystack_connector.minhash import MinHasher, MinHashIndexingPipeline, MinHashQueryPipeline
+from dualtext_api.haystack_connector import custom_pipelines
+from dualtext_api.haystack_connector.indexing_pipeline import IndexingPipeline
+from dualtext_api.haystack_connector.query_pipeline import QueryPipeline
+from dualtext_api.haystack_connector.pipelines import initialized_pipelines, PipelineRegistry
+from dualtext_api.haystack_documents import DualtextDocument
+from dualtext_api.services import IndexService
+from .factories import UserFactory, CorpusFactory, DocumentFactory
+
+
+class RecordingHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        server = self.server
+        with server.lock:
+            server.attempts += 1
+            fail = server.attempts <= server.failures
+            if not fail:
+                server.bodies.append(json.loads(body))
+                server.encodings.append(self.headers.get('Content-Encoding'))
+        self.send_response(503 if fail else 200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestIndexingPipelineTransport(SimpleTestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), RecordingHandler)
+        self.server.lock = threading.Lock()
+        self.server.attempts = 0
+        self.server.failures = 0
+        self.server.bodies = []
+        self.server.encodings = []
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{}/index'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_concurrent_compressed_batches(self):
+        """
+        Ensure that documents are sent as gzipped JSON objects in concurrent batches.
+        """
+        pipeline = IndexingPipeline('remote_index', url=self.url, batch_size=2, concurrency=3, compress=True)
+        documents = [{'id': i, 'content': 'document {}'.format(i), 'meta': {}} for i in range(5)]
+
+        pipeline.save(documents, index=1)
+
+        self.assertEqual(len(self.server.bodies), 3)
+        self.assertEqual(self.server.encodings, ['gzip'] * 3)
+        sent = sorted(doc['id'] for body in self.server.bodies for doc in body['documents'])
+        self.assertEqual(sent, list(range(5)))
+        self.assertEqual(self.server.bodies[0]['params'], {'index': 1})
+
+    def test_uncompressed_by_default(self):
+        """
+        Ensure that bodies are only compressed when the pipeline opts in.
+        """
+        pipeline = IndexingPipeline('remote_index', url=self.url)
+
+        pipeline.save([{'id': 1, 'content': 'document', 'meta': {}}], index=1)
+
+        self.assertEqual(self.server.encodings, [None])
+        self.assertEqual(self.server.bodies[0]['documents'][0]['id'], 1)
+
+    def test_retry_on_unavailable(self):
+        """
+        Ensure that batches are retried when the service answers with a 5xx status.
+        """
+        self.server.failures = 2
+        pipeline = IndexingPipeline('remote_index', url=self.url, retries=3, backoff_factor=0)
+
+        pipeline.save([{'id': 1, 'content': 'document', 'meta': {}}], index=1)
+
+        self.assertEqual(self.server.attempts, 3)
+        self.assertEqual(len(self.server.bodies), 1)
+
+
+class TestBM25Pipeline(SimpleTestCase):
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.indexing = BM25IndexingPipeline('bm25', index_dir=self.index_dir, merge_factor=3)
+        self.query = BM25QueryPipeline('bm25', index_dir=self.index_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+    def search(self, query, **params):
+        results = self.query.run(query=query, params={'index': 1, 'filters': {}, **params})
+        return [document['id'] for document in results['documents']]
+
+    def test_ranking(self):
+        """
+        Ensure that documents are ranked by BM25 and only matching documents are returned.
+        """
+        self.indexing.run(documents=[
+            {'id': 1, 'content': 'The quick brown fox', 'meta': {}},
+            {'id': 2, 'content': 'A fox, a fox and another fox', 'meta': {}},
+            {'id': 3, 'content': 'The lazy dog', 'meta': {}},
+        ], params={'index': 1})
+
+        self.assertEqual(self.search('fox'), [2, 1])
+        self.assertEqual(self.search('QUICK fox', top_k=1), [1])
+        self.assertEqual(self.search('cat'), [])
+
+    def test_updates_and_deletes_across_segments(self):
+        """
+        Ensure that the newest version of a document wins and deleted documents disappear, also after merging segments.
+        """
+        for i in range(10):
+            self.indexing.run(documents=[{'id': i, 'content': 'fox number{}'.format(i), 'meta': {}}], params={'index': 1})
+        self.indexing.run(documents=[{'id': 0, 'content': 'dog', 'meta': {}}], params={'index': 1})
+        self.indexing.delete(ids=[1], params={'index': 1})
+
+        self.assertEqual(sorted(self.search('fox', top_k=20)), list(range(2, 10)))
+        self.assertEqual(self.search('dog'), [0])
+        self.assertEqual(self.search('number5'), [5])
+        self.assertLess(len(self.query.get_index(1).store.segments()), 3)
+
+    def test_unicode_terms(self):
+        """
+        Ensure that terms of any length and script are stored in the term blob and found again after merges.
+        """
+        long_term = 'x' * 60
+        for i, content in enumerate(['größe', 'straße', long_term, 'δέντρο', 'a']):
+            self.indexing.run(documents=[{'id': i, 'content': content, 'meta': {}}], params={'index': 1})
+
+        self.assertEqual(self.search('GRÖSSE'), [])
+        self.assertEqual(self.search('größe'), [0])
+        self.assertEqual(self.search('δέντρο'), [3])
+        self.assertEqual(self.search(long_term), [2])
+        segment = self.query.get_index(1).store.segments()[0]
+        self.assertEqual(segment['term_bytes'].dtype, np.uint8)
+
+    def test_merged_segments_are_retired(self):
+        """
+        Ensure that merged segments are only removed by a later write once they have been retired long enough.
+        """
+        for i in range(3):
+            self.indexing.run(documents=[{'id': i, 'content': 'fox', 'meta': {}}], params={'index': 1})
+        store = self.query.get_index(1).store
+        index_path = self.query.index_path(1)
+        retired = [entry['name'] for entry in store._read_manifest()['retired']]
+        self.assertEqual(len(retired), 3)
+
+        self.indexing.run(documents=[{'id': 3, 'content': 'fox', 'meta': {}}], params={'index': 1})
+        self.assertTrue(all(os.path.isdir(os.path.join(index_path, name)) for name in retired))
+
+        with mock.patch.object(type(store), 'RETIRE_SECONDS', 0):
+            self.indexing.run(documents=[{'id': 4, 'content': 'fox', 'meta': {}}], params={'index': 1})
+        self.assertFalse(any(os.path.isdir(os.path.join(index_path, name)) for name in retired))
+        self.assertEqual(sorted(self.search('fox')), [0, 1, 2, 3, 4])
+
+    def test_indexes_are_separate(self):
+        """
+        Ensure that documents are only found in the index they were saved to.
+        """
+        self.indexing.run(documents=[{'id': 1, 'content': 'fox', 'meta': {}}], params={'index': 1})
+        self.indexing.run(documents=[{'id': 2, 'content': 'fox', 'meta': {}}], params={'index': 2})
+
+        self.assertEqual(self.search('fox'), [1])
+
+
+def letter_encoder(texts):
+    """
+    A deterministic stand-in for a sentence embedding model counting the letters a to e.
+    """
+    return np.array([[text.count(letter) for letter in 'abcde'] for text in texts], dtype=np.float32)
+
+
+class TestDensePipeline(SimpleTestCase):
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+    def pipelines(self, **kwargs):
+        indexing = DenseIndexingPipeline('dense', encoder=letter_encoder, index_dir=self.index_dir, merge_factor=3, **kwargs)
+        query = DenseQueryPipeline('dense', encoder=letter_encoder, index_dir=self.index_dir, block_size=2, **kwargs)
+        return indexing, query
+
+    def search(self, pipeline, query, **params):
+        results = pipeline.run(query=query, params={'index': 1, 'filters': {}, **params})
+        return [document['id'] for document in results['documents']]
+
+    def test_top_k_across_blocks_and_segments(self):
+        """
+        Ensure that the closest documents are found in every block of every segment.
+        """
+        indexing, query = self.pipelines()
+        contents = ['aaaa', 'bbbb', 'cccc', 'dddd', 'eeee', 'aaab', 'bbba']
+        for start in range(0, len(contents), 2):
+            documents = [{'id': i, 'content': contents[i], 'meta': {}} for i in range(start, min(start + 2, len(contents)))]
+            indexing.run(documents=documents, params={'index': 1})
+
+        self.assertEqual(self.search(query, 'aaaa', top_k=3), [0, 5, 6])
+        self.assertEqual(self.search(query, 'eeee', top_k=1), [4])
+
+    def test_batch_reads_blocks_once(self):
+        """
+        Ensure that a batch of queries reads every block once and ranks each query like a single search.
+        """
+        indexing, query = self.pipelines()
+        contents = ['aaaa', 'bbbb', 'cccc', 'dddd', 'eeee', 'aaab', 'bbba']
+        indexing.run(documents=[{'id': i, 'content': content, 'meta': {}} for i, content in enumerate(contents)], params={'index': 1})
+        queries = ['aaaa', 'bbbb', 'ddde', 'abbb']
+        single = [self.search(query, text, top_k=2) for text in queries]
+
+        def run_counting_reads(batch):
+            with mock.patch('dualtext_api.haystack_connector.dense.np.asarray', wraps=np.asarray) as asarray:
+                results = query.run_batch(batch, params={'index': 1, 'top_k': 2})
+            return results, asarray.call_count
+
+        results, batch_reads = run_counting_reads(queries)
+        _, single_reads = run_counting_reads(queries[:1])
+
+        self.assertEqual([[document['id'] for document in documents] for documents in results['documents']], single)
+        self.assertEqual(batch_reads, single_reads)
+
+    def test_updates_and_deletes(self):
+        """
+        Ensure that re-indexed documents use their newest embedding and deleted documents are not returned.
+        """
+        indexing, query = self.pipelines(dtype='float16')
+        indexing.run(documents=[{'id': 1, 'content': 'aaaa', 'meta': {}}, {'id': 2, 'content': 'aaab', 'meta': {}}], params={'index': 1})
+        indexing.run(documents=[{'id': 1, 'content': 'dddd', 'meta': {}}], params={'index': 1})
+        indexing.delete(ids=[2], params={'index': 1})
+        indexing.run(documents=[{'id': 3, 'content': 'cccc', 'meta': {}}], params={'index': 1})
+
+        self.assertEqual(self.search(query, 'dddd'), [1, 3])
+        self.assertEqual(self.search(query, 'aaaa', top_k=1), [1])
+        self.assertEqual(query.get_index(1).store.segments()[-1]['vectors'].dtype, np.float16)
+
+    def test_reject_other_dimensions(self):
+        """
+        Ensure that embeddings with a different dimension can't be added to an existing index.
+        """
+        indexing, query = self.pipelines()
+        indexing.run(documents=[{'id': 1, 'content': 'aaaa', 'meta': {}}], params={'index': 1})
+
+        with self.assertRaises(ValueError):
+            indexing.run(documents=[{'id': 2, 'content': '', 'embedding': [1.0, 0.0], 'meta': {}}], params={'index': 1})
+
+
+class TestQueryPipelineBatch(SimpleTestCase):
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+    def test_native_batch(self):
+        """
+        Ensure that pipelines with a run_batch method get all queries with the same options in one call.
+        """
+        encoder = mock.Mock(side_effect=letter_encoder)
+        indexing = DenseIndexingPipeline('dense', encoder=letter_encoder, index_dir=self.index_dir)
+        indexing.run(documents=[{'id': i, 'content': content, 'meta': {}} for i, content in enumerate(['aaaa', 'dddd', 'eeee'])], params={'index': 1})
+        pipeline = QueryPipeline('dense', DenseQueryPipeline('dense', encoder=encoder, index_dir=self.index_dir))
+
+        responses = pipeline.search_batch(
+            queries=['aaaa', 'eeee', 'dddd'],
+            filters={},
+            options=[{'index': 1, 'top_k': 1}, {'index': 1, 'top_k': 1}, {'index': 1, 'top_k': 2}]
+        )
+
+        self.assertEqual([[document['id'] for document in response['documents']] for response in responses], [[0], [2], [1, 0]])
+        self.assertEqual(encoder.call_count, 2)
+
+    def test_concurrent_batch(self):
+        """
+        Ensure that pipelines without run_batch are queried concurrently and the responses keep the order of the queries.
+        """
+        started = threading.Barrier(3, timeout=5)
+
+        class WaitingPipeline:
+            def run(self, query, params):
+                # every query waits until three queries are running at the same time
+                started.wait()
+                return {'documents': [{'id': query, 'score': params['top_k']}]}
+
+        pipeline = QueryPipeline('waiting', WaitingPipeline(), concurrency=3)
+        responses = pipeline.search_batch(queries=['a', 'b', 'c'], filters={}, options=[{'top_k': i} for i in range(3)])
+
+        self.assertEqual(responses, [{'documents': [{'id': query, 'score': i}]} for i, query in enumerate(['a', 'b', 'c'])])
+
+
+class EchoPipeline:
+    """
+    A query pipeline returning the query and the parameters it was called with.
+    """
+    def run(self, query, params):
+        return {'documents': [], 'query': query, 'params': params}
+
+
+class TestPipelineQueryset(SimpleTestCase):
+    def setUp(self):
+        patches = [
+            mock.patch.dict(initialized_pipelines['query'], {'echo_query': QueryPipeline('echo_query', EchoPipeline())}),
+            mock.patch.object(DualtextDocument, 'query_pipelines', ['echo_query']),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_immutable(self):
+        """
+        Ensure that query, filter and set_options return new querysets and leave the original unchanged.
+        """
+        query_set = DualtextDocument.query_pipeline(pipeline_name='echo_query', index=1)
+        first = query_set.query('first').filter(corpus__id=1).set_options(top_k=5)
+        second = query_set.query('second')
+
+        self.assertEqual(query_set.options, {'index': 1})
+        self.assertEqual(query_set.filters, {})
+        self.assertEqual(first.run()['query'], 'first')
+        self.assertEqual(first.run()['params'], {'filters': {'corpus__id': 1}, 'index': 1, 'top_k': 5})
+        self.assertEqual(second.run()['params'], {'filters': {}, 'index': 1})
+        with self.assertRaises(TypeError):
+            query_set.filter(unknown=1)
+
+    def test_concurrent_queries(self):
+        """
+        Ensure that querysets built and run in parallel threads don't see each other's query, filters and options.
+        """
+        barrier = threading.Barrier(8, timeout=5)
+
+        def search(i):
+            query_set = DualtextDocument.query_pipeline(pipeline_name='echo_query', index=i)
+            query_set = query_set.query(str(i)).filter(id=i)
+            # all threads hold a queryset before any of them sets its options and runs
+            barrier.wait()
+            results = query_set.set_options(top_k=i).run()
+            return results['query'], results['params']
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(search, range(8)))
+
+        self.assertEqual(results, [(str(i), {'filters': {'id': i}, 'index': i, 'top_k': i}) for i in range(8)])
+
+    def test_document_fields_per_instance(self):
+        """
+        Ensure that documents created in parallel threads keep their own field values.
+        """
+        def create(i):
+            instance = SimpleNamespace(id=i, content=f'document {i}', corpus=SimpleNamespace(id=i % 2))
+            return DualtextDocument(instance)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            documents = list(executor.map(create, range(32)))
+
+        for i, document in enumerate(documents):
+            self.assertEqual(document.current_fields, {'content': f'document {i}', 'corpus__id': i % 2, 'id': i})
+            self.assertEqual(document.index, i % 2)
+        with self.assertRaises(TypeError):
+            DualtextDocument(SimpleNamespace(id=1, content='', corpus=SimpleNamespace(id=1)), unknown=1)
+
+
+class TestMinHashPipeline(SimpleTestCase):
+    TEXT = 'the annotation guidelines describe how every sentence of the corpus should be labelled by the annotators'
+
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.indexing = MinHashIndexingPipeline('minhash', index_dir=self.index_dir, merge_factor=3)
+        self.query = MinHashQueryPipeline('minhash', index_dir=self.index_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+    def index(self, contents):
+        self.indexing.run(documents=[{'id': i, 'content': content, 'meta': {}} for i, content in contents.items()], params={'index': 1})
+
+    def test_chunked_signatures(self):
+        """
+        Ensure that signatures don't depend on how the texts are split into chunks.
+        """
+        texts = [self.TEXT, self.TEXT + ' again', '', 'a b', 'other words entirely and more of them']
+        hasher = MinHasher()
+        chunked = MinHasher()
+        chunked.CHUNK_SHINGLES = 3
+
+        np.testing.assert_array_equal(hasher.signatures(texts), chunked.signatures(texts))
+        self.assertEqual(hasher.signatures(texts).shape, (5, 128))
+
+    def test_near_duplicates(self):
+        """
+        Ensure that near duplicates are found across segments and deleted or changed documents are not.
+        """
+        self.index({1: self.TEXT, 2: 'a completely unrelated text about the weather in the mountains during spring'})
+        self.index({3: self.TEXT.replace('every', 'each')})
+        self.index({4: self.TEXT + ' carefully', 5: self.TEXT})
+        self.indexing.delete(ids=[5], params={'index': 1})
+        self.index({4: 'this document was rewritten and has nothing in common with the guidelines anymore'})
+
+        results = self.query.run(query=self.TEXT, params={'index': 1, 'threshold': 0.6})
+        self.assertEqual([document['id'] for document in results['documents']], [1, 3])
+        self.assertEqual(results['documents'][0]['score'], 1.0)
+
+    def test_collapse(self):
+        """
+        Ensure that collapsing keeps the first of every group of near duplicates, repeated ids once and unknown ids.
+        """
+        self.index({
+            1: 'a completely unrelated text about the weather in the mountains during spring',
+            2: self.TEXT,
+            3: self.TEXT + ' carefully',
+            4: 'a completely unrelated text about the weather in the mountains during the spring',
+        })
+
+        kept = self.indexing.collapse(ids=[2, 1, 99, 3, 2, 4], params={'index': 1, 'threshold': 0.6})
+        self.assertEqual(kept, [2, 1, 99])
+
+
+class TestPipelineRegistry(SimpleTestCase):
+    def setUp(self):
+        self.config_dir = tempfile.mkdtemp()
+        self.config_path = os.path.join(self.config_dir, 'pipeline_config.yml')
+        self.addCleanup(shutil.rmtree, self.config_dir)
+
+    def write_config(self, config):
+        with open(self.config_path, 'w') as f:
+            f.write(config)
+        # a new modification time, also on file systems with a coarse timestamp resolution
+        mtime = os.stat(self.config_path).st_mtime + 10
+        os.utime(self.config_path, (mtime, mtime))
+
+    def test_lazy_build(self):
+        """
+        Ensure that configured pipelines are only built when they are used.
+        """
+        self.write_config('remote_query:\n  type: query\n  url: http://localhost\nlocal_query:\n  type: query\n')
+        registry = PipelineRegistry(self.config_path)
+        local_query = mock.Mock()
+
+        with mock.patch.object(custom_pipelines, 'local_query', local_query, create=True), \
+                mock.patch.object(registry, 'build', wraps=registry.build) as build:
+            self.assertEqual(sorted(registry.pipelines['query'].keys()), ['local_query', 'remote_query'])
+            self.assertEqual(build.call_count, 0)
+
+            self.assertIs(registry.pipelines['query']['local_query'].pipeline, local_query)
+            self.assertIs(registry.pipelines['query']['local_query'], registry.pipelines['query']['local_query'])
+            self.assertEqual(build.call_count, 1)
+
+        with self.assertRaises(KeyError):
+            registry.pipelines['indexing']['local_query']
+
+    def test_reload_changed_config(self):
+        """
+        Ensure that changed pipelines are rebuilt with their new configuration and removed pipelines disappear.
+        """
+        self.write_config('first_query:\n  type: query\n  url: http://localhost\n  top_k: 5\nsecond_query:\n  type: query\n  url: http://localhost\n')
+        registry = PipelineRegistry(self.config_path)
+        first = registry.pipelines['query']['first_query']
+        second = registry.pipelines['query']['second_query']
+
+        self.write_config('first_query:\n  type: query\n  url: http://localhost\n  top_k: 20\nsecond_query:\n  type: query\n  url: http://localhost\n')
+        registry.next_check = 0
+
+        self.assertIsNot(registry.pipelines['query']['first_query'], first)
+        self.assertEqual(registry.pipelines['query']['first_query'].options, {'top_k': 20})
+        self.assertIs(registry.pipelines['query']['second_query'], second)
+
+        self.write_config('second_query:\n  type: query\n  url: http://localhost\n')
+        registry.next_check = 0
+        self.assertEqual(list(registry.pipelines['query']), ['second_query'])
+
+    def test_warm_up(self):
+        """
+        Ensure that warming up builds all pipelines and loads the models of custom pipelines.
+        """
+        self.write_config('local_index:\n  type: indexing\nremote_query:\n  type: query\n  url: http://localhost\n')
+        registry = PipelineRegistry(self.config_path)
+        local_index = mock.Mock()
+
+        with mock.patch.object(custom_pipelines, 'local_index', local_index, create=True):
+            registry.warm_up()
+
+        local_index.warm_up.assert_called_once_with()
+        self.assertEqual(sorted(registry.pipelines['indexing'].built), ['local_index'])
+        self.assertEqual(sorted(registry.pipelines['query'].built), ['remote_query'])
+
+
+def clustered_embeddings(count, dimension=32, seed=0):
+    """
+    Embeddings with a low intrinsic dimension, similar to the output of sentence embedding models.
+    """
+    rng = np.random.default_rng(seed)
+    latent = rng.normal(size=(count, 4)) @ rng.normal(size=(4, dimension))
+    return normalize(np.tanh(latent) + 0.05 * rng.normal(size=(count, dimension))).astype(np.float32)
+
+
+class TestIVFPQPipeline(SimpleTestCase):
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.embeddings = clustered_embeddings(2000)
+        indexing = DenseIndexingPipeline('dense', index_dir=self.index_dir)
+        for start in range(0, len(self.embeddings), 500):
+            documents = [
+                {'id': i, 'content': '', 'embedding': self.embeddings[i], 'meta': {}}
+                for i in range(start, start + 500)
+            ]
+            indexing.run(documents=documents, params={'index': 1})
+        self.pipeline = IVFPQQueryPipeline('ann', source='dense', index_dir=self.index_dir, nprobe=8)
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+    def recall(self, ann_index, **kwargs):
+        recalls = []
+        vectors_of = self.pipeline.source_index(1).vectors_of
+        for query in self.embeddings[:20]:
+            exact = set(np.argsort(-(self.embeddings @ query))[:10].tolist())
+            ids, scores = ann_index.search(query, top_k=10, vectors_of=vectors_of, **kwargs)
+            recalls.append(len(exact & set(ids)) / 10)
+        return np.mean(recalls)
+
+    def test_recall_and_compression(self):
+        """
+        Ensure that the approximate index finds most of the exact nearest neighbours in a fraction of the memory.
+        """
+        ann_index = self.pipeline.build(1, iterations=10)
+
+        self.assertEqual(ann_index.codes.shape, (2000, 4))
+        self.assertGreaterEqual(self.embeddings.nbytes / ann_index.codes.nbytes, 32)
+        self.assertGreaterEqual(self.recall(ann_index, nprobe=8, rerank=4), 0.8)
+        self.assertEqual(self.recall(ann_index, nprobe=len(ann_index.centroids), rerank=200), 1.0)
+        # the original vectors are read from the dense index, the build doesn't copy them
+        build = os.path.join(self.pipeline.index_path(1), IVFPQIndex.current_build(self.pipeline.index_path(1)))
+        self.assertTrue(os.path.exists(os.path.join(build, 'codes.npy')))
+        self.assertFalse(os.path.exists(os.path.join(build, 'vectors.npy')))
+
+    def test_rerank_with_current_vectors(self):
+        """
+        Ensure that re-ranking scores the candidates with the current dense index and leaves out deleted documents.
+        """
+        self.pipeline.build(1, iterations=5)
+        DenseIndexingPipeline('dense', index_dir=self.index_dir).delete(ids=[0], params={'index': 1})
+
+        ann_index = self.pipeline.load(1)
+        ids, scores = ann_index.search(
+            self.embeddings[0], top_k=5, nprobe=len(ann_index.centroids), rerank=100,
+            vectors_of=self.pipeline.source_index(1).vectors_of
+        )
+
+        exact = np.argsort(-(self.embeddings[1:] @ self.embeddings[0]))[:5] + 1
+        self.assertEqual(ids, exact.tolist())
+        np.testing.assert_allclose(scores, self.embeddings[exact] @ self.embeddings[0], rtol=1e-5)
+
+    def test_assignment_blocks(self):
+        """
+        Ensure that vectors are assigned to their closest centroid with distance blocks of at most budget elements.
+        """
+        vectors, centroids = self.embeddings[:100], self.embeddings[100:150]
+        exact = ((vectors[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+
+        with mock.patch('dualtext_api.haystack_connector.ivfpq.squared_distances', wraps=squared_distances) as distances:
+            assignments = assign(vectors, centroids, budget=500)
+
+        np.testing.assert_array_equal(assignments, exact)
+        self.assertTrue(all(call.args[0].shape[0] * len(centroids) <= 500 for call in distances.call_args_list))
+        self.assertEqual(distances.call_count, 10)
+
+    def test_missing_index(self):
+        """
+        Ensure that searching before the index was built raises an error instead of returning nothing.
+        """
+        with self.assertRaises(ValueError):
+            self.pipeline.run(query='', params={'index': 1})
+
+
+class TestBuildAnnIndexCommand(APITestCase):
+    def test_build_and_benchmark(self):
+        """
+        Ensure that the buildannindex command builds the index of a corpus and reports recall@k.
+        """
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir)
+        corpus = CorpusFactory()
+        embeddings = clustered_embeddings(500)
+        DenseIndexingPipeline('dense', index_dir=index_dir).run(
+            documents=[{'id': i, 'content': '', 'embedding': embedding, 'meta': {}} for i, embedding in enumerate(embeddings)],
+            params={'index': corpus.id}
+        )
+        pipeline = IVFPQQueryPipeline('ann', source='dense', index_dir=index_dir)
+        stdout = mock.MagicMock()
+
+        with mock.patch.object(custom_pipelines, 'ann_query', pipeline):
+            call_command('buildannindex', corpus.id, iterations=5, benchmark=True, queries=10, nprobe=[1, 4], stdout=stdout)
+
+        output = ''.join(call.args[0] for call in stdout.write.call_args_list)
+        self.assertIn('nprobe 1: recall@10', output)
+        self.assertIn('nprobe 4: recall@10', output)
+        self.assertEqual(len(pipeline.load(corpus.id).ids), 500)
+
+
+class TestBM25Search(APITestCase):
+    def test_search_view(self):
+        """
+        Ensure that the local BM25 pipelines can be used through the search view.
+        """
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir)
+        corpus = CorpusFactory()
+        matching = DocumentFactory(corpus=corpus, content='a document about foxes and dogs')
+        DocumentFactory(corpus=corpus, content='something else entirely')
+        user = UserFactory(is_superuser=True)
+
+        indexing = {'bm25_index': IndexingPipeline('bm25_index', BM25IndexingPipeline('bm25', index_dir=index_dir))}
+        query = {'bm25_query': QueryPipeline('bm25_query', BM25QueryPipeline('bm25', index_dir=index_dir))}
+        with mock.patch.dict(initialized_pipelines['indexing'], indexing), \
+                mock.patch.dict(initialized_pipelines['query'], query), \
+                mock.patch.object(DualtextDocument, 'indexing_pipelines', ['bm25_index']), \
+                mock.patch.object(DualtextDocument, 'query_pipelines', ['bm25_query']):
+            IndexService().process_pending()
+            self.client.force_authenticate(user=user)
+            url = reverse('search') + '?query=foxes&corpus={}&method=bm25_query'.format(corpus.id)
+            response = self.client.get(url, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([document['id'] for document in response.data], [matching.id])
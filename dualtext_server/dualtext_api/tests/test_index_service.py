@@ -0,0 +1,150 @@
+from unittest import mock
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from dualtext_api.models import IndexOperation, IndexCheckpoint
+from dualtext_api.services import IndexService
+from .factories import UserFactory, CorpusFactory, DocumentFactory
+
+class TestIndexService(APITestCase):
+    def test_enqueue_on_batch_create(self):
+        """
+        Ensure that creating documents writes index operations instead of indexing synchronously.
+        """
+        su = UserFactory(is_superuser=True)
+        corpus = CorpusFactory()
+        url = reverse('document_batch', args=[corpus.id])
+        data = [{'content': 'document {}'.format(n)} for n in range(5)]
+
+        self.client.force_authenticate(user=su)
+        with mock.patch('dualtext_api.services.index_service.DualtextDocument.save_batch') as save_batch:
+            self.client.post(url, data, format='json')
+            save_batch.assert_not_called()
+
+        self.assertEqual(IndexOperation.objects.filter(document__corpus=corpus).count(), 5)
+
+    def test_enqueue_on_single_create(self):
+        """
+        Ensure that documents created one by one are queued as well.
+        """
+        document = DocumentFactory()
+        self.assertEqual(IndexOperation.objects.filter(document=document).count(), 1)
+
+    def test_process_pending_in_batches(self):
+        """
+        Ensure that pending operations are sent to the indexing pipelines grouped by corpus and removed afterwards.
+        """
+        corpus_a = CorpusFactory()
+        corpus_b = CorpusFactory()
+        documents_a = [DocumentFactory(corpus=corpus_a) for i in range(3)]
+        DocumentFactory(corpus=corpus_b)
+
+        with mock.patch('dualtext_api.services.index_service.DualtextDocument.save_batch') as save_batch:
+            processed = IndexService().process_pending(batch_size=3)
+
+            self.assertEqual(processed, 3)
+            save_batch.assert_called_once()
+            self.assertEqual(save_batch.call_args.kwargs['index'], corpus_a.id)
+            self.assertEqual([d.id for d in save_batch.call_args.kwargs['documents']], [d.id for d in documents_a])
+
+        self.assertEqual(IndexOperation.objects.count(), 1)
+
+    def test_command_drains_queue(self):
+        """
+        Ensure that the processindexqueue command drains the outbox.
+        """
+        corpus = CorpusFactory()
+        for i in range(4):
+            DocumentFactory(corpus=corpus)
+
+        with mock.patch('dualtext_api.services.index_service.DualtextDocument.save_batch') as save_batch:
+            call_command('processindexqueue', batch_size=3, stdout=mock.MagicMock())
+            self.assertEqual(save_batch.call_count, 2)
+
+        self.assertEqual(IndexOperation.objects.count(), 0)
+
+    def test_failing_corpus(self):
+        """
+        Ensure that a failing batch is backed off without holding up other corpora, and operations are leased while indexing.
+        """
+        corpus_a = CorpusFactory()
+        corpus_b = CorpusFactory()
+        DocumentFactory(corpus=corpus_a)
+        document_b = DocumentFactory(corpus=corpus_b)
+
+        def save_batch(documents, index, common_attributes):
+            self.assertFalse(IndexOperation.objects.filter(available_at=None).exists())
+            if index == corpus_a.id:
+                raise ConnectionError('pipeline unavailable')
+
+        with mock.patch('dualtext_api.services.index_service.DualtextDocument.save_batch', side_effect=save_batch):
+            self.assertEqual(IndexService().process_pending(), 2)
+            self.assertEqual(IndexService().process_pending(), 0)
+
+        failed = IndexOperation.objects.get()
+        self.assertEqual(failed.document.corpus, corpus_a)
+        self.assertEqual(failed.attempts, 1)
+        self.assertIn('pipeline unavailable', failed.last_error)
+        self.assertFalse(IndexOperation.objects.filter(document=document_b).exists())
+
+    def test_dead_letters(self):
+        """
+        Ensure that retries index documents one by one, so only a failing document becomes a dead letter.
+        """
+        corpus = CorpusFactory()
+        poison = DocumentFactory(corpus=corpus, content='poison')
+        for i in range(2):
+            DocumentFactory(corpus=corpus)
+
+        def save_batch(documents, index, common_attributes):
+            if poison in documents:
+                raise ValueError('invalid document')
+
+        with mock.patch('dualtext_api.services.index_service.DualtextDocument.save_batch', side_effect=save_batch):
+            for attempt in range(IndexService.MAX_ATTEMPTS + 1):
+                IndexOperation.objects.update(available_at=None)
+                IndexService().process_pending()
+
+        self.assertEqual(list(IndexOperation.objects.values_list('document_id', flat=True)), [poison.id])
+        self.assertEqual(IndexService().dead_letters().count(), 1)
+        self.assertEqual(IndexService().available().count(), 0)
+
+        with mock.patch('dualtext_api.services.index_service.DualtextDocument.save_batch'):
+            call_command('processindexqueue', retry_failed=True, stdout=mock.MagicMock())
+        self.assertEqual(IndexOperation.objects.count(), 0)
+
+class TestBuildIndexCommand(APITestCase):
+    def test_index_corpus(self):
+        """
+        Ensure that all documents of a corpus are sent to the pipelines and the checkpoint is advanced.
+        """
+        corpus = CorpusFactory()
+        documents = [DocumentFactory(corpus=corpus) for i in range(7)]
+
+        with mock.patch('dualtext_api.management.commands.buildindex.DualtextDocument.save_batch') as save_batch:
+            call_command('buildindex', corpus.id, chunk_size=3, workers=2, stdout=mock.MagicMock())
+            indexed = sorted(d.id for call in save_batch.call_args_list for d in call.kwargs['documents'])
+
+        self.assertEqual(indexed, [d.id for d in documents])
+        self.assertEqual(IndexCheckpoint.objects.get(corpus=corpus).last_document_id, documents[-1].id)
+
+    def test_resume_from_checkpoint(self):
+        """
+        Ensure that a failed run can be resumed without re-indexing finished batches.
+        """
+        corpus = CorpusFactory()
+        documents = [DocumentFactory(corpus=corpus) for i in range(6)]
+
+        with mock.patch('dualtext_api.management.commands.buildindex.DualtextDocument.save_batch') as save_batch:
+            save_batch.side_effect = [None, ValueError('pipeline unavailable')]
+            with self.assertRaises(CommandError):
+                call_command('buildindex', corpus.id, chunk_size=3, workers=1, stdout=mock.MagicMock())
+
+        self.assertEqual(IndexCheckpoint.objects.get(corpus=corpus).last_document_id, documents[2].id)
+
+        with mock.patch('dualtext_api.management.commands.buildindex.DualtextDocument.save_batch') as save_batch:
+            call_command('buildindex', corpus.id, chunk_size=3, workers=1, stdout=mock.MagicMock())
+            indexed = [d.id for call in save_batch.call_args_list for d in call.kwargs['documents']]
+
+        self.assertEqual(indexed, [d.id for d in documents[3:]])
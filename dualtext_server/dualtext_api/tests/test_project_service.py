@@ -0,0 +1,240 @@
+import threading
+from io import StringIO
+import unittest
+from unittest import mock
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from dualtext_api.models import OpenTaskCount, Project, Task
+from dualtext_api.services import ProjectService, TaskCountService, TaskService
+from .factories import UserFactory, GroupFactory, ProjectFactory, TaskFactory
+
+class TestClaimTask(APITestCase):
+    def setUp(self):
+        self.project = ProjectFactory()
+        self.tasks = [TaskFactory(project=self.project, name='task {}'.format(n), annotator=None) for n in range(3)]
+
+    def row_locks(self, supported):
+        features = type(connection.features)
+        return mock.patch.object(features, 'has_select_for_update_skip_locked', new_callable=mock.PropertyMock, return_value=supported)
+
+    def claim_all(self):
+        users = [UserFactory() for n in range(4)]
+        return [ProjectService(self.project.id).claim_annotation_task(user) for user in users], users
+
+    def test_claim_in_order(self):
+        """
+        Ensure that every claim gets the oldest open task, a different one for every user, until none are left.
+        """
+        with self.row_locks(True):
+            claimed, users = self.claim_all()
+
+        self.assertEqual(claimed[:3], self.tasks)
+        self.assertIsNone(claimed[3])
+        for task, user in zip(self.tasks, users):
+            task.refresh_from_db()
+            self.assertEqual(task.annotator, user)
+
+    def test_claim_without_row_locks(self):
+        """
+        Ensure that backends without skip locked claim tasks with a conditional update.
+        """
+        with self.row_locks(False):
+            claimed, users = self.claim_all()
+
+        self.assertEqual(claimed[:3], self.tasks)
+        self.assertEqual([task.annotator for task in claimed[:3]], users[:3])
+        self.assertIsNone(claimed[3])
+
+    def test_lost_claim(self):
+        """
+        Ensure that a task claimed by another user after it was selected is not taken over.
+        """
+        other = UserFactory()
+        user = UserFactory()
+        Task.objects.filter(id=self.tasks[0].id).update(annotator=other)
+        # a stale selection that still contains the task claimed by other
+        stale = Task.objects.filter(id__in=[self.tasks[0].id, self.tasks[1].id])
+
+        with self.row_locks(False):
+            task = ProjectService(self.project.id).claim_task(stale, user)
+
+        self.assertEqual(task, self.tasks[1])
+        self.assertEqual(Task.objects.get(id=self.tasks[0].id).annotator, other)
+
+
+@unittest.skipUnless(connection.features.has_select_for_update_skip_locked, 'concurrent claims need row locks')
+class TestConcurrentClaims(TransactionTestCase):
+    THREADS = 8
+
+    def test_no_task_claimed_twice(self):
+        """
+        Ensure that users claiming tasks at the same time from different connections never get the same task.
+        """
+        project = ProjectFactory()
+        tasks = [TaskFactory(project=project, name='task {}'.format(n), annotator=None) for n in range(self.THREADS - 2)]
+        users = [UserFactory(username='user {}'.format(n)) for n in range(self.THREADS)]
+        barrier = threading.Barrier(self.THREADS, timeout=10)
+        claimed = {}
+
+        def claim(user):
+            try:
+                barrier.wait()
+                claimed[user.id] = ProjectService(project.id).claim_annotation_task(user)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=claim, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        claimed_ids = [task.id for task in claimed.values() if task is not None]
+        self.assertEqual(len(claimed), self.THREADS)
+        self.assertEqual(sorted(claimed_ids), [task.id for task in tasks])
+        for user_id, task in claimed.items():
+            if task is not None:
+                self.assertEqual(Task.objects.get(id=task.id).annotator_id, user_id)
+        self.assertEqual(OpenTaskCount.objects.get(project=project).open_annotation_tasks, 0)
+
+
+class TestOpenTaskCounters(APITestCase):
+    def setUp(self):
+        self.project = ProjectFactory(use_reviews=True)
+
+    def counters(self):
+        counts = OpenTaskCount.objects.get(project=self.project)
+        counters = (counts.open_annotation_tasks, counts.open_review_tasks)
+        self.assertEqual(counters, tuple(TaskCountService().recount(self.project.id).values()))
+        return counters
+
+    def test_task_lifecycle(self):
+        """
+        Ensure that the counters follow tasks being created, claimed, finished, copied for review and deleted.
+        """
+        user = UserFactory()
+        tasks = [TaskFactory(project=self.project, name='task {}'.format(n), annotator=None) for n in range(3)]
+        self.assertEqual(self.counters(), (3, 0))
+
+        task = ProjectService(self.project.id).claim_annotation_task(user)
+        self.assertEqual(self.counters(), (2, 0))
+
+        # finishing an annotation creates an open review task
+        TaskService().finish_tasks([task.id])
+        self.assertEqual(self.counters(), (2, 1))
+
+        ProjectService(self.project.id).claim_review_task(UserFactory())
+        tasks[2].delete()
+        self.assertEqual(self.counters(), (1, 0))
+
+    def test_claim_without_row_locks(self):
+        """
+        Ensure that claims with a conditional update decrease the counters as well.
+        """
+        TaskFactory(project=self.project, annotator=None)
+        features = type(connection.features)
+        with mock.patch.object(features, 'has_select_for_update_skip_locked', new_callable=mock.PropertyMock, return_value=False):
+            ProjectService(self.project.id).claim_annotation_task(UserFactory())
+
+        self.assertEqual(self.counters(), (0, 0))
+
+    def test_claimable_counts(self):
+        """
+        Ensure that open copies of tasks a user annotated are not claimable by them, with a constant number of queries.
+        """
+        group = GroupFactory()
+        user = UserFactory(groups=[group])
+        self.project.allowed_groups.set([group])
+        own_task = TaskFactory(project=self.project, name='own', annotator=user)
+        TaskFactory(project=self.project, name='own review', copied_from=own_task, action=Task.REVIEW, annotator=None)
+        other_task = TaskFactory(project=self.project, name='other', annotator=UserFactory())
+        TaskFactory(project=self.project, name='other review', copied_from=other_task, action=Task.REVIEW, annotator=None)
+        TaskFactory(project=self.project, name='open', annotator=None)
+        url = reverse('task_claimable', args=[self.project.id])
+
+        self.client.force_authenticate(user=user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, format='json')
+
+        self.assertEqual(response.data['open_annotations'], 1)
+        self.assertEqual(response.data['open_reviews'], 1)
+        # the project, the groups of the permission check and one count of the copies of the user's tasks
+        queries = [q for q in queries if q['sql'].startswith('SELECT') and 'silk_' not in q['sql']]
+        self.assertEqual(len(queries), 4)
+
+    def test_stale_project_save(self):
+        """
+        Ensure that saving a project loaded before its tasks changed keeps the counters.
+        """
+        project = Project.objects.get(id=self.project.id)
+        TaskFactory(project=self.project, name='task', annotator=None)
+
+        project.name = 'renamed'
+        project.save()
+
+        self.assertEqual(self.counters(), (1, 0))
+        self.assertEqual(Project.objects.get(id=self.project.id).name, 'renamed')
+
+    def test_save_loaded_task(self):
+        """
+        Ensure that saving tasks moves them between the counters by the state they were loaded or refreshed in.
+        """
+        TaskFactory(project=self.project, name='task', annotator=None)
+        task = Task.objects.get(project=self.project)
+        claimed = ProjectService(self.project.id).claim_annotation_task(UserFactory())
+        self.assertEqual(self.counters(), (0, 0))
+
+        # the claimed task saved again and the stale instance refreshed before it is finished
+        claimed.save()
+        task.refresh_from_db()
+        task.is_finished = True
+        task.save()
+
+        self.assertEqual(self.counters(), (0, 0))
+        task.delete()
+        self.assertEqual(self.counters(), (0, 0))
+
+    def test_user_deletion(self):
+        """
+        Ensure that the unfinished tasks of a deleted user are counted as open again.
+        """
+        user = UserFactory()
+        TaskFactory(project=self.project, name='task', annotator=None)
+        TaskFactory(project=self.project, name='finished', annotator=user, is_finished=True)
+        ProjectService(self.project.id).claim_annotation_task(user)
+        self.assertEqual(self.counters(), (0, 0))
+
+        user.delete()
+
+        self.assertEqual(self.counters(), (1, 0))
+
+    def test_recount_command(self):
+        """
+        Ensure that the recountopentasks command repairs counts changed by queryset updates.
+        """
+        TaskFactory(project=self.project, name='task', annotator=None)
+        Task.objects.filter(project=self.project).update(action=Task.REVIEW)
+
+        call_command('recountopentasks', stdout=StringIO())
+
+        self.assertEqual(self.counters(), (0, 1))
+
+    def test_plain_save_queries(self):
+        """
+        Ensure that saving a task without changing its counted fields takes only its UPDATE.
+        """
+        TaskFactory(project=self.project, name='task', annotator=None)
+        task = Task.objects.get(project=self.project)
+
+        task.name = 'renamed'
+        with CaptureQueriesContext(connection) as queries:
+            task.save()
+
+        queries = [q['sql'] for q in queries if 'silk_' not in q['sql'] and not q['sql'].startswith('EXPLAIN')]
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0].startswith('UPDATE'))
+        self.assertEqual(self.counters(), (1, 0))
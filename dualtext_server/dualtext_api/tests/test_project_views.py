@@ -1,7 +1,12 @@
+import gzip
+import json
+from unittest import mock
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
-from dualtext_api.models import Project, Label, Annotation, Task, Run, Lap
+from dualtext_api.models import Project, Label, Annotation, Task, Run, Lap, Corpus
+from dualtext_api.services import ProjectImportService
 from .factories import UserFactory, TaskFactory, ProjectFactory, AnnotationFactory, LabelFactory, GroupFactory
 import datetime
 import time
@@ -377,3 +382,145 @@ class TestProjectStatisticsView(APITestCase):
     #     self.client.force_authenticate(user=user)
     #     response = self.client.get(url, format='json')
     #     print(response.data)
+
+class TestProjectImportView(APITestCase):
+    def project_data(self):
+        return {
+            'project': {'name': 'Imported Project', 'annotation_mode': 'grouped', 'max_documents': 2},
+            'corpus': {'name': 'Imported Corpus', 'corpus_meta': {}},
+            'labels': [{'name': 'premise', 'key_code': 'p'}, {'name': 'closer', 'key_code': 'c'}],
+            'annotations': [
+                {'identifier': {'unique_id': 'a-1', 'document_meta_key': 'annotations'}, 'labels': ['premise']},
+                {'identifier': {'unique_id': 'b-2', 'document_meta_key': 'annotations'}},
+                {'identifier': {'unique_id': 'c-3', 'document_meta_key': 'annotations'}, 'annotation_meta': {'x': 1}},
+            ],
+            'documents': [
+                {'content': 'doc a', 'document_meta': {'doc_id': 'a', 'annotations': ['a-1']}},
+                {'content': 'doc b', 'document_meta': {'doc_id': 'b', 'annotations': ['a-1', 'b-2']}},
+                {'content': 'doc c', 'document_meta': {'doc_id': 'c', 'annotations': ['c-3']}},
+            ],
+        }
+
+    def test_import(self):
+        """
+        Ensure that a whole project is created from a single request and an id mapping is returned.
+        """
+        su = UserFactory(is_superuser=True)
+        url = reverse('project_import')
+
+        self.client.force_authenticate(user=su)
+        response = self.client.post(url + '?task_size=2', self.project_data(), format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        project = Project.objects.get(id=response.data['project'])
+        self.assertEqual(project.creator, su)
+        self.assertEqual(list(project.corpora.values_list('id', flat=True)), [response.data['corpus']])
+        self.assertEqual(sorted(response.data['labels'].keys()), ['closer', 'premise'])
+        self.assertEqual(Task.objects.filter(project=project).count(), 2)
+        self.assertEqual(list(Task.objects.filter(project=project).values_list('name', flat=True)), ['P{}T0'.format(project.id), 'P{}T1'.format(project.id)])
+
+        first = Annotation.objects.get(id=response.data['annotations']['a-1'])
+        documents = response.data['documents']
+        self.assertEqual(sorted(first.documents.values_list('id', flat=True)), sorted(documents[0:2]))
+        self.assertEqual(list(first.labels.values_list('name', flat=True)), ['premise'])
+        third = Annotation.objects.get(id=response.data['annotations']['c-3'])
+        self.assertEqual(third.annotation_meta, {'x': 1})
+        self.assertEqual(third.task_id, response.data['tasks'][1])
+
+    def test_import_groups(self):
+        """
+        Ensure that annotation groups are kept together within a task.
+        """
+        su = UserFactory(is_superuser=True)
+        url = reverse('project_import')
+        data = self.project_data()
+        data['annotation_groups'] = [{'annotation_ids': ['a-1', 'b-2']}, {'annotation_ids': ['c-3']}]
+
+        self.client.force_authenticate(user=su)
+        response = self.client.post(url + '?task_size=1', data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        first = Annotation.objects.get(id=response.data['annotations']['a-1'])
+        second = Annotation.objects.get(id=response.data['annotations']['b-2'])
+        third = Annotation.objects.get(id=response.data['annotations']['c-3'])
+        self.assertEqual(first.annotation_group, second.annotation_group)
+        self.assertEqual(first.task, first.annotation_group.task)
+        self.assertNotEqual(first.task, third.task)
+
+    def test_import_gzipped_file(self):
+        """
+        Ensure that project data can be uploaded as a gzipped file.
+        """
+        su = UserFactory(is_superuser=True)
+        url = reverse('project_import')
+        upload = SimpleUploadedFile('project.json.gz', gzip.compress(json.dumps(self.project_data()).encode('utf-8')))
+
+        self.client.force_authenticate(user=su)
+        response = self.client.post(url, {'file': upload}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['annotations']), 3)
+
+    def test_import_ndjson_file(self):
+        """
+        Ensure that project data can be uploaded as NDJSON records, with the documents inserted in chunks.
+        """
+        su = UserFactory(is_superuser=True)
+        url = reverse('project_import')
+        data = self.project_data()
+        lines = [{'corpus': data['corpus'], 'project': data['project'], 'labels': data['labels']}]
+        lines += [{'document': document} for document in data['documents']]
+        lines += [{'annotation': annotation} for annotation in data['annotations']]
+        upload = SimpleUploadedFile('project.ndjson', ''.join(json.dumps(line) + '\n' for line in lines).encode('utf-8'))
+
+        self.client.force_authenticate(user=su)
+        with mock.patch.object(ProjectImportService, 'DOCUMENT_CHUNK_SIZE', 2):
+            response = self.client.post(url, {'file': upload}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['documents']), 3)
+        first = Annotation.objects.get(id=response.data['annotations']['a-1'])
+        self.assertEqual(sorted(first.documents.values_list('id', flat=True)), sorted(response.data['documents'][0:2]))
+
+    def test_reject_invalid_line(self):
+        """
+        Ensure that an upload with a line that isn't JSON is rejected and nothing is created.
+        """
+        su = UserFactory(is_superuser=True)
+        url = reverse('project_import')
+        data = self.project_data()
+        body = json.dumps({'corpus': data['corpus'], 'project': data['project']}) + '\nnot json\n'
+        upload = SimpleUploadedFile('project.ndjson', body.encode('utf-8'))
+
+        self.client.force_authenticate(user=su)
+        response = self.client.post(url, {'file': upload}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Corpus.objects.count(), 0)
+
+    def test_rollback_on_invalid_label(self):
+        """
+        Ensure that nothing is created if an annotation references an unknown label.
+        """
+        su = UserFactory(is_superuser=True)
+        url = reverse('project_import')
+        data = self.project_data()
+        data['annotations'][1]['labels'] = ['unknown']
+
+        self.client.force_authenticate(user=su)
+        response = self.client.post(url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Project.objects.count(), 0)
+
+    def test_deny_non_superuser(self):
+        """
+        Ensure that only superusers can import projects.
+        """
+        user = UserFactory()
+        url = reverse('project_import')
+
+        self.client.force_authenticate(user=user)
+        response = self.client.post(url, self.project_data(), format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
@@ -0,0 +1,131 @@
+import importlib
+from unittest import mock
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from rest_framework.test import APITestCase
+from dualtext_api.checks import check_search_cache
+from dualtext_api.haystack_connector.pipelines import initialized_pipelines
+from dualtext_api.haystack_connector.query_pipeline import QueryPipeline
+from dualtext_api.haystack_documents import DualtextDocument
+from dualtext_api.services import SearchCacheService, IndexService
+from .factories import CorpusFactory, DocumentFactory
+
+class TestSearchCacheService(APITestCase):
+    def setUp(self):
+        caches['search'].clear()
+        self.pipeline = mock.MagicMock()
+        self.pipeline.run.return_value = {'documents': [{'id': 1, 'score': 0.5}]}
+        query_pipelines = {'cached_query': QueryPipeline('cached_query', self.pipeline)}
+        patches = [
+            mock.patch.dict(initialized_pipelines['query'], query_pipelines),
+            mock.patch.object(DualtextDocument, 'query_pipelines', ['cached_query']),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_repeated_queries(self):
+        """
+        Ensure that repeated queries are answered from the cache, also with different whitespace.
+        """
+        service = SearchCacheService()
+        first = service.search(corpus_id=1, method='cached_query', query='a  query')
+        second = service.search(corpus_id=1, method='cached_query', query=' a query ')
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.pipeline.run.call_count, 1)
+
+    def test_separate_keys(self):
+        """
+        Ensure that different corpora, queries and options are cached separately.
+        """
+        service = SearchCacheService()
+        service.search(corpus_id=1, method='cached_query', query='query')
+        service.search(corpus_id=2, method='cached_query', query='query')
+        service.search(corpus_id=1, method='cached_query', query='other query')
+        service.search(corpus_id=1, method='cached_query', query='query', options={'top_k': 20})
+
+        self.assertEqual(self.pipeline.run.call_count, 4)
+
+    def test_invalidate_on_indexing(self):
+        """
+        Ensure that indexing new documents of a corpus invalidates its cached results only.
+        """
+        corpus = CorpusFactory()
+        other_corpus = CorpusFactory()
+        service = SearchCacheService()
+        service.search(corpus_id=corpus.id, method='cached_query', query='query')
+        service.search(corpus_id=other_corpus.id, method='cached_query', query='query')
+
+        DocumentFactory(corpus=corpus)
+        with mock.patch('dualtext_api.services.index_service.DualtextDocument.save_batch'):
+            IndexService().process_pending()
+
+        service.search(corpus_id=corpus.id, method='cached_query', query='query')
+        service.search(corpus_id=other_corpus.id, method='cached_query', query='query')
+        self.assertEqual(self.pipeline.run.call_count, 3)
+
+    def test_lost_version(self):
+        """
+        Ensure that entries are not reused when the version of a corpus was evicted.
+        """
+        service = SearchCacheService()
+        service.search(corpus_id=1, method='cached_query', query='query')
+        caches['search'].delete(SearchCacheService.VERSION_KEY.format(1))
+        with mock.patch('dualtext_api.services.search_cache_service.time.time', return_value=10 ** 10):
+            service.search(corpus_id=1, method='cached_query', query='query')
+
+        self.assertEqual(self.pipeline.run.call_count, 2)
+
+    def test_search_many(self):
+        """
+        Ensure that a batch search only runs the searches missing from the cache and shares entries with single searches.
+        """
+        self.pipeline.run.side_effect = lambda query, params: {'documents': [{'id': len(query), 'score': 1.0}]}
+        del self.pipeline.run_batch
+        service = SearchCacheService()
+        service.search(corpus_id=1, method='cached_query', query='a')
+
+        results = service.search_many(corpus_id=1, method='cached_query', searches=[('a', None), ('bb', None), ('ccc', {'top_k': 5})])
+        self.assertEqual([result['documents'][0]['id'] for result in results], [1, 2, 3])
+        self.assertEqual(self.pipeline.run.call_count, 3)
+
+        service.search(corpus_id=1, method='cached_query', query='ccc', options={'top_k': 5})
+        self.assertEqual(self.pipeline.run.call_count, 3)
+
+    def test_invalidate_from_other_instance(self):
+        """
+        Ensure that an invalidation through another cache instance, as made by a command or another worker, is seen.
+        """
+        service = SearchCacheService()
+        service.search(corpus_id=1, method='cached_query', query='query')
+
+        other_service = SearchCacheService()
+        other_service.cache = caches.create_connection('search')
+        self.assertIsNot(other_service.cache, service.cache)
+        other_service.invalidate(1)
+        service.search(corpus_id=1, method='cached_query', query='query')
+
+        self.assertEqual(self.pipeline.run.call_count, 2)
+
+    def test_warn_about_local_cache(self):
+        """
+        Ensure that a search cache local to every process is reported by the system checks.
+        """
+        self.assertEqual(check_search_cache(None), [])
+        with self.settings(CACHES={'search': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual([warning.id for warning in check_search_cache(None)], ['dualtext_api.W001'])
+
+    def test_migration_creates_cache_table(self):
+        """
+        Ensure that migrating creates the table of the search cache.
+        """
+        migration = importlib.import_module('dualtext_api.migrations.0038_search_cache_table')
+        table = settings.CACHES['search']['LOCATION']
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE {}'.format(connection.ops.quote_name(table)))
+
+        migration.create_cache_tables(None, mock.Mock(connection=connection))
+
+        self.assertIn(table, connection.introspection.table_names())
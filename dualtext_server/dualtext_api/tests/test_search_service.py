@@ -0,0 +1,321 @@
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+from django.core.cache import caches
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+from dualtext_api.services.search_service import InvalidSearch, SearchService
+from dualtext_api.services.search_cache_service import SearchCacheService
+from dualtext_api.haystack_connector.pipelines import initialized_pipelines
+from dualtext_api.haystack_connector.query_pipeline import QueryPipeline
+from dualtext_api.haystack_connector.indexing_pipeline import IndexingPipeline
+from dualtext_api.haystack_connector.minhash import MinHashIndexingPipeline
+from dualtext_api.haystack_documents import DualtextDocument
+from .factories import CorpusFactory, DocumentFactory, ProjectFactory, TaskFactory, AnnotationFactory
+
+def register_query_pipelines(testcase, **pipelines):
+    """
+    Make the (pipeline, timeout) pipelines available as query pipelines of DualtextDocument during a test.
+    """
+    query_pipelines = {name: QueryPipeline(name, pipeline, timeout=timeout) for name, (pipeline, timeout) in pipelines.items()}
+    patches = [
+        mock.patch.dict(initialized_pipelines['query'], query_pipelines),
+        mock.patch.object(DualtextDocument, 'query_pipelines', list(query_pipelines)),
+    ]
+    for patch in patches:
+        patch.start()
+        testcase.addCleanup(patch.stop)
+
+
+class TestSearchService(APITestCase):
+    def setUp(self):
+        # the searches of the pipeline are replaced by the tests, it only has to be known
+        register_query_pipelines(self, method=(RankingPipeline([]), 5))
+        self.corpus = CorpusFactory()
+        self.documents = [DocumentFactory(corpus=self.corpus) for i in range(4)]
+        self.results = {'documents': [{'id': document.id} for document in reversed(self.documents)]}
+
+    def postprocess(self, project):
+        service = SearchService(corpus_id=self.corpus.id, project_id=project.id)
+        with CaptureQueriesContext(connection) as queries:
+            documents = list(service.postprocess_results(results=self.results, search_method='method'))
+        # silk records its own queries next to the ones of the service
+        return documents, len([q for q in queries if 'silk_' not in q['sql'] and not q['sql'].startswith('EXPLAIN')])
+
+    def test_exclude_annotated_documents(self):
+        """
+        Ensure that documents annotated in the project are removed from the results without changing their order.
+        """
+        project = ProjectFactory(corpora=[self.corpus], annotation_document_duplicates=False)
+        other_project = ProjectFactory(corpora=[self.corpus], annotation_document_duplicates=False)
+        AnnotationFactory(task=TaskFactory(project=project), documents=[self.documents[1]])
+        AnnotationFactory(task=TaskFactory(project=other_project), documents=[self.documents[2]])
+
+        documents, _ = self.postprocess(project)
+
+        self.assertEqual(documents, [self.documents[3], self.documents[2], self.documents[0]])
+        self.assertEqual(documents[0].method, 'method')
+
+    def test_keep_duplicates(self):
+        """
+        Ensure that annotated documents are returned if the project allows annotation duplicates.
+        """
+        project = ProjectFactory(corpora=[self.corpus], annotation_document_duplicates=True)
+        AnnotationFactory(task=TaskFactory(project=project), documents=[self.documents[1]])
+
+        documents, _ = self.postprocess(project)
+
+        self.assertEqual(documents, list(reversed(self.documents)))
+
+    def test_constant_queries(self):
+        """
+        Ensure that the number of queries doesn't grow with the number of annotations in the project.
+        """
+        project = ProjectFactory(corpora=[self.corpus], annotation_document_duplicates=False)
+        task = TaskFactory(project=project)
+        AnnotationFactory(task=task, documents=[self.documents[0]])
+        _, few_annotations = self.postprocess(project)
+
+        for i in range(20):
+            AnnotationFactory(task=task, documents=[DocumentFactory(corpus=self.corpus)])
+        _, many_annotations = self.postprocess(project)
+
+        self.assertEqual(few_annotations, many_annotations)
+        self.assertEqual(many_annotations, 2)
+
+    def ranked_search(self, documents):
+        """
+        A replacement of SearchCacheService.search returning the top_k first of the documents.
+        """
+        def search(corpus_id, method, query, options=None):
+            top_k = (options or {}).get('top_k', len(documents))
+            return {'documents': [{'id': document.id} for document in documents[:top_k]]}
+        return search
+
+    def test_search_page(self):
+        """
+        Ensure that a page of results is requested from the pipeline with top_k and sliced by offset.
+        """
+        ranked = [DocumentFactory(corpus=self.corpus) for i in range(10)]
+        service = SearchService(corpus_id=self.corpus.id)
+        with mock.patch.object(SearchCacheService, 'search', side_effect=self.ranked_search(ranked)) as search:
+            documents = service.search(method='method', query='query', limit=3, offset=2)
+
+        self.assertEqual(documents, ranked[2:5])
+        self.assertEqual(search.call_count, 1)
+        self.assertEqual(search.call_args.kwargs['options'], {'top_k': 5})
+
+    def test_search_overfetch(self):
+        """
+        Ensure that more results are requested when excluded documents would make the page come back short.
+        """
+        ranked = [DocumentFactory(corpus=self.corpus) for i in range(20)]
+        project = ProjectFactory(corpora=[self.corpus], annotation_document_duplicates=False)
+        AnnotationFactory(task=TaskFactory(project=project), documents=ranked[:6])
+        service = SearchService(corpus_id=self.corpus.id, project_id=project.id)
+        with mock.patch.object(SearchCacheService, 'search', side_effect=self.ranked_search(ranked)) as search:
+            documents = service.search(method='method', query='query', limit=5)
+
+        self.assertEqual(documents, ranked[6:11])
+        self.assertGreater(search.call_count, 1)
+
+    def test_search_exhausted(self):
+        """
+        Ensure that a short page is returned without further requests if the pipeline has no more results.
+        """
+        project = ProjectFactory(corpora=[self.corpus], annotation_document_duplicates=False)
+        AnnotationFactory(task=TaskFactory(project=project), documents=[self.documents[0]])
+        service = SearchService(corpus_id=self.corpus.id, project_id=project.id)
+        with mock.patch.object(SearchCacheService, 'search', side_effect=self.ranked_search(self.documents)) as search:
+            documents = service.search(method='method', query='query', limit=10)
+
+        self.assertEqual(documents, self.documents[1:])
+        self.assertEqual(search.call_count, 1)
+
+    def test_search_many(self):
+        """
+        Ensure that a batch search returns a page per search and excludes annotated documents from each of them.
+        """
+        ranked = [DocumentFactory(corpus=self.corpus) for i in range(6)]
+        project = ProjectFactory(corpora=[self.corpus], annotation_document_duplicates=False)
+        AnnotationFactory(task=TaskFactory(project=project), documents=[ranked[0]])
+
+        def search_many(corpus_id, method, searches):
+            return [self.ranked_search(ranked)(corpus_id, method, query, options) for query, options in searches]
+
+        service = SearchService(corpus_id=self.corpus.id, project_id=project.id)
+        with mock.patch.object(SearchCacheService, 'search_many', side_effect=search_many), \
+                mock.patch.object(SearchCacheService, 'search', side_effect=self.ranked_search(ranked)) as search:
+            pages = service.search_many(method='method', searches=[
+                {'query': 'first', 'limit': 2},
+                {'query': 'second', 'limit': 2, 'offset': 3},
+                {'query': 'third'},
+            ])
+
+        self.assertEqual(pages, [ranked[1:3], ranked[4:6], ranked[1:]])
+        self.assertEqual(search.call_count, 2)
+
+
+    def test_collapse_duplicates(self):
+        """
+        Ensure that near duplicates of better ranked results are left out of a page and of later pages of a batch.
+        """
+        text = 'the annotation guidelines describe how every sentence of the corpus should be labelled'
+        ranked = [
+            DocumentFactory(corpus=self.corpus, content=text),
+            DocumentFactory(corpus=self.corpus, content='a text about the weather in the mountains during spring'),
+            DocumentFactory(corpus=self.corpus, content=text + ' carefully'),
+            DocumentFactory(corpus=self.corpus, content='minutes of the meeting of the committee held last monday'),
+        ]
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir)
+        pipeline = MinHashIndexingPipeline('minhash', index_dir=index_dir, threshold=0.6)
+        pipeline.run(documents=[{'id': d.id, 'content': d.content, 'meta': {}} for d in ranked], params={'index': self.corpus.id})
+
+        def search_many(corpus_id, method, searches):
+            return [self.ranked_search(ranked)(corpus_id, method, query, options) for query, options in searches]
+
+        service = SearchService(corpus_id=self.corpus.id, collapse_duplicates=True)
+        with mock.patch.dict(initialized_pipelines['indexing'], {'minhash_index': IndexingPipeline('minhash_index', pipeline)}), \
+                mock.patch.object(DualtextDocument, 'duplicate_pipeline', 'minhash_index'), \
+                mock.patch.object(SearchCacheService, 'search_many', side_effect=search_many), \
+                mock.patch.object(SearchCacheService, 'search', side_effect=self.ranked_search(ranked)):
+            documents = service.search(method='method', query='query')
+            pages = service.search_many(method='method', searches=[{'query': 'first', 'limit': 2}, {'query': 'second'}])
+
+        self.assertEqual(documents, [ranked[0], ranked[1], ranked[3]])
+        self.assertEqual(pages, [ranked[:2], [ranked[3]]])
+
+
+class RankingPipeline:
+    """
+    A query pipeline returning a fixed ranking after waiting for delay seconds or until released.
+    """
+    def __init__(self, ids, delay=0, release=None):
+        self.ids = ids
+        self.delay = delay
+        self.release = release
+        self.calls = 0
+
+    def run(self, query, params):
+        self.calls += 1
+        if self.release is not None:
+            self.release.wait(timeout=5)
+        time.sleep(self.delay)
+        return {'documents': [{'id': document_id, 'score': 1.0} for document_id in self.ids[:params.get('top_k')]]}
+
+
+# the methods of a fused search run in threads with their own database connections, which can't write a database
+# cache table while the test transaction holds the SQLite write lock
+@override_settings(CACHES={'search': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'hybrid'}})
+class TestHybridSearch(APITestCase):
+    def setUp(self):
+        caches['search'].clear()
+        self.corpus = CorpusFactory()
+        self.documents = [DocumentFactory(corpus=self.corpus) for i in range(4)]
+
+    def register(self, **pipelines):
+        register_query_pipelines(self, **pipelines)
+
+    def test_fusion(self):
+        """
+        Ensure that the results of several methods are fused by reciprocal rank and keep the methods that found them.
+        """
+        ids = [document.id for document in self.documents]
+        self.register(
+            first=(RankingPipeline([ids[0], ids[1], ids[2]]), 5),
+            second=(RankingPipeline([ids[1], ids[3], ids[0]]), 5),
+        )
+        service = SearchService(corpus_id=self.corpus.id)
+        documents = service.search(method='first,second', query='query')
+
+        self.assertEqual([document.id for document in documents], [ids[1], ids[0], ids[3], ids[2]])
+        self.assertEqual([document.method for document in documents], ['first,second', 'first,second', 'second', 'first'])
+
+    def test_concurrent_methods(self):
+        """
+        Ensure that the methods run at the same time and that a method exceeding its timeout is left out.
+        """
+        ids = [document.id for document in self.documents]
+        release = threading.Event()
+        self.register(
+            first=(RankingPipeline([ids[0]], delay=0.4), 5),
+            second=(RankingPipeline([ids[1]], delay=0.4), 5),
+            slow=(RankingPipeline([ids[2]], release=release), 0.5),
+        )
+        self.addCleanup(release.set)
+        service = SearchService(corpus_id=self.corpus.id)
+
+        start = time.monotonic()
+        documents = service.search(method='first,second,slow', query='query', limit=3)
+        duration = time.monotonic() - start
+
+        self.assertEqual({document.id for document in documents}, {ids[0], ids[1]})
+        # one after another the methods would take at least 1.3 seconds
+        self.assertLess(duration, 1.0)
+
+    def test_fill_page_within_deadline(self):
+        """
+        Ensure that filling up a page only asks the methods that answered the first request again.
+        """
+        release = threading.Event()
+        self.addCleanup(release.set)
+        missing = [10 ** 6 + i for i in range(2)]
+        ids = [document.id for document in self.documents]
+        slow = RankingPipeline(ids, release=release)
+        self.register(first=(RankingPipeline(missing + ids), 5), slow=(slow, 0.3))
+        service = SearchService(corpus_id=self.corpus.id)
+
+        start = time.monotonic()
+        documents = service.search(method='first,slow', query='query', limit=2)
+        duration = time.monotonic() - start
+
+        self.assertEqual([document.id for document in documents], ids[:2])
+        self.assertEqual(slow.calls, 1)
+        self.assertLess(duration, 0.6)
+
+    def test_all_methods_timed_out(self):
+        """
+        Ensure that a search fails if none of its methods answer in time.
+        """
+        release = threading.Event()
+        self.addCleanup(release.set)
+        self.register(
+            first=(RankingPipeline([self.documents[0].id], release=release), 0.1),
+            second=(RankingPipeline([self.documents[1].id], release=release), 0.1),
+        )
+        service = SearchService(corpus_id=self.corpus.id)
+
+        with self.assertRaises(TimeoutError):
+            service.search(method='first,second', query='query')
+
+    def test_single_method_timed_out(self):
+        """
+        Ensure that a search with a single method is bounded by the timeout of its pipeline.
+        """
+        release = threading.Event()
+        self.addCleanup(release.set)
+        self.register(slow=(RankingPipeline([self.documents[0].id], release=release), 0.2))
+        service = SearchService(corpus_id=self.corpus.id)
+
+        start = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            service.search(method='slow', query='query')
+        with self.assertRaises(TimeoutError):
+            service.search_many(method='slow', searches=[{'query': 'other'}])
+        self.assertLess(time.monotonic() - start, 1.0)
+
+    def test_unknown_method(self):
+        """
+        Ensure that an unknown method is rejected as an invalid search.
+        """
+        self.register(first=(RankingPipeline([self.documents[0].id]), 5))
+        service = SearchService(corpus_id=self.corpus.id)
+
+        for method in ['unknown', 'first,unknown', ' , ']:
+            with self.assertRaises(InvalidSearch):
+                service.search(method=method, query='query')
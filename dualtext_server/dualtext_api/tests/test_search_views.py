@@ -1,10 +1,17 @@
 import yaml
 import os
+import requests
+import threading
+from unittest import mock
 
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
-from .factories import DocumentFactory, UserFactory, TaskFactory, ProjectFactory, AnnotationFactory, CorpusFactory
+from dualtext_api.services import SearchCacheService
+from dualtext_api.haystack_connector.pipelines import initialized_pipelines
+from dualtext_api.haystack_connector.query_pipeline import QueryPipeline
+from dualtext_api.haystack_documents import DualtextDocument
+from .factories import GroupFactory, DocumentFactory, UserFactory, TaskFactory, ProjectFactory, AnnotationFactory, CorpusFactory
 
 
 class TestSearchView(APITestCase):
@@ -25,6 +32,58 @@ class TestSearchView(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data[0]['content'], doc.content)
 
+    def test_pipeline_timeout(self):
+        """
+        Ensure that a query pipeline timing out returns a 504.
+        """
+        su = UserFactory(is_superuser=True)
+        corpus = CorpusFactory()
+        url = reverse('search')
+        query = '?query=different&corpus={}&method=elastic_query'.format(corpus.id)
+
+        self.client.force_authenticate(user=su)
+        with mock.patch('dualtext_api.views.search_views.SearchService.search', side_effect=requests.Timeout('read timed out')):
+            response = self.client.get(url + query, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_504_GATEWAY_TIMEOUT)
+
+    def test_single_method_timeout(self):
+        """
+        Ensure that a single search method not answering within the timeout of its pipeline returns a 504.
+        """
+        su = UserFactory(is_superuser=True)
+        corpus = CorpusFactory()
+        url = reverse('search')
+        query = '?query=different&corpus={}&method=slow'.format(corpus.id)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        pipeline = mock.Mock()
+        pipeline.run.side_effect = lambda query, params: release.wait(timeout=5)
+
+        self.client.force_authenticate(user=su)
+        with mock.patch.dict(initialized_pipelines['query'], {'slow': QueryPipeline('slow', pipeline, timeout=0.1)}), \
+                mock.patch.object(DualtextDocument, 'query_pipelines', ['slow']):
+            response = self.client.get(url + query, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_504_GATEWAY_TIMEOUT)
+
+    def test_invalid_method(self):
+        """
+        Ensure that an unknown search method returns a 400, while other errors of a pipeline are not hidden as one.
+        """
+        su = UserFactory(is_superuser=True)
+        corpus = CorpusFactory()
+        url = reverse('search')
+
+        self.client.force_authenticate(user=su)
+        response = self.client.get(url + '?query=different&corpus={}&method=unknown'.format(corpus.id), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        query = '?query=different&corpus={}&method=elastic_query'.format(corpus.id)
+        with mock.patch('dualtext_api.views.search_views.SearchService.search', side_effect=ValueError('a bug')):
+            with self.assertRaises(ValueError):
+                self.client.get(url + query, format='json')
+
     def test_deny_not_authenticated(self):
         """
         Ensure the search can only be used by authenticated users.
@@ -59,6 +118,20 @@ class TestSearchView(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_invalid_limit(self):
+        """
+        Ensure that limit and offset have to be non-negative integers.
+        """
+        su = UserFactory(is_superuser=True)
+        corpus = CorpusFactory()
+        url = reverse('search')
+
+        self.client.force_authenticate(user=su)
+        for params in ['limit=ten', 'limit=-1', 'limit=10&offset=-5']:
+            query = '?query=document&corpus={}&method=elastic_query&{}'.format(corpus.id, params)
+            response = self.client.get(url + query, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_no_annotation_document_duplicates(self):
         """
         Ensure that a document already assigned to an annotation is not returned if a project
@@ -77,6 +150,63 @@ class TestSearchView(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 0)
 
+class TestSearchBatchView(APITestCase):
+    def search_many(self, corpus_id, method, searches):
+        return [{'documents': [{'id': int(query)}]} for query, options in searches]
+
+    def test_batch_search(self):
+        """
+        Ensure that a batch search returns a list of documents per search in the order of the searches.
+        """
+        group = GroupFactory()
+        user = UserFactory(groups=[group])
+        corpus = CorpusFactory(allowed_groups=[group])
+        documents = [DocumentFactory(corpus=corpus) for i in range(3)]
+        payload = {
+            'corpus': corpus.id,
+            'method': 'elastic_query',
+            'searches': [{'query': str(document.id), 'limit': 1} for document in reversed(documents)]
+        }
+
+        self.client.force_authenticate(user=user)
+        with mock.patch.object(SearchCacheService, 'search_many', side_effect=self.search_many), \
+                mock.patch.dict(initialized_pipelines['query'], {'elastic_query': QueryPipeline('elastic_query')}), \
+                mock.patch.object(DualtextDocument, 'query_pipelines', ['elastic_query']):
+            response = self.client.post(reverse('search_batch'), payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([[document['id'] for document in page] for page in response.data], [[d.id] for d in reversed(documents)])
+
+    def test_deny_non_member(self):
+        """
+        Ensure that a batch search is only possible in corpora of the user's groups.
+        """
+        user = UserFactory()
+        corpus = CorpusFactory()
+        payload = {'corpus': corpus.id, 'method': 'elastic_query', 'searches': [{'query': 'document'}]}
+
+        self.client.force_authenticate(user=user)
+        response = self.client.post(reverse('search_batch'), payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_batch_limit(self):
+        """
+        Ensure that a batch search is limited to SIZE_LIMIT searches with valid limits.
+        """
+        su = UserFactory(is_superuser=True)
+        corpus = CorpusFactory()
+        url = reverse('search_batch')
+
+        self.client.force_authenticate(user=su)
+        too_many = [{'query': 'document'}] * 1001
+        response = self.client.post(url, {'corpus': corpus.id, 'method': 'elastic_query', 'searches': too_many}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        negative = [{'query': 'document', 'limit': -1}]
+        response = self.client.post(url, {'corpus': corpus.id, 'method': 'elastic_query', 'searches': negative}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
 class TestSearchMethodsView(APITestCase):
     def test_view_methods(self):
         """
@@ -0,0 +1,83 @@
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+from dualtext_api.models import Task, Annotation
+from dualtext_api.services import TaskService
+from .factories import CorpusFactory, ProjectFactory, TaskFactory, AnnotationFactory, AnnotationGroupFactory, DocumentFactory
+
+class TestCopyTasks(APITestCase):
+    def setUp(self):
+        self.corpus = CorpusFactory()
+        self.project = ProjectFactory(corpora=[self.corpus])
+
+    def create_task(self, name, annotation_count):
+        task = TaskFactory(project=self.project, name=name)
+        group = AnnotationGroupFactory(task=task)
+        for n in range(annotation_count):
+            AnnotationFactory(task=task, documents=[DocumentFactory(corpus=self.corpus)], annotation_group=group if n < 2 else None)
+        return task
+
+    def copy(self, task_ids):
+        with CaptureQueriesContext(connection) as queries:
+            copies = TaskService().copy_tasks(task_ids)
+        return copies, len([q for q in queries if 'silk_' not in q['sql'] and not q['sql'].startswith('EXPLAIN')])
+
+    def test_copy_task(self):
+        """
+        Ensure that a copy has copies of all annotations with their documents and annotation groups.
+        """
+        task = self.create_task('task', 3)
+
+        review = TaskService().copy_task(task.id)
+
+        self.assertEqual(review.name, 'taskreview0')
+        self.assertEqual(review.copied_from, task)
+        self.assertEqual(review.action, Task.REVIEW)
+        originals = list(task.annotation_set.order_by('id'))
+        copies = list(Annotation.objects.filter(task=review).order_by('id'))
+        self.assertEqual([copy.copied_from for copy in copies], originals)
+        for original, copy in zip(originals, copies):
+            self.assertEqual(list(copy.documents.all()), list(original.documents.all()))
+            self.assertEqual(copy.action, Annotation.REVIEW)
+        self.assertIsNotNone(copies[0].annotation_group)
+        self.assertEqual(copies[0].annotation_group, copies[1].annotation_group)
+        self.assertEqual(copies[0].annotation_group.task, review)
+        self.assertIsNone(copies[2].annotation_group)
+
+        self.assertEqual(TaskService().copy_task(task.id).name, 'taskreview1')
+
+    def test_constant_queries(self):
+        """
+        Ensure that copying many tasks with many annotations takes as many queries as copying a small task.
+        """
+        small = self.create_task('small', 2)
+        large = [self.create_task('large {}'.format(n), 10) for n in range(5)]
+
+        _, small_queries = self.copy([small.id])
+        copies, large_queries = self.copy([task.id for task in large])
+
+        self.assertEqual(small_queries, large_queries)
+        self.assertEqual([copy.copied_from_id for copy in copies], [task.id for task in large])
+        self.assertEqual(Annotation.objects.filter(task__in=copies).count(), 50)
+
+
+class TestGenerateReviews(APITestCase):
+    def test_deferred_reviews(self):
+        """
+        Ensure that with DUALTEXT_DEFER_REVIEWS finishing a task leaves its review to the generatereviews command.
+        """
+        project = ProjectFactory(use_reviews=True)
+        tasks = [TaskFactory(project=project, name='task {}'.format(n)) for n in range(3)]
+
+        with self.settings(DUALTEXT_DEFER_REVIEWS=True):
+            finished = TaskService().finish_tasks([task.id for task in tasks[:2]])
+        self.assertEqual(finished, [tasks[0].id, tasks[1].id])
+        self.assertFalse(Task.objects.filter(action=Task.REVIEW).exists())
+
+        call_command('generatereviews', '--batch-size', '1', stdout=StringIO())
+        call_command('generatereviews', stdout=StringIO())
+
+        reviewed = Task.objects.filter(action=Task.REVIEW).values_list('copied_from_id', flat=True)
+        self.assertEqual(sorted(reviewed), [tasks[0].id, tasks[1].id])
@@ -1,7 +1,7 @@
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
-from dualtext_api.models import Task, Annotation
+from dualtext_api.models import OpenTaskCount, Task, Annotation
 from .factories import CorpusFactory, AnnotationFactory, DocumentFactory
 from .factories import UserFactory, TaskFactory, ProjectFactory, GroupFactory, AnnotationGroupFactory
 
@@ -380,3 +380,186 @@ class TestClaimTaskView(APITestCase):
         response = self.client.patch(url, format='json')
 
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class TestTaskPartitionView(APITestCase):
+    def setUp(self):
+        self.su = UserFactory(is_superuser=True)
+        self.corpus = CorpusFactory()
+        self.project = ProjectFactory(corpora=[self.corpus])
+        self.url = reverse('task_partition', args=[self.project.id])
+
+    def partition(self, data):
+        self.client.force_authenticate(user=self.su)
+        return self.client.post(self.url, data, format='json')
+
+    def test_partition_documents(self):
+        """
+        Ensure that every document list becomes an annotation and the annotations are split into tasks of task_size.
+        """
+        documents = [DocumentFactory(corpus=self.corpus) for i in range(5)]
+        TaskFactory(project=self.project, name='P{}T0'.format(self.project.id))
+
+        response = self.partition({'task_size': 2, 'documents': [[document.id] for document in documents]})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        tasks = [Task.objects.get(id=task_id) for task_id in response.data['tasks']]
+        self.assertEqual([task.name for task in tasks], ['P{}T{}'.format(self.project.id, idx) for idx in range(1, 4)])
+        annotated = [
+            [list(annotation.documents.all()) for annotation in task.annotation_set.order_by('id')] for task in tasks
+        ]
+        self.assertEqual(annotated, [[[documents[0]], [documents[1]]], [[documents[2]], [documents[3]]], [[documents[4]]]])
+        self.assertEqual(OpenTaskCount.objects.get(project=self.project).open_annotation_tasks, 3)
+
+    def test_partition_repeated_documents(self):
+        """
+        Ensure that a document repeated within one list is linked to its annotation once.
+        """
+        document = DocumentFactory(corpus=self.corpus)
+
+        response = self.partition({'task_size': 2, 'documents': [[document.id, document.id]]})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        annotation = Annotation.objects.get(task_id=response.data['tasks'][0])
+        self.assertEqual(list(annotation.documents.all()), [document])
+
+    def test_partition_annotations_keep_groups(self):
+        """
+        Ensure that existing annotations are moved into new tasks without splitting their groups.
+        """
+        pool = TaskFactory(project=self.project, annotator=None)
+        group = AnnotationGroupFactory(task=pool)
+        single = AnnotationFactory(task=pool)
+        grouped = [AnnotationFactory(task=pool, annotation_group=group) for i in range(2)]
+        last = AnnotationFactory(task=pool)
+
+        response = self.partition({
+            'task_size': 2, 'keep_groups': True, 'annotations': [single.id, grouped[0].id, grouped[1].id, last.id]
+        })
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        tasks = response.data['tasks']
+        self.assertEqual(len(tasks), 3)
+        self.assertEqual(Annotation.objects.get(id=single.id).task_id, tasks[0])
+        self.assertEqual(set(Annotation.objects.filter(id__in=[a.id for a in grouped]).values_list('task_id', flat=True)), {tasks[1]})
+        group.refresh_from_db()
+        self.assertEqual(group.task_id, tasks[1])
+        self.assertEqual(Annotation.objects.get(id=last.id).task_id, tasks[2])
+
+    def test_partition_emptied_pool(self):
+        """
+        Ensure that pool tasks left without annotations are deleted and pool tasks with annotations left are kept.
+        """
+        emptied = TaskFactory(project=self.project, name='emptied', annotator=None)
+        kept = TaskFactory(project=self.project, name='kept', annotator=None)
+        moved = [AnnotationFactory(task=emptied), AnnotationFactory(task=kept)]
+        AnnotationFactory(task=kept)
+
+        response = self.partition({'task_size': 2, 'annotations': [annotation.id for annotation in moved]})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(Task.objects.filter(id=emptied.id).exists())
+        self.assertTrue(Task.objects.filter(id=kept.id).exists())
+        self.assertEqual(OpenTaskCount.objects.get(project=self.project).open_annotation_tasks, 2)
+
+    def test_partition_busy_annotations(self):
+        """
+        Ensure that annotations of claimed or finished tasks can't be moved.
+        """
+        claimed = TaskFactory(project=self.project, name='claimed', annotator=UserFactory())
+        finished = TaskFactory(project=self.project, name='finished', annotator=None, is_finished=True)
+        annotations = [AnnotationFactory(task=claimed), AnnotationFactory(task=finished)]
+
+        for annotation in annotations:
+            response = self.partition({'task_size': 2, 'annotations': [annotation.id]})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(Annotation.objects.get(id=annotation.id).task_id, annotation.task_id)
+        self.assertEqual(Task.objects.filter(project=self.project).count(), 2)
+
+    def test_partial_group(self):
+        """
+        Ensure that groups can't be split when they are kept.
+        """
+        pool = TaskFactory(project=self.project, annotator=None)
+        group = AnnotationGroupFactory(task=pool)
+        grouped = [AnnotationFactory(task=pool, annotation_group=group) for i in range(2)]
+
+        response = self.partition({'task_size': 2, 'keep_groups': True, 'annotations': [grouped[0].id]})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Annotation.objects.get(id=grouped[0].id).task_id, pool.id)
+
+    def test_invalid_pool(self):
+        """
+        Ensure that annotations of other projects, documents of other corpora and requests without a pool are rejected.
+        """
+        other_annotation = AnnotationFactory()
+        other_document = DocumentFactory()
+
+        for data in [
+            {'task_size': 2, 'annotations': [other_annotation.id]},
+            {'task_size': 2, 'documents': [[other_document.id]]},
+            {'task_size': 2},
+            {'task_size': 0, 'documents': []},
+        ]:
+            response = self.partition(data)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Task.objects.filter(project=self.project).exists())
+
+    def test_forbidden(self):
+        """
+        Ensure that only superusers can partition tasks.
+        """
+        self.client.force_authenticate(user=UserFactory())
+        response = self.client.post(self.url, {'task_size': 2, 'documents': []}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class TestTaskFinishView(APITestCase):
+    def test_finish(self):
+        """
+        Ensure that the annotator can finish a task and a single review is generated for it.
+        """
+        user = UserFactory()
+        project = ProjectFactory(use_reviews=True)
+        task = TaskFactory(project=project, annotator=user)
+        AnnotationFactory(task=task)
+        url = reverse('task_finish', args=[task.id])
+
+        self.client.force_authenticate(user=user)
+        response = self.client.post(url, format='json')
+        self.client.post(url, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['is_finished'])
+        reviews = Task.objects.filter(copied_from=task, action=Task.REVIEW)
+        self.assertEqual(reviews.count(), 1)
+        self.assertEqual(reviews.first().annotation_set.count(), 1)
+
+    def test_forbidden(self):
+        """
+        Ensure that a task can't be finished by other users.
+        """
+        task = TaskFactory()
+        url = reverse('task_finish', args=[task.id])
+
+        self.client.force_authenticate(user=UserFactory())
+        response = self.client.post(url, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(Task.objects.get(id=task.id).is_finished)
+
+    def test_no_reviews(self):
+        """
+        Ensure that finished tasks of projects without reviews and updates that don't finish a task aren't reviewed.
+        """
+        su = UserFactory(is_superuser=True)
+        task = TaskFactory(project=ProjectFactory(use_reviews=False))
+        other_task = TaskFactory(project=ProjectFactory(use_reviews=True))
+
+        self.client.force_authenticate(user=su)
+        self.client.post(reverse('task_finish', args=[task.id]), format='json')
+        self.client.patch(reverse('task_detail', args=[other_task.id]), {'name': 'renamed'}, format='json')
+
+        self.assertFalse(Task.objects.filter(copied_from__in=[task, other_task]).exists())
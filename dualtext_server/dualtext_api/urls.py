@@ -3,8 +3,9 @@ from rest_framework.authtoken.views import obtain_auth_token
 from .views import LabelListView, ProjectListView, TaskListView, AnnotationListView, AnnotationDetailView
 from .views import CorpusDetailView, DocumentListView, CorpusListView, DocumentDetailView, SearchView
 from .views import CurrentUserView, CurrentUserStatisticsView, ProjectDetailView, TaskDetailView, ProjectStatisticsView
-from .views import ClaimTaskView, SearchMethodsView, DocumentBatchView, GroupListView
-from .views import AnnotationGroupListView, AnnotationGroupDetailView
+from .views import TaskFinishView
+from .views import ClaimTaskView, TaskPartitionView, SearchMethodsView, SearchBatchView, DocumentBatchView, DocumentStreamView, GroupListView
+from .views import AnnotationGroupListView, AnnotationGroupDetailView, ProjectImportView, AnnotationBatchView
 from.views import LogoutView, TokenValidityView
 
 urlpatterns = [
@@ -14,6 +15,7 @@ urlpatterns = [
     path('document/<int:document_id>', DocumentDetailView.as_view(), name='document_detail'),
     path('corpus/<int:corpus_id>/document/', DocumentListView.as_view(), name='document_list'),
     path('corpus/<int:corpus_id>/document/batch/', DocumentBatchView.as_view(), name='document_batch'),
+    path('corpus/<int:corpus_id>/document/stream/', DocumentStreamView.as_view(), name='document_stream'),
     path('corpus/', CorpusListView.as_view(), name='corpus_list'),
     path('group/', GroupListView.as_view(), name='group_list'),
     path('login/', obtain_auth_token, name='api_token_auth'),
@@ -22,15 +24,20 @@ urlpatterns = [
     path('project/<int:project_id>', ProjectDetailView.as_view(), name='project_detail'),
     path('project/<int:project_id>/statistics', ProjectStatisticsView.as_view(), name='project_statistics'),
     path('project/', ProjectListView.as_view(), name='project_list'),
+    path('project/import/', ProjectImportView.as_view(), name='project_import'),
     path('project/<int:project_id>/label', LabelListView.as_view(), name='label_list'),
     path('project/<int:project_id>/task/claim/<str:claim_type>/', ClaimTaskView.as_view(), name='task_claim'),
     path('project/<int:project_id>/task/claim/', ClaimTaskView.as_view(), name='task_claimable'),
+    path('project/<int:project_id>/task/partition/', TaskPartitionView.as_view(), name='task_partition'),
     re_path(r'project/(?P<project_id>[0-9]+)/task/$', TaskListView.as_view(), name='task_list'),
     path('task/<int:task_id>', TaskDetailView.as_view(), name='task_detail'),
+    path('task/<int:task_id>/finish/', TaskFinishView.as_view(), name='task_finish'),
     path('task/<int:task_id>/annotation-group/', AnnotationGroupListView.as_view(), name='annotation_group_list'),
     re_path(r'task/(?P<task_id>[0-9]+)/annotation/$', AnnotationListView.as_view(), name='annotation_list'),
+    path('task/<int:task_id>/annotation/batch/', AnnotationBatchView.as_view(), name='annotation_batch'),
     path('user/current', CurrentUserView.as_view(), name='current_user'),
     path('user/current/statistics', CurrentUserStatisticsView.as_view(), name='current_user_statistics'),
     path('search/methods', SearchMethodsView.as_view(), name='search_methods'),
+    path('search/batch/', SearchBatchView.as_view(), name='search_batch'),
     re_path(r'search/$', SearchView.as_view(), name='search'),
 ]
@@ -4,9 +4,10 @@ from rest_framework import generics, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from dualtext_api.models import Annotation, Task
-from dualtext_api.serializers import AnnotationSerializer, LabelSerializer
+from django.db import transaction
+from dualtext_api.serializers import AnnotationSerializer, LabelSerializer, AnnotationBatchItemSerializer
 from dualtext_api.permissions import AnnotationPermission, AuthenticatedReadAdminCreate
-from dualtext_api.services import ProjectService, RunService
+from dualtext_api.services import ProjectService, RunService, AnnotationService
 from dualtext_api.filters import AnnotationFilter
 
 
@@ -43,6 +44,22 @@ class AnnotationListView(APIView):
             return Response(serialized.data, status=status.HTTP_201_CREATED)
         return Response('You are not permitted to access this resource.', status.HTTP_403_FORBIDDEN)
 
+class AnnotationBatchView(APIView):
+    """
+    Creating a list of annotations in a task with a constant number of queries.
+    """
+    def post(self, request, task_id):
+        permission = AuthenticatedReadAdminCreate
+        if permission().has_permission(request, self):
+            task = get_object_or_404(Task.objects.select_related('project'), id=task_id)
+            serialized = AnnotationBatchItemSerializer(data=request.data, many=True)
+            serialized.is_valid(raise_exception=True)
+            with transaction.atomic():
+                annotations = AnnotationService().create_for_task(task, serialized.validated_data)
+            queryset = Annotation.objects.filter(id__in=[a.id for a in annotations]).order_by('id').prefetch_related('documents', 'labels')
+            return Response(AnnotationSerializer(queryset, many=True).data, status=status.HTTP_201_CREATED)
+        return Response('You are not permitted to access this resource.', status.HTTP_403_FORBIDDEN)
+
 class AnnotationDetailView(generics.RetrieveUpdateAPIView):
     queryset = Annotation.objects.all()
     serializer_class = AnnotationSerializer
@@ -2,6 +2,7 @@ from django.db.models import Count
 from rest_framework import generics
 from dualtext_api.models import Corpus
 from dualtext_api.serializers import CorpusSerializer
+from dualtext_api.services import CorpusService
 from dualtext_api.permissions import MembersReadAdminEdit, AuthenticatedReadAdminCreate
 
 class CorpusListView(generics.ListCreateAPIView):
@@ -10,14 +11,18 @@ class CorpusListView(generics.ListCreateAPIView):
 
     def get_queryset(self):
         user = self.request.user
-        queryset = Corpus.objects.annotate(Count('document')).all().prefetch_related('allowed_groups')
+        queryset = Corpus.objects.filter(is_deleted=False).annotate(Count('document')).prefetch_related('allowed_groups')
         if not user.is_superuser:
             user_groups = user.groups.all()
             queryset = queryset.filter(allowed_groups__in=user_groups)
         return queryset
 
 class CorpusDetailView(generics.RetrieveDestroyAPIView):
-    queryset = Corpus.objects.annotate(Count('document')).all()
+    queryset = Corpus.objects.filter(is_deleted=False).annotate(Count('document'))
     serializer_class = CorpusSerializer
     permission_classes = [MembersReadAdminEdit]
     lookup_url_kwarg = 'corpus_id'
+
+    def perform_destroy(self, instance):
+        # documents, annotation links and index entries are removed in batches by the purgecorpora command
+        CorpusService().mark_deleted(instance)
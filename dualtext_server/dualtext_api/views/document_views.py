@@ -1,35 +1,51 @@
+import gzip
+import json
+from django.db import transaction
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from rest_framework import generics, status
+from rest_framework import generics, status, serializers
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from dualtext_api.models import Corpus, Document
-from dualtext_api.serializers import DocumentSerializer
+from dualtext_api.serializers import DocumentSerializer, DocumentListSerializer
 from dualtext_api.permissions import DocumentPermission, AuthenticatedReadAdminCreate, MembersReadAdminEdit
 
 class DocumentListView(generics.ListCreateAPIView):
     """
     Retrieving a list of documents in a corpus or creating new documents.
+    The on_duplicate query parameter decides how a document already present in the corpus is handled (allow, error, skip or update).
     """
     queryset = Document.objects.all()
     serializer_class = DocumentSerializer
     permission_classes = [AuthenticatedReadAdminCreate]
 
     def get_queryset(self):
-        queryset = Document.objects.filter(corpus=self.kwargs['corpus_id'])
+        queryset = Document.objects.filter(corpus=self.kwargs['corpus_id'], corpus__is_deleted=False)
         user = self.request.user
         if not user.is_superuser:
             queryset = queryset.filter(corpus__allowed_groups__in=user.groups.all())
         return queryset
 
+    def create(self, request, *args, **kwargs):
+        if request.query_params.get('on_duplicate', DocumentListSerializer.ALLOW) not in DocumentListSerializer.ON_DUPLICATE_CHOICES:
+            return Response('on_duplicate must be one of {}'.format(', '.join(DocumentListSerializer.ON_DUPLICATE_CHOICES)), status=status.HTTP_400_BAD_REQUEST)
+        return super().create(request, *args, **kwargs)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['on_duplicate'] = self.request.query_params.get('on_duplicate', DocumentListSerializer.ALLOW)
+        return context
+
     def perform_create(self, serializer):
-        corpus = get_object_or_404(Corpus, id=self.kwargs['corpus_id'])
-        serializer.save(corpus=corpus)
+        corpus = get_object_or_404(Corpus, id=self.kwargs['corpus_id'], is_deleted=False)
+        with transaction.atomic():
+            serializer.save(corpus=corpus)
 
 class DocumentDetailView(generics.RetrieveAPIView):
     """
     Retrieving a single document.
     """
-    queryset = Document.objects.all()
+    queryset = Document.objects.filter(corpus__is_deleted=False)
     serializer_class = DocumentSerializer
     permission_classes = [DocumentPermission]
     lookup_url_kwarg = 'document_id'
@@ -37,6 +53,7 @@ class DocumentDetailView(generics.RetrieveAPIView):
 class DocumentBatchView(APIView):
     """
     Creating up to 200 documents in a single batch.
+    The on_duplicate query parameter decides how documents already present in the corpus are handled (allow, error, skip or update).
     """
     SIZE_LIMIT = 200
     def post(self, request, corpus_id):
@@ -44,12 +61,94 @@ class DocumentBatchView(APIView):
         permission = MembersReadAdminEdit()
         if permission.has_permission(request, self):
             data = request.data
+            on_duplicate = request.query_params.get('on_duplicate', DocumentListSerializer.ALLOW)
+            if on_duplicate not in DocumentListSerializer.ON_DUPLICATE_CHOICES:
+                return Response('on_duplicate must be one of {}'.format(', '.join(DocumentListSerializer.ON_DUPLICATE_CHOICES)), status=status.HTTP_400_BAD_REQUEST)
             if len(data) <= self.SIZE_LIMIT:
-                corpus = get_object_or_404(Corpus, id=corpus_id)
-                serialized = serializer(data=request.data, many=True)
+                corpus = get_object_or_404(Corpus, id=corpus_id, is_deleted=False)
+                serialized = serializer(data=request.data, many=True, context={'on_duplicate': on_duplicate})
                 serialized.is_valid(raise_exception=True)
                 serialized.save(corpus=corpus)
                 return Response(serialized.data, status=status.HTTP_201_CREATED)
             return Response('Batch creation is limited to {} documents'.format(self.SIZE_LIMIT), status=status.HTTP_400_BAD_REQUEST)
         return Response('You are not permitted to access this resource.', status=status.HTTP_403_FORBIDDEN)
-    
+
+class DocumentStreamView(APIView):
+    """
+    Creating an unlimited number of documents from a (gzipped) NDJSON request body.
+    The body is parsed line by line and documents are inserted in chunks, each chunk in its own transaction.
+    The response streams back one JSON object per input record, either {line, id} or {line, errors}.
+    Documents already present in the corpus are handled according to the on_duplicate query parameter (allow, error, skip or update).
+    """
+    CHUNK_SIZE = 500
+    MAX_CHUNK_SIZE = 5000
+
+    def post(self, request, corpus_id):
+        permission = MembersReadAdminEdit()
+        if not permission.has_permission(request, self):
+            return Response('You are not permitted to access this resource.', status=status.HTTP_403_FORBIDDEN)
+
+        corpus = get_object_or_404(Corpus, id=corpus_id, is_deleted=False)
+        try:
+            chunk_size = int(request.query_params.get('chunk_size', self.CHUNK_SIZE))
+        except ValueError:
+            return Response('chunk_size must be an integer', status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < chunk_size <= self.MAX_CHUNK_SIZE:
+            return Response('chunk_size must be between 1 and {}'.format(self.MAX_CHUNK_SIZE), status=status.HTTP_400_BAD_REQUEST)
+        on_duplicate = request.query_params.get('on_duplicate', DocumentListSerializer.ALLOW)
+        if on_duplicate not in DocumentListSerializer.ON_DUPLICATE_CHOICES:
+            return Response('on_duplicate must be one of {}'.format(', '.join(DocumentListSerializer.ON_DUPLICATE_CHOICES)), status=status.HTTP_400_BAD_REQUEST)
+
+        stream = request.stream
+        if stream is None:
+            return Response('The request body is empty', status=status.HTTP_400_BAD_REQUEST)
+
+        content_encoding = request.META.get('HTTP_CONTENT_ENCODING', '')
+        if content_encoding == 'gzip' or request.content_type == 'application/gzip':
+            stream = gzip.GzipFile(fileobj=stream, mode='rb')
+
+        response = StreamingHttpResponse(self.create_documents(stream, corpus, chunk_size, on_duplicate), content_type='application/x-ndjson')
+        return response
+
+    def create_documents(self, stream, corpus, chunk_size, on_duplicate):
+        chunk = []
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                yield self.format_result(line_number, errors='Invalid JSON')
+                continue
+
+            serialized = DocumentSerializer(data=item)
+            if not serialized.is_valid():
+                yield self.format_result(line_number, errors=serialized.errors)
+                continue
+
+            chunk.append((line_number, serialized.validated_data))
+            if len(chunk) >= chunk_size:
+                yield from self.save_chunk(chunk, corpus, on_duplicate)
+                chunk = []
+
+        if chunk:
+            yield from self.save_chunk(chunk, corpus, on_duplicate)
+
+    def save_chunk(self, chunk, corpus, on_duplicate):
+        validated_data = [{**data, 'corpus': corpus} for line_number, data in chunk]
+        list_serializer = DocumentSerializer(many=True, context={'on_duplicate': on_duplicate})
+        try:
+            with transaction.atomic():
+                documents = list_serializer.create(validated_data)
+        except serializers.ValidationError as e:
+            # report the rejected duplicates and save the rest of the chunk
+            results = [self.format_result(line_number, errors=errors) for (line_number, data), errors in zip(chunk, e.detail) if errors]
+            remaining = [item for item, errors in zip(chunk, e.detail) if not errors]
+            if remaining:
+                results.extend(self.save_chunk(remaining, corpus, on_duplicate))
+            return results
+        # create returns one document per item of validated_data, in the same order
+        return [self.format_result(line_number, id=document.id) for (line_number, data), document in zip(chunk, documents)]
+
+    def format_result(self, line_number, **kwargs):
+        return json.dumps({'line': line_number, **kwargs}) + '\n'
@@ -1,11 +1,13 @@
+import gzip
+import json
 from django.shortcuts import get_object_or_404
-from rest_framework import generics, status
+from rest_framework import generics, serializers, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from dualtext_api.models import Project
 from dualtext_api.serializers import ProjectSerializer
 from dualtext_api.permissions import MembersReadAdminEdit, AuthenticatedReadAdminCreate
-from dualtext_api.services import ProjectService
+from dualtext_api.services import ProjectService, ProjectImportService
 
 class ProjectListView(generics.ListCreateAPIView):
     serializer_class = ProjectSerializer
@@ -38,3 +40,51 @@ class ProjectStatisticsView(APIView):
             statistics = ps.get_project_statistics()
             return Response(statistics)
         return Response('not permitted', status=status.HTTP_403_FORBIDDEN)
+
+class ProjectImportView(APIView):
+    """
+    Creating a project with its corpus, documents, labels, tasks, annotation groups and annotations in one request.
+    The project data follows the client's project_from_scratch schema and is sent either as the JSON body
+    or as an uploaded (optionally gzipped) NDJSON file in the file field. Annotations are split into tasks of task_size.
+    Each line of the file is an object of sections, e.g. {"corpus": {...}, "project": {...}} followed by one line per
+    {"document": {...}}, {"annotation": {...}} or {"annotation_group": {...}}. The documents have to follow the corpus.
+    A file holding the whole project object on a single line is read as well.
+    """
+    DEFAULT_TASK_SIZE = 20
+
+    def post(self, request):
+        permission = AuthenticatedReadAdminCreate()
+        if not permission.has_permission(request, self):
+            return Response('You are not permitted to access this resource.', status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            task_size = int(request.query_params.get('task_size', self.DEFAULT_TASK_SIZE))
+        except ValueError:
+            return Response('task_size must be an integer', status=status.HTTP_400_BAD_REQUEST)
+        if task_size < 1:
+            return Response('task_size must be a positive integer', status=status.HTTP_400_BAD_REQUEST)
+
+        import_service = ProjectImportService(request.user, task_size=task_size)
+        upload = request.FILES.get('file', None)
+        if upload is not None:
+            is_gzipped = upload.read(2) == b'\x1f\x8b'
+            upload.seek(0)
+            stream = gzip.GzipFile(fileobj=upload, mode='rb') if is_gzipped else upload
+            result = import_service.run_records(self.read_records(stream, import_service))
+        else:
+            if not isinstance(request.data, dict):
+                return Response('Project data must be a JSON object', status=status.HTTP_400_BAD_REQUEST)
+            result = import_service.run(request.data)
+        return Response(result, status=status.HTTP_201_CREATED)
+
+    def read_records(self, stream, import_service):
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                raise serializers.ValidationError('Line {} of the uploaded file is not valid JSON'.format(line_number))
+            if not isinstance(item, dict):
+                raise serializers.ValidationError('Line {} of the uploaded file is not a JSON object'.format(line_number))
+            yield from import_service.records(item)
@@ -1,12 +1,14 @@
+import requests
+from django.shortcuts import get_object_or_404
 from rest_framework import status
 from rest_framework.response import Response
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from dualtext_api.models import Corpus, Document
-from dualtext_api.serializers import DocumentSerializer
+from dualtext_api.serializers import DocumentSerializer, SearchBatchSerializer
 from dualtext_api.permissions import AuthenticatedReadAdminCreate
-from dualtext_api.haystack_documents import DualtextDocument
 from dualtext_api.haystack_connector.pipelines import initialized_pipelines
-from dualtext_api.services.search_service import SearchService
+from dualtext_api.services.search_service import InvalidSearch, SearchService
 
 
 class SearchView(APIView):
@@ -21,20 +23,33 @@ class SearchView(APIView):
         method = query_params.get('method', None)
         query = query_params.get('query', None)
         project = query_params.get('project', None)
+        collapse_duplicates = query_params.get('collapse_duplicates', 'false').lower() in ('1', 'true')
+        try:
+            limit = self.get_non_negative_int(query_params, 'limit')
+            offset = self.get_non_negative_int(query_params, 'offset') or 0
+        except ValueError:
+            return Response('limit and offset have to be non-negative integers.', status.HTTP_400_BAD_REQUEST)
 
         if corpus and method and query:
             user_groups = request.user.groups.values_list('id', flat=True)
             corpus_id = int(corpus)
-            corpus = Corpus.objects.get(id=corpus_id)
+            corpus = get_object_or_404(Corpus, id=corpus_id, is_deleted=False)
             corpus_allowed_groups = corpus.allowed_groups.values_list('id', flat=True)
 
             if set(user_groups).isdisjoint(set(corpus_allowed_groups)) and not request.user.is_superuser:
                 return Response('You are not permitted to access this resource.', status=status.HTTP_403_FORBIDDEN)
 
-            query_set = DualtextDocument.query_pipeline(pipeline_name=method)
-            results = query_set.query(query).set_options(index=corpus_id).run()
-            search_service = SearchService(corpus_id=corpus_id, project_id=int(project) if project else None)
-            results = search_service.postprocess_results(results=results, search_method=method)
+            search_service = SearchService(
+                corpus_id=corpus_id,
+                project_id=int(project) if project else None,
+                collapse_duplicates=collapse_duplicates
+            )
+            try:
+                results = search_service.search(method=method, query=query, limit=limit, offset=offset)
+            except InvalidSearch as e:
+                return Response(str(e), status.HTTP_400_BAD_REQUEST)
+            except (TimeoutError, requests.Timeout) as e:
+                return Response(str(e), status.HTTP_504_GATEWAY_TIMEOUT)
             results = DocumentSerializer(results, many=True)
             results = results.data
 
@@ -42,6 +57,52 @@ class SearchView(APIView):
         else:
             return Response('Missing search parameters', status.HTTP_400_BAD_REQUEST)
 
+    @staticmethod
+    def get_non_negative_int(query_params, name):
+        value = query_params.get(name, None)
+        if value is None:
+            return None
+        value = int(value)
+        if value < 0:
+            raise ValueError(f'{name} has to be non-negative.')
+        return value
+
+
+class SearchBatchView(APIView):
+    """
+    Running up to 1000 searches in one corpus with a single request.
+    The searches are sent to the query pipeline in one batch and the response holds a list of documents per search.
+    """
+    SIZE_LIMIT = 1000
+    permission = IsAuthenticated()
+
+    def post(self, request):
+        if not self.permission.has_permission(request, self):
+            return Response('You need to be logged in.', status.HTTP_401_UNAUTHORIZED)
+
+        serialized = SearchBatchSerializer(data=request.data)
+        serialized.is_valid(raise_exception=True)
+        data = serialized.validated_data
+        if len(data['searches']) > self.SIZE_LIMIT:
+            return Response('Batch search is limited to {} searches'.format(self.SIZE_LIMIT), status=status.HTTP_400_BAD_REQUEST)
+
+        corpus = get_object_or_404(Corpus, id=data['corpus'], is_deleted=False)
+        user_groups = request.user.groups.values_list('id', flat=True)
+        corpus_allowed_groups = corpus.allowed_groups.values_list('id', flat=True)
+        if set(user_groups).isdisjoint(set(corpus_allowed_groups)) and not request.user.is_superuser:
+            return Response('You are not permitted to access this resource.', status=status.HTTP_403_FORBIDDEN)
+
+        search_service = SearchService(
+            corpus_id=corpus.id, project_id=data['project'], collapse_duplicates=data['collapse_duplicates']
+        )
+        try:
+            pages = search_service.search_many(method=data['method'], searches=data['searches'])
+        except InvalidSearch as e:
+            return Response(str(e), status.HTTP_400_BAD_REQUEST)
+        except (TimeoutError, requests.Timeout) as e:
+            return Response(str(e), status.HTTP_504_GATEWAY_TIMEOUT)
+        return Response([DocumentSerializer(documents, many=True).data for documents in pages])
+
 
 class SearchMethodsView(APIView):
     permission = AuthenticatedReadAdminCreate()
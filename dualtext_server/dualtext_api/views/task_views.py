@@ -1,12 +1,13 @@
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from django.db.models import Q
 from rest_framework import generics, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from dualtext_api.models import Task, Project
-from dualtext_api.serializers import TaskSerializer
+from dualtext_api.serializers import TaskSerializer, TaskPartitionSerializer
 from dualtext_api.permissions import TaskPermission, AuthenticatedReadAdminCreate, MembersReadAdminEdit, MembersEdit
-from dualtext_api.services import ProjectService
+from dualtext_api.services import ProjectService, TaskCountService, TaskPartitionService, TaskService
 from dualtext_api.filters import TaskFilter
 from django_filters.rest_framework import DjangoFilterBackend
 
@@ -46,21 +47,40 @@ class TaskDetailView(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [TaskPermission]
     lookup_url_kwarg = 'task_id'
 
+    def perform_update(self, serializer):
+        # finishing a task with an update generates its review like the finish action
+        finishing = serializer.validated_data.get('is_finished', False) and not serializer.instance.is_finished
+        with transaction.atomic():
+            task = serializer.save()
+            if finishing:
+                TaskService().on_finished([task.id])
+
+
+class TaskFinishView(APIView):
+    """
+    Finishing a task. Finished tasks get a review if their project uses reviews.
+    """
+    def post(self, request, task_id):
+        task = get_object_or_404(Task, id=task_id)
+        permission = TaskPermission()
+        if not permission.has_object_permission(request, self, task):
+            return Response('You are not permitted to access this resource.', status=status.HTTP_403_FORBIDDEN)
+
+        TaskService().finish_tasks([task.id])
+        task.refresh_from_db()
+        return Response(TaskSerializer(task).data)
+
 class ClaimTaskView(APIView):
     """
     Claiming an unclaimed task.
     """
     def get(self, request, project_id):
         out = {}
-        project = get_object_or_404(Project, id=project_id)
+        project = get_object_or_404(Project.objects.select_related('open_task_count'), id=project_id)
         permission = MembersReadAdminEdit()
 
         if permission.has_object_permission(request, self, project):
-            ps = ProjectService(project_id)
-            open_annotation_tasks = ps.get_open_annotation_tasks(request.user).count()
-            open_review_tasks = ps.get_open_review_tasks(request.user).count()
-            out['open_reviews'] = open_review_tasks
-            out['open_annotations'] = open_annotation_tasks
+            out.update(TaskCountService().open_task_counts(project, request.user))
             return Response(out)
         return Response('You are not permitted to access this resource.', status=status.HTTP_403_FORBIDDEN)
 
@@ -81,4 +101,32 @@ class ClaimTaskView(APIView):
                 return Response(serializer(task).data)
             else:
                 return Response('There is no task to claim', status=status.HTTP_409_CONFLICT)
-        return Response('You are not permitted to access this resource', status=status.HTTP_403_FORBIDDEN)
\ No newline at end of file
+        return Response('You are not permitted to access this resource', status=status.HTTP_403_FORBIDDEN)
+
+
+class TaskPartitionView(APIView):
+    """
+    Splitting a pool of annotations or candidate documents of a project into new tasks of task_size.
+    Existing annotations are moved into the tasks, documents get an annotation each.
+    """
+    SIZE_LIMIT = 200000
+
+    def post(self, request, project_id):
+        permission = AuthenticatedReadAdminCreate()
+        if not permission.has_permission(request, self):
+            return Response('You are not permitted to access this resource.', status=status.HTTP_403_FORBIDDEN)
+
+        project = get_object_or_404(Project, id=project_id)
+        serialized = TaskPartitionSerializer(data=request.data)
+        serialized.is_valid(raise_exception=True)
+        data = serialized.validated_data
+        if len(data.get('annotations', data.get('documents'))) > self.SIZE_LIMIT:
+            return Response('Partitioning is limited to {} annotations'.format(self.SIZE_LIMIT), status=status.HTTP_400_BAD_REQUEST)
+
+        partition_service = TaskPartitionService(project, task_size=data['task_size'])
+        with transaction.atomic():
+            if 'annotations' in data:
+                tasks = partition_service.partition_annotations(data['annotations'], keep_groups=data['keep_groups'])
+            else:
+                tasks = partition_service.partition_documents(data['documents'])
+        return Response({'tasks': [task.id for task in tasks]}, status=status.HTTP_201_CREATED)